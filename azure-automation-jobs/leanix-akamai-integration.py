@@ -56,7 +56,7 @@ akamai_api = AkamaiAPI(akamai_client_token, akamai_client_secret, akamai_access_
 # Load all existing websites #
 ##############################
 # Representation is the Factsheet name I use, with Subtype (category): website.
-existing_websites = leanix_api.get_all("Representation", "website")
+existing_websites = leanix_api.get_all("Representation", "website", fields=[])
 
 existing_website_map = {}
 for site in existing_websites:
@@ -145,8 +145,11 @@ def create_website(cpcode, hostname, parent_fs=None, isGrouping=False, summary=N
         #"{\"externalId\":\"" + str(externalId) + "\", \"externalUrl\":\"" + str(externalUrl) + "\", \"status\":\"\"}"
         externalStr = json.dumps(externalObj)            
 
-        site_fs_id = leanix_api.create_factsheet("Representation", hostname, "website")
-        leanix_api.add_tag_to_factsheet(site_fs_id, TAG_AKAMAI)
+        # buffer all writes for this website, such that it is created with a single mutation
+        buffer = leanix_api.write_buffer()
+
+        site_fs_id = buffer.create_factsheet("Representation", hostname, "website")
+        buffer.add_tag_to_factsheet(site_fs_id, TAG_AKAMAI)
 
         patches= [
             {
@@ -186,12 +189,14 @@ def create_website(cpcode, hostname, parent_fs=None, isGrouping=False, summary=N
                 }])
 
 
-        leanix_api.modify_factsheet(site_fs_id, patches=patches)
+        buffer.modify_factsheet(site_fs_id, patches=patches)
 
         if parent_fs is not None:
-            leanix_api.create_relation_if_not_exists(site_fs_id, parent_fs, "Representation", "relToParent")
+            buffer.create_relation_if_not_exists(site_fs_id, parent_fs, "Representation", "relToParent")
         
-        leanix_api.create_relation_if_not_exists(site_fs_id, AKAMAI_COMPONENT, "Representation", "relToRequires")
+        buffer.create_relation_if_not_exists(site_fs_id, AKAMAI_COMPONENT, "Representation", "relToRequires")
+
+        site_fs_id = buffer.resolve(site_fs_id)
 
     else:
         site_fs_id = [k for k, v in existing_website_map.items() if v == hostname.upper()][0]
@@ -76,13 +76,16 @@ processes = leanix_api.get_all("BusinessContext", "process", returnAsRaw=True)
 
 import pprint
 
+# retrieve the existing resources of all processes in batches, instead of one request per process
+all_resources = leanix_api.get_resources_for_factsheets([process['node']['id'] for process in processes['data']['allFactSheets']['edges']])
+
 for process in processes['data']['allFactSheets']['edges']:    
     node = process['node']
     fs_id = node['id']
     process_name = node['name']
 
     # check if SVG already exists on factsheet
-    resources = leanix_api.get_resources_for_factsheet(fs_id)
+    resources = all_resources.get(fs_id) or []
 
     # if so, delete all existing resources
     for document in resources:
@@ -72,8 +72,18 @@ linked = leanix_api.get_discovery_linked_apps(ZSCALER_DISCOVERY)
 utilization = leanix_api.get_discovery_utilization("Zscaler", linked)
 
 
+# retrieve name and status of all linked factsheets in batches, instead of one request per factsheet
+factsheets = leanix_api.get_factsheets_by_ids(list(utilization.keys()))
+
 for factsheetId in utilization:
     patches = []
+
+    factsheet = factsheets.get(factsheetId)
+    name = factsheet['name'] if factsheet is not None else factsheetId
+
+    if factsheet is None or factsheet['status'] == "ARCHIVED":
+        print(f"Ignoring {name} as this factsheet is archived or does not exist")
+        continue
     
     if 'usersCount' in utilization[factsheetId]:
         metric_value = utilization[factsheetId]['usersCount']
@@ -111,14 +121,14 @@ for factsheetId in utilization:
         try:
             leanix_api.modify_factsheet(factsheetId, patches)
         except Exception as e:
-            print(f"Error updating {utilization[factsheetId]['name']}: {e}")
+            print(f"Error updating {name}: {e}")
             if "Updating an archived" in str(e):
                 print("Ignoring as this was an archived factsheet")
                 pass
 
     
-        print(f"Done for {utilization[factsheetId]['name']}")
+        print(f"Done for {name}")
     else:
-        print(f"No data for {utilization[factsheetId]['name']}")
+        print(f"No data for {name}")
 
 
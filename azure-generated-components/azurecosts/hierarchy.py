@@ -0,0 +1,471 @@
+import json
+import threading
+
+from azurecosts.azuregraph import Azuregraph
+
+
+REL_TO_APPLICATION = "relITComponentToApplication"
+REL_TO_SUBCOMPONENT = "relParentalComponentITComponentToSubcomponentITComponent"
+REL_TO_PARENT = "relSubcomponentITComponentToParentalComponentITComponent"
+
+# (custom) IT Component fields set on VM components
+VM_ATTRIBUTES = [
+    "osType", "osFullname", "osVersion", "privateIP", "resourceGroup", "azureSubscriptionId", "instanceType",
+    "cpuCount", "ramAllocated", "diskOSSize", "diskResourceSize", "resourceLocation"
+]
+
+
+class _Run:
+    """Write buffer and counters of a single apply()."""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.created = 0
+        self.updated = 0
+        self.archived = 0
+
+
+class AzureHierarchySync:
+    """
+    Keeps the Azure IT Components of Applications in LeanIX in line with Azure, writing only the differences:
+
+    Application
+    └── Azure Hosting - <apm id>                (cost: total of the resource groups)
+        └── <Environment> (<resource group>)    (cost: total of its services)
+            ├── <service>                       (shared component of the Microsoft provider, cost on the relation)
+            └── VM <name>                       (VM attributes)
+
+    The Azure-tagged IT Components are loaded once (see load()). apply() compares the desired structure of an
+    Application with them and queues creates, cost/attribute patches and relation removals in a write buffer.
+    Resource groups and VMs no longer in Azure are archived, shared service components only lose their relation.
+
+    Usage:
+
+    sync = AzureHierarchySync(leanix_api, AZURE_TAG, azureProviderId)
+    sync.apply(app_id, apm_id, az.get_costs_by_apm_id(apm_id))
+    """
+
+    def __init__(self, leanix_api, tag, provider_id, threshold=50):
+        self.leanix_api = leanix_api
+        self.tag = tag
+        self.provider_id = provider_id
+        self.threshold = threshold
+
+        self._components = None # id -> Azure-tagged IT Component, with its relations
+        self._by_name = None    # lowercase name -> Azure-tagged IT Component
+        self._services = {}     # lowercase service name -> IT Component ID
+        self._resource_groups = {} # lowercase resource group name -> ID of the IT Component created in this run
+        self._lock = threading.RLock()
+
+        self.created = 0
+        self.updated = 0
+        self.archived = 0
+
+    def load(self, refresh=False):
+        """Loads all Azure-tagged IT Components with their application and subcomponent relations, in one query."""
+        with self._lock:
+            if self._components is not None and not refresh:
+                return
+
+            components = self.leanix_api.get_components_with_relations(
+                tagFilter=[self.tag], relations=[REL_TO_APPLICATION, REL_TO_SUBCOMPONENT], attributes=VM_ATTRIBUTES
+            )
+
+            self._by_name = {component['name'].lower(): component for component in components}
+            self._components = {component['id']: component for component in components}
+
+    @staticmethod
+    def _size(value, divisor=1):
+        """Non-negative integer of a (possibly missing or non-numeric) size."""
+        try:
+            return max(int(float(value) / divisor), 0)
+        except (TypeError, ValueError):
+            return 0
+
+    @classmethod
+    def vm_attributes(cls, vm):
+        """Values of the VM_ATTRIBUTES for a VM of Azuregraph.get_resource_graph()."""
+        return {
+            "osType": vm['os_type'],
+            "osFullname": vm['os'],
+            "osVersion": vm['os_version'],
+            "privateIP": ", ".join(vm['privateIPAddresses']),
+            "resourceGroup": vm['resourceGroup'],
+            "azureSubscriptionId": vm['service_id'],
+            "instanceType": vm['vmSize'],
+            "cpuCount": vm.get('numberOfCores'),
+            "ramAllocated": cls._size(vm.get('memoryInMB'), 1024),
+            "diskOSSize": cls._size(vm.get('osDiskSizeInGB')),
+            "diskResourceSize": cls._size(vm.get('diskSizeGB')),
+            "resourceLocation": vm['location'],
+        }
+
+    def desired(self, apm_id, azureResult):
+        """
+        Builds the desired structure from the result of Azuregraph.get_costs_by_apm_id():
+        {'name', 'cost', 'resource_groups': {name: {'cost', 'services': {name: {'cost', 'location'}}, 'vms': {name: attributes}}}}
+        """
+        resource_groups = {}
+
+        for rgName, resources in azureResult.items():
+            rg = resource_groups.setdefault(rgName, {'cost': 0, 'services': {}, 'vms': {}})
+
+            for resource in resources:
+                # a service may be billed in multiple locations/subscriptions of the same resource group
+                service = rg['services'].setdefault(resource['service'], {'cost': 0, 'location': resource['resource_location']})
+                service['cost'] += resource['cost_yearly_eur']
+                rg['cost'] += resource['cost_yearly_eur']
+
+                for vm in resource.get('vms', []):
+                    rg['vms']["VM " + vm['resourceId'].split("/")[-1]] = self.vm_attributes(vm)
+
+        return {
+            'name': "Azure Hosting - " + apm_id,
+            'cost': sum(rg['cost'] for rg in resource_groups.values()),
+            'resource_groups': resource_groups
+        }
+
+    def _tag_patch(self):
+        return {
+            "op": "add",
+            "path": "/tags",
+            "value": '[{"tagId":"' + self.tag + '"}]'
+        }
+
+    def _relation_value(self, factsheet_id, cost=None, **fields):
+        value = {"factSheetId": factsheet_id}
+
+        if cost is not None:
+            value["costTotalAnnual"] = int(cost)
+
+        value.update(fields)
+
+        return json.dumps(value)
+
+    def _cost_changed(self, relation, cost):
+        return int(relation['costTotalAnnual'] or 0) != int(cost)
+
+    def _children(self, component_id):
+        component = self._components.get(component_id)
+
+        if component is None:
+            return {}
+
+        return {child['name'].lower(): child for child in component[REL_TO_SUBCOMPONENT]}
+
+    def desired_from_rollup(self, rollup, key, apm_id, inventory=None):
+        """
+        Builds the desired structure (see desired()) from a CostRollup, with the VMs from Azuregraph.get_vm_inventory().
+        key is the application's ApplicationId tag value in the rollup and inventory.
+        """
+        resource_groups = {}
+
+        for resource_group, cost in rollup.resource_groups(key).items():
+            rg = {'cost': cost, 'services': {}, 'vms': {}}
+
+            for service, costs in rollup.services(key, resource_group).items():
+                if service == "Virtual Machines Licenses" and costs['cost'] == 0:
+                    continue
+
+                rg['services'][service] = costs
+
+                if service == "Virtual Machines" and inventory is not None:
+                    for vm in inventory.get((key, resource_group.lower()), []):
+                        rg['vms']["VM " + vm['resourceId'].split("/")[-1]] = self.vm_attributes(vm)
+
+            if len(rg['services']) > 0:
+                resource_groups[f"{Azuregraph.environment_of(resource_group)} ({resource_group})"] = rg
+
+        return {
+            'name': "Azure Hosting - " + apm_id,
+            'cost': rollup.total(key),
+            'resource_groups': resource_groups
+        }
+
+    def apply(self, app_id, apm_id, azureResult):
+        """
+        Brings the Azure structure of an Application in LeanIX in line with azureResult (see Azuregraph.get_costs_by_apm_id).
+        Applications may be applied concurrently (one thread each), the loaded components and services are shared.
+        """
+        return self.apply_desired(app_id, apm_id, self.desired(apm_id, azureResult))
+
+    def apply_desired(self, app_id, apm_id, desired):
+        """
+        Brings the Azure structure of an Application in line with a desired structure (see desired() and desired_from_rollup()).
+        All cost updates of a parent (relations to its children) are sent with its other patches, in one mutation per factsheet.
+        Returns the ID of the Azure Hosting component. Without resource groups (no Azure costs anymore), the existing
+        Azure Hosting component is archived with its resource groups and VMs, and None is returned.
+        """
+        self.load()
+
+        if len(desired['resource_groups']) == 0:
+            self._archive_hosting(apm_id, desired)
+            return None
+
+        with self.leanix_api.write_buffer(self.threshold) as buffer:
+            run = _Run(buffer)
+
+            hosting_id, existing_rgs = self._sync_hosting(run, app_id, desired)
+
+            for rgName, rg in desired['resource_groups'].items():
+                self._sync_resource_group(run, hosting_id, existing_rgs.pop(rgName.lower(), None), rgName, rg)
+
+            # resource groups that are gone from Azure (with their VMs)
+            for relation in existing_rgs.values():
+                for child in self._children(relation['id']).values():
+                    if self._is_vm(child['id']):
+                        self._archive(run, child['id'])
+
+                self._archive(run, relation['id'])
+
+        with self._lock:
+            self.created += run.created
+            self.updated += run.updated
+            self.archived += run.archived
+
+        print(f"Azure structure of {apm_id} at {int(desired['cost'])} EUR: {run.created} created, "
+              f"{run.updated} updated, {run.archived} archived")
+
+        return buffer.resolve(hosting_id)
+
+    def _sync_hosting(self, run, app_id, desired):
+        """Returns the ID (or buffer handle) of the Azure Hosting component and its current resource groups by lowercase name."""
+        existing = self._by_name.get(desired['name'].lower())
+
+        if existing is None:
+            hosting_id = run.buffer.create_factsheet("ITComponent", desired['name'], "hardware")
+            run.buffer.modify_factsheet(hosting_id, [
+                self._tag_patch(),
+                {
+                    "op": "add",
+                    "path": "/%s/new_1" % REL_TO_APPLICATION,
+                    "value": self._relation_value(app_id, desired['cost'])
+                }
+            ])
+            run.created += 1
+
+            return hosting_id, {}
+
+        relation = next((r for r in existing[REL_TO_APPLICATION] if r['id'] == app_id), None)
+
+        if relation is None:
+            run.buffer.modify_factsheet(existing['id'], [{
+                "op": "add",
+                "path": "/%s/new_1" % REL_TO_APPLICATION,
+                "value": self._relation_value(app_id, desired['cost'])
+            }])
+            run.updated += 1
+
+        elif self._cost_changed(relation, desired['cost']):
+            run.buffer.modify_factsheet(existing['id'], [{
+                "op": "replace",
+                "path": "/%s/%s" % (REL_TO_APPLICATION, relation['relation_id']),
+                "value": self._relation_value(app_id, desired['cost'])
+            }])
+            run.updated += 1
+
+        return existing['id'], self._children(existing['id'])
+
+    def _sync_resource_group(self, run, hosting_id, relation, rgName, rg):
+        if relation is not None:
+            rg_id = relation['id']
+
+            if self._cost_changed(relation, rg['cost']):
+                run.buffer.modify_factsheet(hosting_id, [{
+                    "op": "replace",
+                    "path": "/%s/%s" % (REL_TO_SUBCOMPONENT, relation['relation_id']),
+                    "value": self._relation_value(rg_id, rg['cost'])
+                }])
+                run.updated += 1
+
+        elif rgName.lower() in self._by_name:
+            # exists, but not (yet) under this Azure Hosting component
+            rg_id = self._by_name[rgName.lower()]['id']
+
+            run.buffer.modify_factsheet(hosting_id, [{
+                "op": "add",
+                "path": "/%s/new_%s" % (REL_TO_SUBCOMPONENT, rg_id),
+                "value": self._relation_value(rg_id, rg['cost'])
+            }])
+            run.updated += 1
+
+        else:
+            rg_id, created = self._resource_group_component(run, rgName)
+
+            if rg_id is None:
+                return
+
+            run.buffer.modify_factsheet(hosting_id, [{
+                "op": "add",
+                "path": "/%s/new_%s" % (REL_TO_SUBCOMPONENT, rg_id),
+                "value": self._relation_value(rg_id, rg['cost'])
+            }])
+
+            # created for another application in this run, which syncs its services and VMs
+            if not created:
+                run.updated += 1
+                return
+
+        children = self._children(rg_id)
+
+        for serviceName, service in rg['services'].items():
+            self._sync_service(run, rg_id, children.pop(serviceName.lower(), None), serviceName, service)
+
+        for vmName, attributes in rg['vms'].items():
+            self._sync_vm(run, rg_id, children.pop(vmName.lower(), None), vmName, attributes)
+
+        # services and VMs that are gone from this resource group
+        for child in children.values():
+            if self._is_vm(child['id']):
+                self._archive(run, child['id'])
+            else:
+                run.buffer.modify_factsheet(rg_id, [{
+                    "op": "remove",
+                    "path": "/%s/%s" % (REL_TO_SUBCOMPONENT, child['relation_id'])
+                }])
+                run.updated += 1
+
+    def _resource_group_component(self, run, rgName):
+        """
+        Returns (ID, created) of the IT Component of a resource group that is not in LeanIX yet. It is created once per run,
+        applications with costs in the same resource group that follow (or run concurrently) get the same ID.
+        """
+        key = rgName.lower()
+
+        with self._lock:
+            if key in self._resource_groups:
+                return self._resource_groups[key], False
+
+            rg_id = self.leanix_api.create_factsheet("ITComponent", rgName, "hardware", patches=[self._tag_patch()])
+
+            if rg_id is None:
+                print("** ERROR! Resource could not be created in LeanIX: " + rgName)
+                return None, False
+
+            self._resource_groups[key] = rg_id
+            run.created += 1
+
+            return rg_id, True
+
+    def _sync_service(self, run, rg_id, relation, serviceName, service):
+        if relation is None:
+            service_id = self._service_component(run, serviceName)
+
+            if service_id is None:
+                return
+
+            run.buffer.modify_factsheet(rg_id, [{
+                "op": "add",
+                "path": "/%s/new_%s" % (REL_TO_SUBCOMPONENT, service_id),
+                "value": self._relation_value(service_id, service['cost'], resource_location=service['location'])
+            }])
+            run.updated += 1
+
+        elif self._cost_changed(relation, service['cost']):
+            run.buffer.modify_factsheet(rg_id, [{
+                "op": "replace",
+                "path": "/%s/%s" % (REL_TO_SUBCOMPONENT, relation['relation_id']),
+                "value": self._relation_value(relation['id'], service['cost'], resource_location=service['location'])
+            }])
+            run.updated += 1
+
+    def _sync_vm(self, run, rg_id, relation, vmName, attributes):
+        if relation is None:
+            vm_id = run.buffer.create_factsheet("ITComponent", vmName, "hardware")
+
+            patches = [
+                self._tag_patch(),
+                {
+                    "op": "add",
+                    "path": "/%s/new_%s" % (REL_TO_PARENT, vm_id),
+                    "value": self._relation_value(rg_id) #under the resource group, not the generic Virtual Machines component
+                }
+            ]
+            patches += [{"op": "replace", "path": "/" + name, "value": value} for name, value in attributes.items()]
+
+            run.buffer.modify_factsheet(vm_id, patches)
+            run.created += 1
+            return
+
+        existing = self._components.get(relation['id'], {})
+
+        patches = [
+            {"op": "replace", "path": "/" + name, "value": value}
+            for name, value in attributes.items() if existing.get(name) != value
+        ]
+
+        if len(patches) > 0:
+            run.buffer.modify_factsheet(relation['id'], patches)
+            run.updated += 1
+
+    def _is_vm(self, component_id):
+        component = self._components.get(component_id)
+
+        return component is not None and component['name'].startswith("VM ")
+
+    def has_hosting(self, apm_id):
+        """True if the Application has an (Azure-tagged) Azure Hosting component in LeanIX."""
+        self.load()
+
+        return ("Azure Hosting - " + apm_id).lower() in self._by_name
+
+    def _archive_hosting(self, apm_id, desired):
+        existing = self._by_name.get(desired['name'].lower())
+
+        if existing is None:
+            return
+
+        run = _Run(None)
+
+        for relation in self._children(existing['id']).values():
+            for child in self._children(relation['id']).values():
+                if self._is_vm(child['id']):
+                    self._archive(run, child['id'])
+
+            self._archive(run, relation['id'])
+
+        self._archive(run, existing['id'])
+
+        with self._lock:
+            self.archived += run.archived
+
+        print(f"Azure structure of {apm_id} without Azure costs: {run.archived} archived")
+
+    def _archive(self, run, component_id):
+        self.leanix_api.archive_factsheet(component_id)
+        run.archived += 1
+
+    def _service_component(self, run, serviceName):
+        """
+        Returns the ID of the (shared) IT Component of an Azure service under the Microsoft provider, creating it only
+        if neither the service name nor one of its usual variants ("Azure Storage", "Microsoft Storage", "Microsoft / Azure Storage")
+        is taken.
+        """
+        key = serviceName.lower()
+
+        with self._lock:
+            return self._resolve_service(run, key, serviceName)
+
+    def _resolve_service(self, run, key, serviceName):
+        if key in self._services:
+            return self._services[key]
+
+        if key in self._by_name:
+            self._services[key] = self._by_name[key]['id']
+            return self._services[key]
+
+        service_id, created = self.leanix_api.uniqueness_index("ITComponent").resolve_or_create(
+            serviceName, "paas", provider_id=self.provider_id, patches=[self._tag_patch()],
+            alternatives=[f"Azure {serviceName}", f"Microsoft {serviceName}", f"Microsoft / Azure {serviceName}"]
+        )
+
+        if service_id is None:
+            print("** ERROR! Resource could not be created in LeanIX: " + serviceName)
+            return None
+
+        if created:
+            run.created += 1
+
+        self._services[key] = service_id
+
+        return service_id
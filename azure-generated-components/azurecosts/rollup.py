@@ -0,0 +1,104 @@
+from azurecosts.azuregraph import Azuregraph
+
+
+class CostRollup:
+    """
+    Sums the costs of a CostTable (see Azuregraph.get_costs_by_apm_ids) over the Azure hierarchy in a single pass:
+    application -> environment -> resource group -> service. When queried with granularity "Monthly" (or "Daily"),
+    the costs per period are kept as well, i.e. to be stored as time series.
+
+    Usage:
+
+    rollup = CostRollup(az.get_costs_by_apm_ids(apm_ids, granularity="Monthly"))
+    rollup.total("APM001")                          # yearly cost of the application
+    rollup.resource_groups("APM001")                # resource group -> cost
+    rollup.timeseries("APM001")                     # rows for LeanIXAPI.metric_add_timeseries_data
+    """
+    period_columns = ["BillingMonth", "UsageDate"]
+
+    def __init__(self, table, key="TagValue"):
+        self.period = next((name for name in self.period_columns if name in table), None)
+
+        # apm id -> {'total', 'environments', 'resource_groups', 'services' (rg -> service -> {cost, location}), 'series'}
+        self._applications = {}
+
+        periods = table[self.period] if self.period is not None else [None] * len(table)
+
+        for apm_id, service, resource_group, location, cost, period in zip(
+                table[key], table["ServiceName"], table["ResourceGroupName"], table["ResourceLocation"], table["Cost"], periods):
+            if not apm_id:
+                continue
+
+            app = self._applications.get(apm_id)
+            if app is None:
+                app = self._applications[apm_id] = {'total': 0, 'environments': {}, 'resource_groups': {}, 'services': {}, 'series': {}}
+
+            environment = Azuregraph.environment_of(resource_group)
+
+            app['total'] += cost
+            app['environments'][environment] = app['environments'].get(environment, 0) + cost
+            app['resource_groups'][resource_group] = app['resource_groups'].get(resource_group, 0) + cost
+
+            # a service may be billed in multiple locations of the same resource group, the first location is kept
+            services = app['services'].setdefault(resource_group, {})
+            services.setdefault(service, {'cost': 0, 'location': location})['cost'] += cost
+
+            if period is not None:
+                date = self._date(period)
+                series = app['series'].setdefault((resource_group, service), {})
+                series[date] = series.get(date, 0) + cost
+
+    @staticmethod
+    def _date(period):
+        """YYYY-MM-DD of a period, as returned as BillingMonth ("2024-01-01T00:00:00") or UsageDate (20240101)."""
+        period = str(period)
+
+        if "-" in period:
+            return period[:10]
+
+        return f"{period[:4]}-{period[4:6]}-{period[6:8]}"
+
+    def _app(self, apm_id):
+        return self._applications.get(apm_id, {'total': 0, 'environments': {}, 'resource_groups': {}, 'services': {}, 'series': {}})
+
+    def applications(self):
+        return list(self._applications)
+
+    def total(self, apm_id):
+        return self._app(apm_id)['total']
+
+    def environments(self, apm_id):
+        """Environment (Production, Test, ...) -> cost."""
+        return dict(self._app(apm_id)['environments'])
+
+    def resource_groups(self, apm_id):
+        """Resource group -> cost."""
+        return dict(self._app(apm_id)['resource_groups'])
+
+    def services(self, apm_id, resource_group):
+        """Service -> {'cost', 'location'} within a resource group."""
+        return dict(self._app(apm_id)['services'].get(resource_group, {}))
+
+    def series(self, apm_id, resource_group=None, service=None):
+        """Period (YYYY-MM-DD) -> cost of an application, optionally of one resource group and/or service."""
+        result = {}
+
+        for (rg, svc), series in self._app(apm_id)['series'].items():
+            if (resource_group is not None and rg != resource_group) or (service is not None and svc != service):
+                continue
+
+            for date, cost in series.items():
+                result[date] = result.get(date, 0) + cost
+
+        return dict(sorted(result.items()))
+
+    def timeseries(self, apm_id):
+        """
+        Monthly (or daily) costs of an application per resource group and service, as rows for
+        LeanIXAPI.metric_add_timeseries_data (schema dimensions seriesType = service, resourceGroup).
+        """
+        return [
+            {'date': date, 'seriesType': svc, 'resourceGroup': rg, 'value': cost}
+            for (rg, svc), series in self._app(apm_id)['series'].items()
+            for date, cost in sorted(series.items())
+        ]
@@ -3,6 +3,7 @@ import sys
 import re
 import json
 import pprint
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # detect if on Windows
 if os.name == 'nt':
@@ -13,6 +14,9 @@ if os.name == 'nt':
 # Import my LeanIX API class
 from leanix.leanix import LeanIXAPI
 from azurecosts.azuregraph import Azuregraph
+from azurecosts.hierarchy import AzureHierarchySync
+from azurecosts.rollup import CostRollup
+from azureinventory.snapshot import AzureInventorySnapshot
 
 azure_tenant_id = "<tenant id>"
 azure_client_id = "<client id>"
@@ -33,13 +37,16 @@ leanix_api = LeanIXAPI(leanix_token, leanix_auth_url, leanix_request_url, leanix
 
 AZURE_TAG = "<tag guid of AZURE tag in leanix>" #tag defined in LeanIX for Azure resources, created it if you don't have it.
 
-def azureToLeanIX(leanix_api, apm_id):
-    global AZURE_TAG
+AZURE_COST_SCHEMA = None #uuid of a metrics schema (see LeanIXAPI.create_metric_schema) to store monthly costs per Azure Hosting component, None to skip.
+
+# only differences with the existing Azure structure in LeanIX are written
+sync = AzureHierarchySync(leanix_api, AZURE_TAG, azureProviderId)
 
+def azureToLeanIX(leanix_api, apm_id):
     print("Retrieving Azure graph and costs for APM ID: " + apm_id)
     azureResult = az.get_costs_by_apm_id( apm_id )
 
-    print("Done. Now parsing and adding to LeanIX")
+    print("Done. Now comparing with LeanIX")
 
     for apm_result in leanix_api.search( apm_id ):
 
@@ -47,325 +54,70 @@ def azureToLeanIX(leanix_api, apm_id):
             app_id = apm_result['id']
             
             if app_id is not None:
-                ##################################################
-                # Get IT component structure of APM ID in LeanIX #
-                ##################################################
-
-                components = leanix_api.get_relationships(app_id, "Application", "relApplicationToITComponent")
-
-                azureHostingComponent = None #main component ID for Azure SaaS Hosting
-                azureHostingExists = False
-
-                for component in components:
-                    if component['name'] == "Azure Hosting - " + apm_id:
-                        azureHostingExists = True
-                        azureHostingComponent = component['id']
-                        break
-                
-
-                if not azureHostingExists:
-                    azureHostingComponent = leanix_api.create_factsheet("ITComponent", "Azure Hosting - " + apm_id, "hardware")                
-                    
-                    patches = [
-                        {
-                            "op": "add",
-                            "path": "/tags",
-                            "value": '[{"tagId":"' + AZURE_TAG + '"}]'
-                        },
-                        {
-                            "op": "add",
-                            "path": "/relITComponentToApplication/new_1",
-                            "value": '{"factSheetId":"' + app_id + '"}'
-                        }
-                    ]
-
-                    leanix_api.modify_factsheet(azureHostingComponent, patches)
-
-                    azureHostingExists = True
-
-                # rgToFactsheet = {}
-
-                totalRGCost = {}
-
-                #############################################################
-                # Add each resourcegroup as a component under Azure Hosting #
-                #############################################################
-                for rgName in azureResult:
-                    rgComponent = leanix_api.create_factsheet("ITComponent", rgName, "hardware")
-
-                    totalRGCost[rgComponent] = 0
-
-                    patches = [
-                        {
-                            "op": "add",
-                            "path": "/tags",
-                            "value": '[{"tagId":"' + AZURE_TAG + '"}]'
-                        },
-                        {
-                            "op": "add",
-                            "path": "/relSubcomponentITComponentToParentalComponentITComponent/new_" + rgComponent,
-                            "value": '{"factSheetId":"' + azureHostingComponent + '"}'
-                        }
-                    ]
-
-                    leanix_api.modify_factsheet(rgComponent, patches)
-
-                    for resource in azureResult[rgName]:
-                        print(resource)
-                        serviceName = resource['service']
-
-                        resourceComponent = leanix_api.create_factsheet("ITComponent", serviceName, "paas")
+                sync.apply(app_id, apm_id, azureResult)
 
-                        patches = [
-                            {
-                                "op": "add",
-                                "path": "/tags",
-                                "value": '[{"tagId":"' + AZURE_TAG + '"}]'
-                            },
-                            {
-                                "op": "add",
-                                "path": "/relITComponentToProvider/new_provider" + resourceComponent,
-                                "value": '{"factSheetId":"' + azureProviderId + '"}'
-                            },
-                            {
-                                "op": "add",
-                                "path": "/relSubcomponentITComponentToParentalComponentITComponent/new_subcomponent" + resourceComponent,
-                                "value": '{"factSheetId":"' + rgComponent + '"}'
-                            },                        
-                        ]
 
-                        try:
-                            leanix_api.modify_factsheet(resourceComponent, patches)
+def azureToLeanIXAll(leanix_api, apm_ids=None, workers=4):
+    """
+    Generates the Azure structure of many applications: costs and VMs are retrieved in bulk, after which the
+    applications are compared/written concurrently, sharing the loaded components, service components and VM sizes.
+    Without apm_ids, all Applications with an externalId (APM ID) that have Azure costs are processed.
+    """
+    applications = {}
+    for app in leanix_api.get_all("Application", fields=["externalId"]):
+        if app['externalId']:
+            applications[app['externalId'].lower()] = app
 
-                        except Exception as e:
-                            #get message
-                            if str(e).find("'errorType': 'UNIQUE'") > -1:
-                                print("Resource already exists with this Provider allocated")
+    wanted = set(applications) if apm_ids is None else {apm_id.lower() for apm_id in apm_ids}
 
-                                archivedResource = resourceComponent
+    print(f"Retrieving Azure costs for {len(wanted)} applications")
+    # monthly costs are only needed for the time series, the rollup sums them to yearly costs
+    granularity = "Monthly" if AZURE_COST_SCHEMA is not None else "Yearly"
 
-                                #delete the new resource and repoint to the existing
-                                leanix_api.archive_factsheet(resourceComponent)
+    # costs and VMs retrieved once (or read from the cached snapshot), also read by get_costs_by_apm_id/get_vm_inventory;
+    # without a list, one query for the whole estate is cheaper than filtering on thousands of ids
+    az.snapshot = AzureInventorySnapshot(az, None if apm_ids is None else list(apm_ids), granularity=granularity)
 
-                                resourceComponent = None
+    # costs of all applications summed per service, resource group and environment in one pass
+    rollup = CostRollup(az.snapshot.costs)
 
-                                existing = leanix_api.search(serviceName)
-                                for e in existing:
-                                    if e['id'] != archivedResource:
-                                        if e['name'].lower() == serviceName.lower() or \
-                                            e['name'].lower() == f"microsoft / azure {serviceName.lower()}" or \
-                                                e['name'].lower() == f"azure {serviceName.lower()}" or \
-                                                    e['name'].lower() == f"microsoft {serviceName.lower()}":
-                                            resourceComponent = e['id']
-                                            break
+    jobs = []
+    for tag_value in rollup.applications():
+        if tag_value.lower() in wanted and tag_value.lower() in applications:
+            jobs.append((applications[tag_value.lower()], tag_value))
 
-                                if resourceComponent is not None:
-                                    print("Existing component found for " + serviceName + " with id " + resourceComponent)
-                                    #modify again, but then minus the provider relation, and minus the Azure tag (so it doesnt get deleted - when I delete by all tags)
-                                    patches = [
-                                        {
-                                            "op": "add",
-                                            "path": "/relSubcomponentITComponentToParentalComponentITComponent/new_subcomponent" + resourceComponent,
-                                            "value": '{"factSheetId":"' + rgComponent + '"}'
-                                        },                        
-                                    ]
-                                    leanix_api.modify_factsheet(resourceComponent, patches)
-                                else:
-                                    print("** ERROR! Resource not found in LeanIX: " + serviceName)
-                                    continue
-                            else:
-                                print("Error: " + str(e))
-                                exit(-1)
+    # applications without Azure costs (anymore): their existing Azure structure is archived
+    with_costs = {tag_value.lower() for _, tag_value in jobs}
+    for apm_id in sorted(wanted - with_costs):
+        if apm_id in applications and sync.has_hosting(applications[apm_id]['externalId']):
+            jobs.append((applications[apm_id], applications[apm_id]['externalId']))
 
+    inventory = az.snapshot.vm_inventory([tag_value for _, tag_value in jobs])
 
-                        leanix_api.update_costs(
-                            parent = rgComponent,\
-                            factsheet_type = "ITComponent", \
-                            relationship_name = "relParentalComponentITComponentToSubcomponentITComponent", \
-                            factsheet_id = resourceComponent,
-                            costTotalAnnual = resource['cost_yearly_eur'],
-                            resource_location = resource['resource_location']
-                        )
+    def process(job):
+        app, tag_value = job
+        desired = sync.desired_from_rollup(rollup, tag_value, app['externalId'], inventory)
+        hosting_id = sync.apply_desired(app['id'], app['externalId'], desired)
 
-                        totalRGCost[rgComponent] += resource['cost_yearly_eur']
+        if AZURE_COST_SCHEMA is not None and hosting_id is not None:
+            leanix_api.metric_add_timeseries_data(hosting_id, AZURE_COST_SCHEMA, rollup.timeseries(tag_value))
 
-                        if serviceName == "Virtual Machines":
-                            ####################################################################
-                            # Add VMs underneath this resource, as part of this resource group #
-                            ####################################################################
-
-                            for vm in resource['vms']:
-                                vmName = "VM " + vm['resourceId'].split("/")[-1]
-
-                                vmComponent = leanix_api.create_factsheet("ITComponent", vmName, "hardware")
-
-                                ramAllocated = 0
-
-                                # check if memoryInMB is a number
-                                #
-                                if vm['memoryInMB'] > 0:
-                                    ramAllocated = vm['memoryInMB']
-                                    ramAllocated = int(ramAllocated / 1024)
-                                    if ramAllocated < 0:
-                                        ramAllocated = 0
-                                else:
-                                    # if not, try to convert it to a number
-                                    try:
-                                        ramAllocated = int(int(vm['memoryInMB']) / 1024)
-                                        if ramAllocated < 0:
-                                            ramAllocated = 0
-                                    except ValueError:
-                                        # if it's not a number, set it to 0
-                                        ramAllocated = 0
-
-
-                                diskOSSize = 0
-
-                                # check if osDiskSizeInMB is a number
-                                #
-                                if vm['osDiskSizeInGB'] > 0:
-                                    diskOSSize = vm['osDiskSizeInGB']
-                                    diskOSSize = int(diskOSSize)
-                                    if diskOSSize < 0:
-                                        diskOSSize = 0
-                                else:
-                                    # if not, try to convert it to a number
-                                    try:
-                                        diskOSSize = int(vm['osDiskSizeInGB'])
-                                        if diskOSSize < 0:
-                                            diskOSSize = 0
-                                    except ValueError:
-                                        # if it's not a number, set it to 0
-                                        diskOSSize = 0
-
-                                diskSizeGB = 0
-
-                                # check if diskSizeGB is a number
-                                #
-                                if vm['diskSizeGB'] > 0:
-                                    diskSizeGB = vm['diskSizeGB']
-                                    diskSizeGB = int(diskSizeGB)
-                                    if diskSizeGB < 0:
-                                        diskSizeGB = 0
-                                else:
-                                    # if not, try to convert it to a number
-                                    try:
-                                        diskSizeGB = int(vm['diskSizeGB'])
-                                        if diskSizeGB < 0:
-                                            diskSizeGB = 0
-                                    except ValueError:
-                                        # if it's not a number, set it to 0
-                                        diskSizeGB = 0
-
-
-                                patches = [
-                                    {
-                                        "op": "add",
-                                        "path": "/tags",
-                                        "value": '[{"tagId":"' + AZURE_TAG + '"}]'
-                                    },
-                                    # {
-                                    #     "op": "add",
-                                    #     "path": "/relITComponentToProvider/new_provider" + vmComponent,
-                                    #     "value": '{"factSheetId":"' + azureProviderId + '"}'
-                                    # },
-                                    {
-                                        "op": "add",
-                                        "path": "/relSubcomponentITComponentToParentalComponentITComponent/new_subcomponent" + vmComponent,
-                                        "value": '{"factSheetId":"' + rgComponent + '"}' #add under rgComponent, not this resourceComponent (else all VMs are under a generic Azure Virtual Machines component)
-                                    },   
-                                    {
-                                        "op": "replace",
-                                        "path": "/osType",
-                                        "value": vm['os_type']
-                                    },
-                                    {
-                                        "op": "replace",
-                                        "path": "/osFullname",
-                                        "value": vm['os']
-                                    },
-                                    {
-                                        "op": "replace",
-                                        "path": "/osVersion",
-                                        "value": vm['os_version']
-                                    },
-                                    {
-                                        "op": "replace",
-                                        "path": "/privateIP",
-                                        "value": ", ".join(vm['privateIPAddresses'])
-                                    },
-                                    {
-                                        "op": "replace",
-                                        "path": "/resourceGroup",
-                                        "value": vm['resourceGroup']
-                                    },
-                                    {
-                                        "op": "replace",
-                                        "path": "/azureSubscriptionId",
-                                        "value": vm['service_id']
-                                    },
-                                    {
-                                        "op": "replace",
-                                        "path": "/instanceType",
-                                        "value": vm['vmSize']
-                                    },
-                                    {
-                                        "op": "replace",
-                                        "path": "/cpuCount",
-                                        "value": vm['numberOfCores']
-                                    },
-                                    {
-                                        "op": "replace",
-                                        "path": "/ramAllocated",
-                                        "value": ramAllocated
-                                    },
-                                    {
-                                        "op": "replace",
-                                        "path": "/diskOSSize",
-                                        "value": diskOSSize
-                                    },
-                                    {
-                                        "op": "replace",
-                                        "path": "/diskResourceSize",
-                                        "value": diskSizeGB
-                                    },
-                                    {
-                                        "op": "replace",
-                                        "path": "/resourceLocation",
-                                        "value": vm['location']
-                                    },
-                                ]
-
-                                leanix_api.modify_factsheet(vmComponent, patches)
-                
-
-                #update the total cost for this resource group
-                for rgComponent, value in totalRGCost.items():                        
-                    leanix_api.update_costs(
-                        parent = azureHostingComponent,\
-                        factsheet_type = "ITComponent", \
-                        relationship_name = "relParentalComponentITComponentToSubcomponentITComponent", \
-                        factsheet_id = rgComponent,
-                        costTotalAnnual = value
-                    )
-
-                print("Total costs for " + apm_id + " is calculated at: " + str(sum(totalRGCost.values())))
-
-                #update the total cost for the Azure Hosting component
-                leanix_api.update_costs(
-                    parent = app_id,\
-                    factsheet_type = "Application", \
-                    relationship_name = "relApplicationToITComponent", \
-                    factsheet_id = azureHostingComponent,
-                    costTotalAnnual = sum(totalRGCost.values())                    
-                )
-            
+    failed = 0
 
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process, job): job for job in jobs}
 
-# deletes all with Azure tag
-leanix_api.delete_factsheets_with_tag("ITComponent", AZURE_TAG)
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                print(f"Failed to generate Azure structure for {futures[future][0]['externalId']}: {e}")
 
-# generates new ones
-azureToLeanIX(leanix_api, "<apm id>")
+    print(f"Azure structure of {len(jobs)} applications: {sync.created} created, {sync.updated} updated, "
+          f"{sync.archived} archived, {failed} failed")
 
 
+# updates the Azure structure of the applications (components no longer in Azure are archived),
+# use azureToLeanIXAll(leanix_api) for all Applications with an APM ID
+azureToLeanIXAll(leanix_api, ["<apm id>"])
@@ -0,0 +1,72 @@
+class CostTable:
+    """
+    Columnar result of Azure Cost Management queries: one list per column (Cost, ServiceName, TagValue, ...),
+    as named in the 'columns' of the query result. Pages of rows are appended with extend().
+
+    Usage:
+
+    table = az.get_costs_by_apm_ids(["APM001", "APM002"])
+    for apm_id, costs in table.group_by("TagValue").items():
+        print(apm_id, costs.sum("Cost"))
+    """
+
+    def __init__(self, names, rows=None):
+        self.names = list(names)
+        self.columns = {name: [] for name in self.names}
+
+        if rows is not None:
+            self.extend(rows)
+
+    @classmethod
+    def from_result(cls, result):
+        """Creates a table from the properties of a Cost Management query result."""
+        names = [column['name'] for column in result['properties']['columns']]
+
+        return cls(names, result['properties']['rows'])
+
+    def extend(self, rows):
+        columns = [self.columns[name] for name in self.names]
+
+        for row in rows:
+            for column, value in zip(columns, row):
+                column.append(value)
+
+    def __len__(self):
+        return len(self.columns[self.names[0]]) if len(self.names) > 0 else 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def rows(self):
+        """Iterates the rows as dicts of column name -> value."""
+        for values in zip(*[self.columns[name] for name in self.names]):
+            yield dict(zip(self.names, values))
+
+    def take(self, indices):
+        """Returns a new table with the rows at the given indices."""
+        table = CostTable(self.names)
+
+        for name in self.names:
+            column = self.columns[name]
+            table.columns[name] = [column[i] for i in indices]
+
+        return table
+
+    def group_by(self, *names):
+        """
+        Splits the table in one pass into a dict of key -> table, keyed by the value of one column,
+        or by a tuple of values when multiple columns are given.
+        """
+        keys = zip(*[self.columns[name] for name in names]) if len(names) > 1 else self.columns[names[0]]
+
+        indices = {}
+        for i, key in enumerate(keys):
+            indices.setdefault(key, []).append(i)
+
+        return {key: self.take(rows) for key, rows in indices.items()}
+
+    def sum(self, name):
+        return sum(self.columns[name])
@@ -0,0 +1,380 @@
+import os
+import time
+import json
+import threading
+from datetime import datetime, timedelta
+
+from azureinventory.costtable import CostTable
+
+
+class AzureResourceGraph:
+    """
+    Cost Management and Resource Graph queries shared by Azuregraph (azure-generated-components) and SubcomponentGraph
+    (subcomponents): costs of many applications, their VMs (with disks, network and VM size configuration) and the
+    VM size catalog. Subclasses provide _call(url, json_payload, method), cost_management_url,
+    subscription_tenant_sizes and azure_location.
+
+    With a snapshot set (see AzureInventorySnapshot), costs and VMs of the applications it covers are read from it.
+    """
+    cost_query_batch_size = 100 # APM ids per Cost Management query in get_costs_by_apm_ids
+    cost_query_retries = 5 # retries of a rate limited Cost Management page (with exponential backoff) before giving up
+
+    vm_sizes_file = 'vm-sizes.json' # VM sizes per location, see get_vm_configurations
+    vm_sizes_ttl = timedelta(days=7)
+    _vm_sizes = {} # location -> VM sizes, shared by all instances in this process
+    _vm_sizes_lock = threading.Lock()
+
+    resource_graph_url = "https://management.azure.com/providers/Microsoft.ResourceGraph/resources?api-version=2021-03-01"
+    resource_graph_page_size = 1000 # maximum $top of the Resource Graph API
+    resource_graph_batch_size = 50 # APM ids per Resource Graph query in get_vm_inventory
+
+    snapshot = None # AzureInventorySnapshot (see snapshot.py) read instead of the APIs for the applications it covers
+
+    @staticmethod
+    def environment_of(resource_group):
+        """Environment of a resource group, by the first letter of its name (naming convention)."""
+        first = resource_group[:1].lower()
+
+        if first == 'p':
+            return 'Production'
+        elif first == 't':
+            return 'Test'
+        elif first == 'd':
+            return 'Development'
+        elif first == 'a':
+            return 'Acceptance'
+
+        return "Unknown"
+
+    def _query_costs(self, payload):
+        """Runs a Cost Management query, following nextLink over all pages, and returns the rows as a CostTable."""
+        url = self.cost_management_url
+        table = None
+        retries = 0
+
+        while url:
+            result = self._call(url, payload)
+
+            if "properties" not in result or "rows" not in result['properties']:
+                if 'error' in result and result['error']['code'] == '429' and retries < self.cost_query_retries:
+                    retries += 1
+                    print(f"Rate limited. Retrying ({retries}/{self.cost_query_retries})...")
+                    time.sleep(min(3 * 2 ** (retries - 1), 60))
+                    continue
+
+                raise Exception(f"Error occurred in retrieving costs: {result}")
+
+            if table is None:
+                table = CostTable.from_result(result)
+            else:
+                table.extend(result['properties']['rows'])
+
+            url = result['properties'].get('nextLink')
+            retries = 0
+
+        return table
+
+    def get_costs_by_apm_ids(self, apm_ids=None, from_date=None, to_date=None, granularity="Yearly"):
+        """
+        Retrieves the costs of many applications at once, grouped by service, resource group, location, subscription
+        and ApplicationId tag (in columns TagKey/TagValue). Without apm_ids, the costs of all tagged resources are returned.
+        Returns a CostTable, split it per application with costs_by_apm_id().
+        """
+        if not from_date:
+            # Default to one year ago
+            from_date = (datetime.now() - timedelta(days=365)).strftime('%Y-%m-%d')
+
+        if not to_date:
+            # Default to today
+            to_date = datetime.now().strftime('%Y-%m-%d')
+
+        # without a filter on the ids, a single query (of some pages) covers the whole estate
+        batches = [None] if apm_ids is None else [
+            apm_ids[i:i + self.cost_query_batch_size] for i in range(0, len(apm_ids), self.cost_query_batch_size)
+        ]
+
+        table = None
+
+        for batch in batches:
+            payload = {
+                "type": "ActualCost",
+                "dataSet": {
+                    "granularity": granularity,
+                    "aggregation": {
+                        "totalCost": {
+                            "name": "Cost",
+                            "function": "Sum"
+                        },
+                        "totalCostUSD": {
+                            "name": "CostUSD",
+                            "function": "Sum"
+                        }
+                    },
+                    "grouping": [
+                        {
+                            "type": "Dimension",
+                            "name": "ServiceName"
+                        },
+                        {
+                            "type": "Dimension",
+                            "name": "ResourceGroupName"
+                        },
+                        {
+                            "type": "Dimension",
+                            "name": "ResourceLocation"
+                        },
+                        {
+                            "type": "Dimension",
+                            "name": "SubscriptionId"
+                        },
+                        {
+                            "type": "TagKey",
+                            "name": "ApplicationId"
+                        }
+                    ]
+                },
+                "timeframe": "Custom",
+                "timePeriod": {
+                    "from": from_date + "T00:00:00+00:00",  # Time range start
+                    "to": to_date + "T23:59:59+00:00"  # Time range end
+                }
+            }
+
+            if batch is not None:
+                payload['dataSet']['filter'] = {
+                    "Tags": {
+                        "Name": "ApplicationId",
+                        "Operator": "In",
+                        "Values": batch
+                    }
+                }
+
+            result = self._query_costs(payload)
+
+            if table is None:
+                table = result
+            else:
+                table.extend(zip(*[result[name] for name in table.names]))
+
+        return table
+
+    def costs_by_apm_id(self, table):
+        """
+        Splits a CostTable of get_costs_by_apm_ids() per application, returns a dict of apm id -> CostTable.
+        Costs of resources without ApplicationId tag are left out.
+        """
+        return {apm_id: costs for apm_id, costs in table.group_by("TagValue").items() if apm_id}
+
+    def _download_vm_configurations(self, location):
+        url = f"https://management.azure.com/subscriptions/{self.subscription_tenant_sizes}/providers/Microsoft.Compute/locations/{location}/vmSizes?api-version=2022-08-01"
+
+        result = self._call(url, method="GET")
+    
+        response = {}
+        for vm in result['value']:
+            response[vm['name']] = vm
+            vm['osDiskSizeInGB'] = vm['osDiskSizeInMB'] / 1024
+            vm['resourceDiskSizeInGB'] = vm['resourceDiskSizeInMB'] / 1024
+
+            del vm['osDiskSizeInMB']
+            del vm['resourceDiskSizeInMB']
+
+        return response
+
+    def get_vm_configurations(self, location=None):
+        """
+        Returns the VM sizes of a location (default azure_location) as dict of size name -> configuration.
+        Loaded once per process and cached in vm_sizes_file, the API is only called for new or expired locations.
+        """
+        location = location or self.azure_location
+
+        with self._vm_sizes_lock:
+            if location in self._vm_sizes:
+                return self._vm_sizes[location]
+
+            try:
+                with open(self.vm_sizes_file, 'r') as f:
+                    cached = json.load(f)
+            except (OSError, ValueError):
+                cached = {}
+
+            entry = cached.get(location)
+
+            if entry is None or time.time() - entry['fetched'] >= self.vm_sizes_ttl.total_seconds():
+                entry = {'fetched': time.time(), 'sizes': self._download_vm_configurations(location)}
+                cached[location] = entry
+
+                # written to a temporary file first, such that an aborted run never leaves a truncated cache
+                temp_file = self.vm_sizes_file + '.tmp'
+                with open(temp_file, 'w') as f:
+                    f.write(json.dumps(cached))
+
+                os.replace(temp_file, self.vm_sizes_file)
+
+            self._vm_sizes[location] = entry['sizes']
+
+            return entry['sizes']
+
+    def _query_resources(self, query):
+        """Runs a Resource Graph query, following $skipToken over all pages, and returns all rows."""
+        payload = {
+            "query": query,
+            "options": {
+                "$top": self.resource_graph_page_size
+            }
+        }
+
+        rows = []
+
+        while True:
+            result = self._call(self.resource_graph_url, payload)
+            rows.extend(result['data'])
+
+            if not result.get('$skipToken'):
+                return rows
+
+            payload['options']['$skipToken'] = result['$skipToken']
+
+    @staticmethod
+    def _kql_list(values):
+        return ", ".join(json.dumps(value) for value in values)
+
+    def get_vm_inventory(self, apm_ids, resource_groups=None):
+        """
+        Retrieves the VMs of many applications (optionally only in the given resource groups) with one Resource Graph
+        query per batch of applications. Returns a dict of (apm id, lowercase resource group) -> list of VMs.
+        """
+        if self.snapshot is not None and all(self.snapshot.covers(apm_id) for apm_id in apm_ids):
+            return self.snapshot.vm_inventory(apm_ids, resource_groups)
+
+        return self.vm_inventory_from_rows(self.get_resource_rows(apm_ids, resource_groups))
+
+    def get_resource_rows(self, apm_ids, resource_groups=None):
+        """
+        Retrieves the Resource Graph rows (VMs and disks, with tags and vnet/subnets) of the resource groups of many
+        applications, optionally only the given resource groups. Combine them into VMs with vm_inventory_from_rows().
+        """
+        rows = []
+
+        for i in range(0, len(apm_ids), self.resource_graph_batch_size):
+            batch = apm_ids[i:i + self.resource_graph_batch_size]
+
+            resource_group_filter = ""
+            if resource_groups is not None:
+                resource_group_filter = f"| where resourceGroup in~ ({self._kql_list(resource_groups)})"
+
+            # only VMs and disks are needed, other resources of the resource groups are not returned
+            resource_query = f"""
+ResourceContainers
+| where type == "microsoft.resources/subscriptions/resourcegroups"
+| extend applicationId = coalesce(
+    tostring(tags['ApplicationId']),
+    tostring(tags['ApplicationID']),
+    tostring(tags['applicationid'])
+)
+| extend service_id = subscriptionId
+| where applicationId in ({self._kql_list(batch)})
+| project resourceGroupName = name, applicationId, service_id
+| join kind=inner (
+    Resources
+    | where type in~ ('microsoft.compute/virtualmachines', 'microsoft.compute/disks')
+    {resource_group_filter}
+    | extend resourceId = id
+    | extend vmSize = tostring(properties.hardwareProfile.vmSize)
+    | extend vmStatus = tostring(properties.extended.instanceView.powerState.displayStatus)
+    | extend vmHostname = tostring(properties.osProfile.computerName)
+    | extend os_type = tostring(properties.storageProfile.osDisk.osType)
+    | extend os = tostring(properties.extended.instanceView.osName)
+    | extend os_version = tostring(properties.extended.instanceView.osVersion)
+    // Expand data disks and retrieve their sizes
+    | extend dataDisks = properties.storageProfile.dataDisks
+    | mv-expand dataDisks to typeof(dynamic)
+    | extend diskSizeGB = iif(
+        type == 'microsoft.compute/disks',
+        toint(properties['diskSizeGB']),
+        toint(dataDisks['diskSizeGB'])
+    )
+    // Access managedDiskId
+    | extend managedDiskId = tostring(dataDisks.managedDisk.id)
+    // Extract network interface IDs
+    | extend networkInterfaceIds = properties.networkProfile.networkInterfaces
+    | mv-expand networkInterfaceIds
+    | extend networkInterfaceId = tostring(networkInterfaceIds.id)
+    | extend tags = tags
+    | project location, resourceId, name, resourceType = type, vmHostname, vmSize, vmStatus, diskSizeGB, resourceGroup, managedDiskId, os_type, os, os_version, networkInterfaceId, tags
+) on $left.resourceGroupName == $right.resourceGroup
+| join kind=leftouter (
+    Resources
+    | where type =~ 'Microsoft.Network/networkInterfaces'
+    {resource_group_filter}
+    | extend nicId = id
+    | extend ipConfigs = properties.ipConfigurations
+    | mv-expand ipConfigs to typeof(dynamic)
+    | extend privateIPAddress = tostring(ipConfigs.properties.privateIPAddress)
+    // Retrieve subnet and virtual network information
+    | extend subnetId = tostring(ipConfigs.properties.subnet.id)
+    | extend vnet = tostring(extract('.*?/virtualNetworks/([^/]+)', 1, subnetId))
+    | extend subnet = tostring(extract('.*?/subnets/([^/]+)', 1, subnetId))
+    // Format vnet/subnet pair
+    | extend vnetSubnetPair = strcat(vnet, "/", subnet)
+    | summarize privateIPAddresses = make_list(privateIPAddress), vnetSubnetPairs = make_list(vnetSubnetPair) by nicId
+) on $left.networkInterfaceId == $right.nicId
+| project location, resourceId, name, resourceType, vmHostname, vmSize, vmStatus, diskSizeGB, resourceGroup, service_id, applicationId, managedDiskId, os_type, os, os_version, privateIPAddresses, vnetSubnetPairs, tags
+            """
+
+            rows.extend(self._query_resources(resource_query))
+
+        return rows
+
+    def vm_inventory_from_rows(self, rows):
+        """Combines Resource Graph rows into VMs, returns a dict of (apm id, lowercase resource group) -> list of VMs."""
+        groups = {}
+        for row in rows:
+            groups.setdefault((row['applicationId'], row['resourceGroup'].lower()), []).append(row)
+
+        return {key: self._vms_from_rows(group) for key, group in groups.items()}
+
+    def _vms_from_rows(self, rows):
+        """Combines the Resource Graph rows of one resource group into VMs, with their disks and VM size configuration."""
+        diskData = {}
+
+        # disks first, such that the VMs referring to them find them regardless of the order of the rows
+        for row in rows:
+            if row['resourceType'] == 'microsoft.compute/disks':
+                if row['resourceId'] not in diskData:
+                    diskData[row['resourceId']] = 0
+
+                diskData[row['resourceId']] += row['diskSizeGB']
+
+        vms = {}
+
+        for row in rows:
+            if row['resourceType'] != 'microsoft.compute/virtualmachines':
+                continue
+
+            row['environment'] = self.environment_of(row['resourceGroup'])
+
+            if row['resourceId'] not in vms:
+                vms[row['resourceId']] = row
+
+            if 'managedDiskId' in row:
+                if row['managedDiskId'] in diskData:
+                    vms[row['resourceId']]['diskSizeGB'] += diskData[row['managedDiskId']]
+
+                    if not 'managedDisks' in vms[row['resourceId']]:
+                        vms[row['resourceId']]['managedDisks'] = []
+
+                    vms[row['resourceId']]['managedDisks'].append(row['managedDiskId'])
+
+            # VM sizes of the location of the VM (cached, see get_vm_configurations)
+            vm_configurations = self.get_vm_configurations(row['location'])
+
+            if row['vmSize'] in vm_configurations:
+                vms[row['resourceId']].update(vm_configurations[row['vmSize']])
+
+        return list(vms.values())
+
+    def get_resource_graph(self, apm_id, resource_group):
+        inventory = self.get_vm_inventory([apm_id], [resource_group])
+
+        return inventory.get((apm_id, resource_group.lower()), [])
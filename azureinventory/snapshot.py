@@ -0,0 +1,139 @@
+import os
+import json
+import time
+from datetime import timedelta
+
+from azureinventory.costtable import CostTable
+
+
+class AzureInventorySnapshot:
+    """
+    Costs and resources (VMs, disks, with their tags and vnet/subnets) of many applications, retrieved once per run
+    and cached in cache_file, such that Azuregraph and SubcomponentGraph read the same data without calling the
+    Cost Management and Resource Graph APIs again. Indexed by resource group, application (ApplicationId tag) and VM id.
+
+    Usage:
+
+    az = Azuregraph(tenant_id, client_id, client_secret)
+    az.snapshot = AzureInventorySnapshot(az, ["APM001", "APM002"])
+    az.get_costs_by_apm_id("APM001")                # read from the snapshot
+
+    subcomponents = SubcomponentGraph(tenant_id, client_id, client_secret)
+    subcomponents.snapshot = az.snapshot            # same run, or in another job (read from cache_file):
+    subcomponents.snapshot = AzureInventorySnapshot(subcomponents, ["APM001", "APM002"])
+    """
+    cache_file = 'azure-inventory.json'
+    ttl = timedelta(hours=12) # a snapshot older than this is retrieved again
+
+    def __init__(self, graph, apm_ids=None, granularity="Yearly", refresh=False):
+        self.graph = graph
+        self.apm_ids = None if apm_ids is None else sorted(set(apm_ids))
+        self.granularity = granularity
+
+        self._covered = None if apm_ids is None else {apm_id.lower() for apm_id in apm_ids}
+
+        data = None if refresh else self._read()
+
+        if data is None:
+            data = self._fetch()
+            self._write(data)
+
+        self.fetched = data['fetched']
+        self.costs = CostTable(data['costs']['names'], data['costs']['rows'])
+        self.resources = data['resources']
+
+        self._index()
+
+    def _read(self):
+        try:
+            with open(self.cache_file, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if data.get('apm_ids') != self.apm_ids or data.get('granularity') != self.granularity:
+            return None
+
+        if time.time() - data['fetched'] >= self.ttl.total_seconds():
+            return None
+
+        return data
+
+    def _write(self, data):
+        # written to a temporary file first, such that an aborted run never leaves a truncated cache
+        temp_file = self.cache_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            f.write(json.dumps(data))
+
+        os.replace(temp_file, self.cache_file)
+
+    def _fetch(self):
+        print(f"Retrieving Azure snapshot of {'all' if self.apm_ids is None else len(self.apm_ids)} applications")
+
+        costs = self.graph.get_costs_by_apm_ids(self.apm_ids, granularity=self.granularity)
+
+        # without ids, the resources of all applications with costs
+        apm_ids = self.apm_ids
+        if apm_ids is None:
+            apm_ids = sorted({apm_id for apm_id in costs["TagValue"] if apm_id})
+
+        resources = self.graph.get_resource_rows(apm_ids) if len(apm_ids) > 0 else []
+
+        return {
+            'fetched': time.time(),
+            'apm_ids': self.apm_ids,
+            'granularity': self.granularity,
+            'costs': {'names': costs.names, 'rows': [list(row) for row in zip(*[costs[name] for name in costs.names])]},
+            'resources': resources
+        }
+
+    def _index(self):
+        # apm id (lowercase) -> CostTable
+        self._costs_by_application = {
+            apm_id.lower(): costs for apm_id, costs in self.graph.costs_by_apm_id(self.costs).items()
+        }
+
+        self._by_resource_group = {} # lowercase resource group -> rows
+        self._by_application = {} # lowercase apm id -> rows
+
+        for row in self.resources:
+            self._by_resource_group.setdefault(row['resourceGroup'].lower(), []).append(row)
+            self._by_application.setdefault(row['applicationId'].lower(), []).append(row)
+
+        # rows are combined on copies, the cached rows stay as retrieved
+        self._vm_inventory = self.graph.vm_inventory_from_rows([dict(row) for row in self.resources])
+
+        self._vms = {} # VM resource id (lowercase) -> VM
+        for vms in self._vm_inventory.values():
+            for vm in vms:
+                self._vms[vm['resourceId'].lower()] = vm
+
+    def covers(self, apm_id):
+        """True if the snapshot contains the costs and resources of the application."""
+        return self._covered is None or apm_id.lower() in self._covered
+
+    def costs_of(self, apm_id):
+        """CostTable of one application (see Azuregraph.get_costs_by_apm_ids)."""
+        return self._costs_by_application.get(apm_id.lower(), CostTable(self.costs.names))
+
+    def resources_of(self, apm_id):
+        """Resource Graph rows (VMs and disks) of the resource groups of an application."""
+        return list(self._by_application.get(apm_id.lower(), []))
+
+    def resources_in(self, resource_group):
+        """Resource Graph rows (VMs and disks) of a resource group."""
+        return list(self._by_resource_group.get(resource_group.lower(), []))
+
+    def vm(self, resource_id):
+        """VM by its resource id, None if not in the snapshot."""
+        return self._vms.get(resource_id.lower())
+
+    def vm_inventory(self, apm_ids=None, resource_groups=None):
+        """VMs as dict of (apm id, lowercase resource group) -> list of VMs (see Azuregraph.get_vm_inventory)."""
+        apm_ids = None if apm_ids is None else {apm_id.lower() for apm_id in apm_ids}
+        resource_groups = None if resource_groups is None else {resource_group.lower() for resource_group in resource_groups}
+
+        return {
+            (apm_id, resource_group): vms for (apm_id, resource_group), vms in self._vm_inventory.items()
+            if (apm_ids is None or apm_id.lower() in apm_ids) and (resource_groups is None or resource_group in resource_groups)
+        }
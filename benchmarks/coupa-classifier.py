@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks the contract classification of the Coupa loaders: the keyword loops as they were in parseContract
+against the compiled ContractClassifier, on a synthetic contract corpus. Also reports where both disagree.
+
+Usage:
+    python benchmarks/coupa-classifier.py [number of contracts]
+"""
+
+import os
+import sys
+import time
+import random
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'coupa-integration'))
+
+from coupa.classifier import ContractClassifier, DEFAULT_IGNORE, DEFAULT_RULES, DEFAULT_TELEPHONY_SUPPLIERS, UNCLASSIFIED
+
+CONTRACTS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+RUNS = 5
+
+FILLER = ["agreement", "renewal", "order", "emea", "global", "2024", "annual", "fee", "amendment", "contract", "for", "the", "of", "and",
+          "terms", "conditions", "pricing", "schedule", "appendix", "region", "europe", "invoice", "quote", "addendum", "master"]
+SUPPLIERS = ["Microsoft", "SAP", "Vodafone", "Dell", "Accenture", "Orange", "ServiceNow", "Atlassian", "Cisco", "KPN", "Capgemini", "Adobe"]
+
+
+def legacy_classify(contract):
+    """The keyword loops of parseContract, as they were (with the same ignore list as the classifier)."""
+    searchTxt = (contract['name'] + " " + contract['description']).lower()
+
+    for i in DEFAULT_IGNORE:
+        if (" " + i + " " in searchTxt) or (" " + i + "-" in searchTxt) or (" " + i + ":" in searchTxt):
+            return None
+
+    rules = dict(DEFAULT_RULES)
+
+    isSoW = isSupport = isLicense = isHardware = isTelephony = False
+
+    for i in rules["sow"]:
+        if (" " + i + " " in searchTxt.replace("_", " ")) or (" " + i + "-" in searchTxt) or (" " + i + ":" in searchTxt):
+            isSoW = True
+            break
+
+    for i in rules["support"]:
+        if (" " + i + " " in searchTxt) or (" " + i + "-" in searchTxt) or (" " + i + ":" in searchTxt):
+            isSupport = True
+            break
+
+    for i in rules["license"]:
+        if (" " + i + " " in searchTxt) or (" " + i + "-" in searchTxt) or (" " + i + ":" in searchTxt):
+            isLicense = True
+            isSupport = False
+            break
+
+    for i in rules["hardware"]:
+        if (" " + i + " " in searchTxt) or (" " + i + "-" in searchTxt) or (" " + i + ":" in searchTxt):
+            isLicense = isSupport = isTelephony = False
+            isHardware = True
+            break
+
+    for i in rules["telephony"]:
+        if (i in searchTxt.lower()) or (" " + i + "-" in searchTxt) or (" " + i + ":" in searchTxt):
+            isLicense = isSupport = isHardware = False
+            isTelephony = True
+            break
+
+    for i in DEFAULT_TELEPHONY_SUPPLIERS:
+        if i in contract['supplier'].lower() + " " + contract['name'].lower():
+            isLicense = isSupport = isHardware = False
+            isTelephony = True
+
+    if isSoW:
+        return "sow"
+    elif isLicense:
+        return "license"
+    elif isSupport:
+        return "support"
+    elif isHardware:
+        return "hardware"
+    elif isTelephony:
+        return "telephony"
+
+    return UNCLASSIFIED
+
+
+def corpus(n, seed=42):
+    rnd = random.Random(seed)
+    keywords = [k for _, keywords in DEFAULT_RULES for k in keywords] + DEFAULT_IGNORE
+    separators = [" ", " ", " ", "-", ":", "_"]
+
+    contracts = []
+    for _ in range(n):
+        def text(words):
+            out = []
+            for _ in range(words):
+                out.append(rnd.choice(keywords) if rnd.random() < 0.08 else rnd.choice(FILLER))
+                out.append(rnd.choice(separators))
+            return "".join(out).strip()
+
+        contracts.append({
+            'name': rnd.choice(SUPPLIERS) + " " + text(rnd.randint(3, 10)),
+            'description': text(rnd.randint(10, 80)),
+            'supplier': rnd.choice(SUPPLIERS)
+        })
+
+    return contracts
+
+
+def measure(fn, contracts):
+    timings = []
+    for _ in range(RUNS):
+        t = time.perf_counter()
+        result = fn(contracts)
+        timings.append(time.perf_counter() - t)
+
+    return min(timings), result
+
+
+if __name__ == "__main__":
+    contracts = corpus(CONTRACTS)
+
+    t = time.perf_counter()
+    classifier = ContractClassifier()
+    compile_time = time.perf_counter() - t
+
+    legacy_time, legacy = measure(lambda cs: [legacy_classify(c) for c in cs], contracts)
+    compiled_time, compiled = measure(classifier.classify_batch, contracts)
+
+    print(f"{CONTRACTS} synthetic contracts, best of {RUNS} runs")
+    print(f"{'keyword loops':<20} {legacy_time * 1000:8.1f} ms   {legacy_time / CONTRACTS * 1e6:6.1f} us/contract")
+    print(f"{'ContractClassifier':<20} {compiled_time * 1000:8.1f} ms   {compiled_time / CONTRACTS * 1e6:6.1f} us/contract   (compile {compile_time * 1000:.1f} ms)")
+    print(f"speed-up {legacy_time / compiled_time:.1f}x")
+
+    differences = [(c, a, b) for c, a, b in zip(contracts, legacy, compiled) if a != b]
+    print(f"{len(differences)} contracts classified differently")
+
+    for c, a, b in differences[:5]:
+        print(f"  {a} -> {b}: {c['name']!r}")
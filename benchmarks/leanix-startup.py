@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks the cold start of a runbook: importing leanix.leanix and constructing LeanIXAPI.
+Azure Automation sandboxes pay this on every (webhook-triggered) run.
+
+Usage:
+    python benchmarks/leanix-startup.py
+
+Optionally set LEANIX_TOKEN and LEANIX_BASE_URL (i.e. https://<tenant>.leanix.net/) to also measure
+the time until the first GraphQL result against a real tenant.
+"""
+
+import os
+import sys
+import time
+import statistics
+import subprocess
+
+RUNS = 10
+
+# run from the repository root, such that the leanix package can be imported
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+
+def measure_import():
+    """Import time in a fresh interpreter (nothing cached in sys.modules)."""
+    code = "import time; t = time.perf_counter(); import leanix.leanix; print(time.perf_counter() - t)"
+
+    timings = []
+    for _ in range(RUNS):
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=ROOT)
+        timings.append(float(output.decode().strip()))
+
+    return timings
+
+
+def measure_constructor(token, base_url):
+    from leanix.leanix import LeanIXAPI
+
+    timings = []
+    for _ in range(RUNS):
+        t = time.perf_counter()
+        LeanIXAPI(token, base_url + 'services/mtm/v1/oauth2/token', base_url + 'services/pathfinder/v1/graphql', base_url, search_base_url=base_url)
+        timings.append(time.perf_counter() - t)
+
+    return timings
+
+
+def measure_first_result(token, base_url):
+    from leanix.leanix import LeanIXAPI
+
+    t = time.perf_counter()
+    leanix_api = LeanIXAPI(token, base_url + 'services/mtm/v1/oauth2/token', base_url + 'services/pathfinder/v1/graphql', base_url, search_base_url=base_url)
+    leanix_api._call("{ allFactSheets(first: 1) { totalCount } }")
+
+    return time.perf_counter() - t
+
+
+def report(name, timings):
+    print(f"{name:<30} median {statistics.median(timings) * 1000:8.1f} ms   min {min(timings) * 1000:8.1f} ms   max {max(timings) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    report("import leanix.leanix", measure_import())
+
+    token = os.environ.get("LEANIX_TOKEN")
+    base_url = os.environ.get("LEANIX_BASE_URL")
+
+    if token and base_url:
+        report("LeanIXAPI(...)", measure_constructor(token, base_url))
+        report("constructor + first query", [measure_first_result(token, base_url)])
+    else:
+        report("LeanIXAPI(...)", measure_constructor("<token>", "https://<tenant>.leanix.net/"))
+        print("Set LEANIX_TOKEN and LEANIX_BASE_URL to measure the time until the first query result")
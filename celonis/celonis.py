@@ -215,17 +215,8 @@ class CelonisBPM:
 
             # Check if the process already exists or needs to be created
             if parent_fs_id is None:
-                # It's a root process
-                results = self.leanix_api.search(process_name)
-                if results:
-                    for fs in results:
-                        if fs['type'] == "BusinessContext" and fs['name'] == process_name:
-                            process_id = fs['id']
-                            break
-                    else:
-                        process_id = self.leanix_api.create_factsheet("BusinessContext", process_name, "process")
-                else:
-                    process_id = self.leanix_api.create_factsheet("BusinessContext", process_name, "process")
+                # It's a root process, only created if the name is not taken yet
+                process_id = self.leanix_api.resolve_or_create("BusinessContext", process_name, "process")
             else:
                 # It’s a child process, link it to the parent
                 if (parent_fs_id, process_name) not in visited_relationships:
@@ -242,12 +233,7 @@ class CelonisBPM:
                     print(f"Skipping creation of '{process_name}' under '{parent_fs_id}' to avoid duplicate relationship.")
                     
                     # Get the existing process ID
-                    results = self.leanix_api.search(process_name)
-                    if results:
-                        for fs in results:
-                            if fs['type'] == "BusinessContext" and process_name in fs['name']:
-                                process_id = fs['id']
-                                break
+                    process_id = self.leanix_api.uniqueness_index("BusinessContext").find(process_name)
                     
 
             # Update the process with additional attributes if needed
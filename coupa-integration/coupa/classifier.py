@@ -0,0 +1,227 @@
+import re
+
+
+# contracts mentioning any of these are not loaded (i.e. NDA's, data processing and feedback agreements)
+DEFAULT_IGNORE = [
+    "dpa",
+    "nda",
+    "feedback agreement",
+    "service agreement",
+    "confidentialityagreement",
+    "confidentiality agreement",
+    "sap fa",
+    "sow-",
+    "dpa-",
+]
+
+# categories in order of precedence, the first category with a matching keyword wins
+DEFAULT_RULES = [
+    ("sow", [
+        "sow",
+        "sow&fa",
+        "statement of work",
+        "delivery",
+        "implementation",
+        "project",
+        "consulting",
+        "consultancy",
+        "consultant",
+        "consultants",
+        "consultancy services",
+    ]),
+    ("telephony", [
+        "telephony",
+        "telephone",
+        "telecom",
+        "telecommunications",
+        "communications",
+        "phone",
+        "voip",
+        "mobile",
+        "fixed line",
+        "fixedline"
+    ]),
+    ("hardware", [
+        "hardware",
+        "servers",
+        "device",
+        "server",
+        "devices",
+        "network",
+        "switch",
+        "router",
+        "firewall",
+        "storage",
+        "datacenter",
+        "data center",
+        "datacentre",
+        "printing",
+        "printer",
+        "printers",
+        "laptop",
+        "desktop",
+        "workstation",
+        "workstations",
+        "monitor",
+        "monitors",
+        "display",
+        "displays",
+        "keyboard",
+        "keyboards"
+    ]),
+    ("license", [
+        "license",
+        "users",
+        "software",
+        "saas",
+        "subscription",
+        "tool"
+    ]),
+    ("support", [
+        "support",
+        "maintenance",
+        "helpdesk",
+        "hours",
+        "service",
+        "sla",
+        "supporting"
+    ]),
+]
+
+DEFAULT_TELEPHONY_SUPPLIERS = ["orange", "vodafone", "t-mobile", "telefonica", "kpn", "tele2", "british telecom"]
+
+UNCLASSIFIED = "unclassified"
+
+
+class ContractClassifier:
+    """
+    Classifies contracts (as staged by CoupaAPI) into sow, telephony, hardware, license, support or unclassified.
+
+    All keywords are compiled into a single regex (a trie of alternations), such that the text of a contract is scanned once.
+    A keyword matches when preceded by a space and followed by a space, "-" or ":".
+    Exceptions, as in the original parseContract rules:
+    - sow keywords may also be surrounded by underscores
+    - telephony keywords match anywhere in the text (separate, small regex)
+    - telephony suppliers are matched against supplier and contract name
+
+    Usage:
+
+    classifier = ContractClassifier()
+    category = classifier.classify(contract) # None if the contract is to be ignored
+    """
+
+    def __init__(self, ignore=DEFAULT_IGNORE, rules=DEFAULT_RULES, telephony_suppliers=DEFAULT_TELEPHONY_SUPPLIERS):
+        self.categories = [category for category, _ in rules]
+
+        # keyword -> categories it belongs to
+        self._keywords = {}
+        anywhere = []
+
+        for category, keywords in [("ignore", ignore)] + list(rules):
+            for keyword in keywords:
+                if category == "telephony":
+                    anywhere.append(keyword)
+                else:
+                    self._keywords.setdefault(keyword, []).append(category)
+
+        # a match is the longest keyword at a position, shorter keywords at the same position are checked as well
+        self._candidates = {
+            keyword: sorted([k for k in self._keywords if keyword.startswith(k)], key=len, reverse=True)
+            for keyword in self._keywords
+        }
+
+        self._matcher = re.compile("[ _](" + self._trie(self._keywords) + ")") if len(self._keywords) > 0 else None
+        self._anywhere = re.compile(self._trie(anywhere)) if len(anywhere) > 0 else None
+        self._suppliers = re.compile(self._trie(telephony_suppliers)) if len(telephony_suppliers) > 0 else None
+
+    def _trie(self, keywords):
+        """Regex alternation of the keywords, factored by common prefix (i.e. "sow" and "sow&fa" become sow(?:&fa)?)."""
+        trie = {}
+        for keyword in keywords:
+            node = trie
+            for ch in keyword:
+                node = node.setdefault(ch, {})
+            node[''] = True
+
+        def to_regex(node):
+            alternatives = [re.escape(ch) + to_regex(child) for ch, child in sorted(node.items()) if ch != '']
+
+            if len(alternatives) == 0:
+                return ''
+
+            regex = alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+
+            # keyword ends here, longer keywords are optional (greedy, so the longest keyword is matched first)
+            return "(?:" + regex + ")?" if '' in node else regex
+
+        return to_regex(trie)
+
+    def _accepts(self, category, before, after):
+        if category == "sow" and before in " _" and after != "" and after in " _":
+            return True
+
+        return before == " " and after != "" and after in " :-"
+
+    def matches(self, text):
+        """Returns the set of categories (including "ignore") with a keyword in the (lowercase) text."""
+        found = set()
+
+        if self._matcher is not None:
+            for match in self._matcher.finditer(text):
+                before = text[match.start()]
+                start = match.start(1)
+
+                for keyword in self._candidates[match.group(1)]:
+                    after = text[start + len(keyword):start + len(keyword) + 1]
+
+                    for category in self._keywords[keyword]:
+                        if self._accepts(category, before, after):
+                            found.add(category)
+
+        if self._anywhere is not None and self._anywhere.search(text):
+            found.add("telephony")
+
+        return found
+
+    def classify(self, contract):
+        """
+        Returns the category of a contract, or None if it matches the ignore list.
+        """
+        text = (contract['name'] + " " + (contract['description'] or "")).lower()
+
+        found = self.matches(text)
+
+        if "ignore" in found:
+            return None
+
+        if "telephony" in self.categories and self._suppliers is not None:
+            if self._suppliers.search(contract['supplier'].lower() + " " + contract['name'].lower()):
+                found.add("telephony")
+
+        for category in self.categories:
+            if category in found:
+                return category
+
+        return UNCLASSIFIED
+
+    def classify_batch(self, contracts):
+        return [self.classify(contract) for contract in contracts]
+
+
+_default_classifier = None
+
+
+def classify_batch(contracts, classifier=None):
+    """
+    Classifies a list of contracts, returns a list of categories (None for contracts to be ignored).
+    Uses a ContractClassifier with the default rules, unless one is given.
+    """
+    global _default_classifier
+
+    if classifier is None:
+        if _default_classifier is None:
+            _default_classifier = ContractClassifier()
+
+        classifier = _default_classifier
+
+    return classifier.classify_batch(contracts)
@@ -1,13 +1,20 @@
 import time
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import re
 import warnings
 import os
 import zipfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib3.exceptions import InsecureRequestWarning
 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+
+from coupa.staging import ContractStaging
+from coupa.currency import ExchangeRates
 
 # Suppress only the InsecureRequestWarning from urllib3
 warnings.simplefilter('ignore', InsecureRequestWarning)
@@ -21,16 +28,79 @@ logger = logging.getLogger(__name__)
 
 
 
+class ContractDocument:
+    """
+    First pdf of a contract's legal agreement, kept in memory (see CoupaAPI(in_memory_documents=True)).
+    Serializes as its file name.
+    """
+    def __init__(self, name, content):
+        self.name = name
+        self.content = content
+
+    def __str__(self):
+        return self.name
+
+
 class CoupaAPI:
-    _exchange_rates = []
     _rate_token = "<your token here>"
+    rates_file = 'rates.json' # latest (refreshed daily) and historical exchange rates, see ExchangeRates
+
+    max_page_size = 50 # maximum limit accepted by the Coupa API
+    prefetch_pages = 4 # pages requested ahead while the current page is processed
+
+    # only request the attributes the loaders consume
+    contract_fields = [
+        "id", "name", "type", "status", "description", "start-date", "end-date", "updated-at",
+        "min-commit", "max-commit", "legal-agreement-url",
+        {"contract-owner": ["email", "fullname"]},
+        {"supplier": ["id", "name", {"custom_fields": ["harmonized-supplier-name"]}]},
+        {"currency": ["code"]},
+        {"custom_fields": ["total-contract-value-in-eur", {"categories-applicable": ["id"]}]}
+    ]
+    purchase_order_line_fields = ["created-at", "updated-at", {"supplier": ["id", "name"]}]
+
+    max_document_size = 10*1024*1024 # LeanIX cannot handle larger documents
+    documents_dir = 'docs'
+    document_cache_file = 'docs/documents.json' # contract id -> updated-at and extracted pdf, to skip unchanged documents
+    document_cache_flush_every = 50 # documents cached in memory before document_cache_file is written again
 
-    def __init__(self, domain, client_id, client_secret, verify_ssl=True):
+    watermark_file = 'coupa-watermarks.json' # last seen updated-at per tenant and filter, see get_all_contracts(sinceLastSync=True)
+    watermark_overlap = timedelta(hours=1) # re-read window before the watermark, covers clock skew and late commits
+
+    token_refresh_margin = timedelta(minutes=5) # access tokens are refreshed this long before they expire
+
+    def __init__(self, domain, client_id, client_secret, verify_ssl=True, document_workers=4, in_memory_documents=False, staging_file='contracts.jsonl'):
         self.domain = domain
         self.client_id = client_id
         self.client_secret = client_secret
         self.verify_ssl = verify_ssl
         self.access_token = None
+        self.token_expires_at = None
+        self._token_lock = threading.Lock()
+
+        # one pooled session for all calls, sized for the document workers and prefetched pages running at once
+        pool_size = document_workers + self.prefetch_pages + 2
+        self.session = requests.Session()
+        self.session.verify = verify_ssl
+        self.session.mount('https://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+
+        # when set, documents are never written to docs/, get_document returns a ContractDocument instead of a path
+        self.in_memory_documents = in_memory_documents
+
+        # sanitized contracts are staged in a single JSONL file (.gz to compress), indexed by contract id
+        self.staging = ContractStaging(staging_file)
+
+        # exchange rates are cached on disk, the API is only called for stale latest or new historical rates
+        self.exchange_rates = ExchangeRates(self._rate_token, self.rates_file, verify_ssl=verify_ssl)
+
+        # watermark of a completed iter_contract_pages(sinceLastSync=True), saved by commit_watermark()
+        self._pending_watermark = None
+
+        # documents are downloaded on a bounded pool, decoupled from parsing the contracts
+        self._document_pool = ThreadPoolExecutor(max_workers=document_workers)
+        self._document_cache = None
+        self._document_cache_lock = threading.Lock()
+        self._document_cache_changes = 0 # cached documents not yet written to document_cache_file
 
     def get_date(self, date_str):
         if date_str is not None:
@@ -40,43 +110,26 @@ class CoupaAPI:
             return None
     
     def get_rates(self):
-        try: 
-            url =f"https://api.exchangeratesapi.io/v1/latest?access_key={self._rate_token}&format=1"
-            rates = self._call(url).json()
-
-            #write rates to file
-            with open('rates.json', 'w') as f:
-                f.write(json.dumps(rates, indent=4))
-        except:
-
-            #read rates from file
-            with open('rates.json', 'r') as f:
-                rates = json.load(f)
-
-        self._exchange_rates = rates['rates']
+        """Returns the latest exchange rates (currency -> rate against EUR), from rates.json unless older than a day."""
+        return self.exchange_rates.latest()
 
-        return rates
-    
-    def convert_to_eur(self, amount, currency):
-        if self._exchange_rates == []:
-            self.get_rates()
-
-        #ensure amount is a float
-        amount = float(amount)
+    def convert_to_eur(self, amount, currency, date=None):
+        """Converts the given amount in the specified currency to EUR, at the rate of date (latest if None)."""
+        return self.exchange_rates.convert(amount, currency, date)
 
-        """Converts the given amount in the specified currency to EUR."""
-        if currency == "EUR" or currency == "" or currency is None:
-            return amount
-        if currency not in self._exchange_rates:
-            raise ValueError(f"Currency {currency} not supported")
-        rate = self._exchange_rates[currency]
-        val = amount / rate
+    def rate_date(self, date_str):
+        """Date a contract's commitments are converted at: first of its start month, so one historical lookup covers a month."""
+        if date_str is None:
+            return None
 
-        #rount to two decimal places
-        return round(val, 2)
+        return datetime.fromisoformat(date_str).date().replace(day=1)
 
     def obtain_access_token(self):
         """Obtain an OAuth access token using the client credentials grant type."""
+        with self._token_lock:
+            return self._request_token()
+
+    def _request_token(self):
         token_url = f'https://{self.domain}/oauth2/token'
         payload = {
             'grant_type': 'client_credentials',
@@ -85,32 +138,57 @@ class CoupaAPI:
             'scope': 'core.contract.read core.contracts_template.read core.purchase_order.read'
         }
         headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        response = requests.post(token_url, data=payload, headers=headers, verify=self.verify_ssl)
+        response = self.session.post(token_url, data=payload, headers=headers)
 
         if response.status_code == 200:
-            self.access_token = response.json().get('access_token')
-            print(f"Access Token obtained: {self.access_token}")
+            token = response.json()
+            self.access_token = token.get('access_token')
+            self.token_expires_at = time.monotonic() + int(token.get('expires_in', 3600)) - self.token_refresh_margin.total_seconds()
+            print(f"Access Token obtained, expires in {token.get('expires_in', 3600)}s")
         else:
             print(f"Failed to obtain token: {response.status_code}")
             print(f"Response: {response.text}")
             raise Exception("Failed to obtain access token")
 
         return self.access_token
+
+    def _valid_token(self, rejected=None):
+        """
+        Returns an access token that has not expired, refreshing it first if needed.
+        rejected is a token the API refused (401): it is refreshed, unless another thread already did so.
+        Concurrent callers wait for a single refresh.
+        """
+        with self._token_lock:
+            if not self.access_token:
+                raise Exception("Access token not available. Call obtain_access_token() first.")
+
+            if time.monotonic() >= self.token_expires_at or (rejected is not None and rejected == self.access_token):
+                self._request_token()
+
+            return self.access_token
     
 
+    @staticmethod
     def harmonize_company_name(company_name):
-        # Define a regex pattern to match common company suffixes
-        pattern = r'\b(b\.v\.|n\.v\.|inc\.|incorporated|llc|ltd|limited|corp\.|corporation|gmbh|ag|s\.a\.|pvt\.|plc|co\.|company|s\.r\.l\.|pte\. ltd\.)\b'
-        
+        """Removes legal suffixes (B.V., Inc., GmbH, ...) from a company name, i.e. "Acme Software B.V." -> "Acme Software"."""
+        # Define a regex pattern to match common company suffixes at the end of the name (one or more, i.e. "Co., Ltd.")
+        # (dots may also be written as space or underscore, as in sanitized supplier names: "Acme_B_V_")
+        suffix = r'(?:b[._ ]?v|n[._ ]?v|inc|incorporated|llc|ltd|limited|corp|corporation|gmbh|ag|s[._ ]?a|pvt|plc|co|company|s[._ ]?r[._ ]?l|pte[._ ]+ltd)'
+        pattern = r'(?:[\s,_]+' + suffix + r'\.?)+[\s,_]*$'
+
         # Remove matching suffixes, ignoring case
         harmonized_name = re.sub(pattern, '', company_name, flags=re.IGNORECASE)
 
-        # Remove any leading or trailing whitespace
-        harmonized_name = harmonized_name.strip()
+        # Remove any leading or trailing whitespace (and separators left behind, i.e. "Acme, Inc.")
+        harmonized_name = harmonized_name.strip(' ,_')
 
         # Normalize multiple spaces to a single space
         harmonized_name = re.sub(r'\s+', ' ', harmonized_name)
-        
+
+        # a name that is nothing but a suffix is kept as is
+        if harmonized_name == "":
+            return re.sub(r'\s+', ' ', company_name.strip(' ,_'))
+
         return harmonized_name
 
     def get_po_companies(self):
@@ -126,242 +204,556 @@ class CoupaAPI:
         retry=retry_if_exception_type(requests.exceptions.RequestException),  # Retry on any requests exceptions
         before_sleep=before_sleep_log(logger, logging.INFO)  # Log before retrying
     )
-    def _call(self, url, params=None, operation="GET", data=None):
-        if not self.access_token:
-            raise Exception("Access token not available. Call obtain_access_token() first.")
+    def _call(self, url, params=None, operation="GET", data=None, stream=False):
+        if operation not in ("GET", "POST", "PUT", "DELETE"):
+            raise Exception("Unsupported HTTP operation")
 
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Accept': 'application/json'
-        }
+        token = self._valid_token()
+
+        for attempt in range(2):
+            headers = {
+                'Authorization': f'Bearer {token}',
+                'Accept': 'application/json'
+            }
+
+            response = self.session.request(operation, url, headers=headers, params=params, json=data, stream=stream)
+
+            # token revoked or expired early: refresh once and repeat the call
+            if response.status_code != 401 or attempt == 1:
+                break
+
+            response.close()
+            token = self._valid_token(rejected=token)
 
-        if operation == "GET":
-            response = requests.get(url, headers=headers, params=params, verify=self.verify_ssl)
-        elif operation == "POST":
-            response = requests.post(url, headers=headers, json=data, verify=self.verify_ssl)
-        elif operation == "PUT":
-            response = requests.put(url, headers=headers, json=data, verify=self.verify_ssl)
-        elif operation == "DELETE":
-            response = requests.delete(url, headers=headers, verify=self.verify_ssl)
-        else:
-            raise Exception("Unsupported HTTP operation")
-        
         return response
 
-    def get_all_contracts(self,callback=None, excludeId=[], filteringCategory=0, limit=50, retrieveSinceYesterday=False):
-        """Retrieve all contracts with pagination until none are left."""
+    def _get_page(self, url, params, offset, limit):
+        """Returns a single page as a list, or None if the request failed."""
+        params = dict(params, offset=offset, limit=limit)
+
+        response = self._call(url, params=params)
+
+        if response.status_code == 200:
+            return response.json()
+        else:
+            print(f"Failed to retrieve page at offset {offset}: {response.status_code}")
+            print(f"Response: {response.text}")
+            return None
+
+    def _pages(self, url, params={}, fields=None, limit=None, prefetch=None):
+        """
+        Generator over all pages of a listing, in order.
+        The next pages are requested concurrently while the current one is processed, paging stops on the first short page.
+        Raises if a page cannot be retrieved, such that a listing is never silently truncated (and no watermark is committed).
+
+        Args:
+            fields (list): projection, sent as the fields parameter (i.e. contract_fields)
+            limit (int): page size, capped at max_page_size
+            prefetch (int): number of pages in flight, defaults to prefetch_pages
+        """
+        limit = min(limit or self.max_page_size, self.max_page_size)
+        prefetch = max(prefetch or self.prefetch_pages, 1)
+
+        params = dict(params)
+        if fields is not None:
+            params['fields'] = json.dumps(fields)
+
+        with ThreadPoolExecutor(max_workers=prefetch) as executor:
+            inflight = [executor.submit(self._get_page, url, params, i * limit, limit) for i in range(prefetch)]
+            next_offset = prefetch * limit
+
+            try:
+                while inflight:
+                    page = inflight.pop(0).result()
+
+                    if page is None:
+                        raise Exception(f"Failed to retrieve {url}, listing aborted")
+
+                    if not page:
+                        break
+
+                    # request the next page before handing this one out
+                    if len(page) == limit:
+                        inflight.append(executor.submit(self._get_page, url, params, next_offset, limit))
+                        next_offset += limit
+
+                    yield page
+
+                    if len(page) < limit:
+                        break
+            finally:
+                # pages beyond the end were requested speculatively, drop them
+                for future in inflight:
+                    future.cancel()
+
+    def _load_watermarks(self):
+        try:
+            with open(self.watermark_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get_watermark(self, key):
+        """
+        Returns the watermark for a sync key: {'updated-at': <iso date>, 'seen': {contract id: updated-at}} or None.
+        'seen' holds the contracts handed out within the overlap window, such that they are not handed out twice.
+        """
+        return self._load_watermarks().get(key)
+
+    def save_watermark(self, key, watermark):
+        watermarks = self._load_watermarks()
+        watermarks[key] = watermark
+
+        with open(self.watermark_file, 'w') as f:
+            f.write(json.dumps(watermarks, indent=4))
+
+    def get_all_contracts(self,callback=None, excludeId=[], filteringCategory=0, limit=50, retrieveSinceYesterday=False, sinceLastSync=False):
+        """
+        Retrieve all contracts with pagination until none are left.
+
+        With sinceLastSync, only contracts updated since the previous (completed) sync of this tenant and filter are retrieved,
+        using updated-at[gt] with a watermark persisted in watermark_file. The first sync retrieves all contracts.
+        """
+        for selected in self.iter_contract_pages(excludeId, filteringCategory, limit, retrieveSinceYesterday, sinceLastSync):
+            #download the documents of this page in the background, while the contracts are parsed
+            #(documents larger than max_document_size are skipped, leanix cannot handle those large files)
+            documents = self.download_documents(selected)
+
+            for contract in selected:
+                c = self.build_contract(contract, self._document_result(documents[contract['id']]))
+
+                callback(c)
+
+                time.sleep(1)
+
+        self.staging.flush()
+        self.flush_document_cache()
+
+        # only move the watermark once all contracts were handed out
+        self.commit_watermark()
+
+        # return all_contracts
+
+    def iter_contract_pages(self, excludeId=[], filteringCategory=0, limit=50, retrieveSinceYesterday=False, sinceLastSync=False):
+        """
+        Generator over the pages of contracts (raw, as returned by Coupa) that pass excludeId and filteringCategory.
+        With sinceLastSync, the new watermark is kept pending once all pages were retrieved, see commit_watermark().
+        """
         if not self.access_token:
             raise Exception("Access token not available. Call obtain_access_token() first.")
 
-        # all_contracts = []
-        offset = 0
+        sync_key = f"{self.domain}|contracts|{filteringCategory}"
+        watermark = self.get_watermark(sync_key) if sinceLastSync else None
+        seen = watermark['seen'] if watermark is not None else {}
+        newest = None
+        params = {}
+
+        if watermark is not None:
+            since = datetime.fromisoformat(watermark['updated-at']) - self.watermark_overlap
+            since = since.isoformat(timespec='seconds')
+
+            print(f"Retrieving contracts updated since {since}")
+            contracts_url = f'https://{self.domain}/api/contracts?status=published&min-commit[gt]=1'
+            params['updated-at[gt]'] = since # as parameter, such that the + of the offset is encoded
+        elif not retrieveSinceYesterday:
+            contracts_url = f'https://{self.domain}/api/contracts?status=published&min-commit[gt]=1'
+        else:
+            #date filter set
+            #yesterday in yyyy-mm-dd hh:mm:ss format
+            yesterday = datetime.now() - timedelta(1)
+            yesterday = datetime.strftime(yesterday, '%Y-%m-%d') + 'T00:00:00+01:00'
 
-        while True:
-            if not retrieveSinceYesterday:
-                contracts_url = f'https://{self.domain}/api/contracts?status=published&min-commit[gt]=1'
-            else:
-                #date filter set
-                #yesterday in yyyy-mm-dd hh:mm:ss format
-                yesterday = datetime.now() - timedelta(1)
-                yesterday = datetime.strftime(yesterday, '%Y-%m-%d') + 'T00:00:00+01:00'
+            contracts_url = f'https://{self.domain}/api/contracts?status=published&min-commit[gt]=1&start-date[gt]={yesterday}' #2024-09-01T00:00:00+01:00'
 
-                contracts_url = f'https://{self.domain}/api/contracts?status=published&min-commit[gt]=1&start-date[gt]={yesterday}' #2024-09-01T00:00:00+01:00'
-            
-            
-            params = {
-                'offset': offset,
-                'limit': limit
-            }
+        for contracts in self._pages(contracts_url, params=params, fields=self.contract_fields, limit=limit):
 
-            response = self._call(contracts_url, params=params)
+            selected = []
 
-            if response.status_code == 200:
-                contracts = response.json()
+            for contract in contracts:
+                if sinceLastSync and contract['updated-at'] is not None:
+                    updated = datetime.fromisoformat(contract['updated-at'])
 
-                for contract in contracts:
-                    #exclude those in excludeId
-                    if contract['id'] in excludeId:
-                        continue
+                    if newest is None or updated > newest:
+                        newest = updated
 
-                    #check if filteringCategory is set for a particular commodity catgory we need to filter on and if so, then filter
-                    elif contract['custom-fields'] is not None and (
-                        contract['custom-fields']['categories-applicable'] is not None and
-                        (len(contract['custom-fields']['categories-applicable']) > 0 and
-                        contract['custom-fields']['categories-applicable'][0]['id'] != filteringCategory)
-                    ):
+                    #already handed out by the previous sync (within the overlap window)
+                    if seen.get(str(contract['id'])) == contract['updated-at']:
                         continue
-                    
-                    else:                                                
-                        print(f"Contract ID: {contract['id']}, Contract Type: {contract['name']}, Category")
-
-                        docFile = None
-
-                        try:
-                                docFile = self.get_document(contract['id'])
-
-                                if docFile == False:
-                                    docFile = None
-                        except:
-                            docFile = None
-
-
-                        lower = contract['name'].lower()
-                        isAmendment = 'renewal' in lower or 'extension' in lower or 'amendment' in lower or 'addendum' in lower or 'revised' in lower or 'renewed' in lower or 'renew' in lower
-
-                        #check if docFile is larger than 10mb, if so, then set to None
-                        #(leanix cannot handle those large files)
-                        if docFile is not None:
-                            if os.path.getsize(docFile) > 10*1024*1024:
-                                docFile = None
-
-                        if contract['start-date'] is not None:
-                            contract['start-date'] = self.get_date( contract['start-date'] )
-                        if contract['end-date'] is not None:
-                            contract['end-date'] = self.get_date( contract['end-date'] )
-
-                        c = {
-                            'coupa_contract_id': contract['id'],
-                            'coupa_supplier_id': contract['supplier']['id'],
-                            'name': contract['name'],
-                            'type': contract['type'],
-                            'owner_mail': contract['contract-owner']['email'],
-                            'owner_fullname': contract['contract-owner']['fullname'],
-                            'start-date':  contract['start-date'],
-                            'end-date':  contract['end-date'] ,
-                            'supplier': contract['supplier']['custom-fields']['harmonized-supplier-name'],
-                            'currency': contract['currency']['code'],
-                            'TCV': contract['custom-fields']['total-contract-value-in-eur'],
-                            'min-commitment': float(contract['min-commit']),
-                            'max-commitment': float(contract['max-commit']),
-                            'min-commitment-eur': self.convert_to_eur(float(contract['min-commit']), contract['currency']['code'].upper()),
-                            'max-commitment-eur': self.convert_to_eur(float(contract['max-commit']), contract['currency']['code'].upper()),
-                            'description': contract['description'],
-                            'document': docFile,
-                            'amendment': isAmendment,
-                            'url': contract['legal-agreement-url']
-                        }
-
-                        #make supplier path safe
-                        fileSupplier = c['supplier'] = re.sub(r'[^a-zA-Z0-9]', '_', c['supplier'])
-
-                        with open(f'contracts-{fileSupplier}-{c['coupa_contract_id']}.json', 'w') as f:
-                            f.write(json.dumps(c, indent=4))
-
-
-                        callback(c)
-
-                        time.sleep(1)
-
-                if not contracts:
-                    break  # No more contracts to retrieve
-
-                # all_contracts.extend(contracts)                
-                offset += limit
-            else:
-                print(f"Failed to retrieve contracts: {response.status_code}")
-                print(f"Response: {response.text}")
-                break
 
-        # return all_contracts
+                    seen[str(contract['id'])] = contract['updated-at']
 
-    
+                #exclude those in excludeId
+                if contract['id'] in excludeId:
+                    continue
 
-    def get_contracts_by_supplier(self, supplier_id, max_commit=None, offset=0, limit=50):
-        """Retrieve contracts with pagination."""
-        if not self.access_token:
-            raise Exception("Access token not available. Call obtain_access_token() first.")
+                #check if filteringCategory is set for a particular commodity catgory we need to filter on and if so, then filter
+                elif contract['custom-fields'] is not None and (
+                    contract['custom-fields']['categories-applicable'] is not None and
+                    (len(contract['custom-fields']['categories-applicable']) > 0 and
+                    contract['custom-fields']['categories-applicable'][0]['id'] != filteringCategory)
+                ):
+                    continue
+                
+                else:
+                    selected.append(contract)
+
+            yield selected
+
+        if sinceLastSync and (newest is not None or watermark is None):
+            if newest is None:
+                newest = datetime.now(timezone.utc)
+
+            if watermark is not None:
+                newest = max(newest, datetime.fromisoformat(watermark['updated-at']))
+
+            # keep only what falls within the overlap window of the new watermark
+            cutoff = newest - self.watermark_overlap
+            seen = {id: updated for id, updated in seen.items() if datetime.fromisoformat(updated) > cutoff}
+
+            self._pending_watermark = (sync_key, {'updated-at': newest.isoformat(timespec='seconds'), 'seen': seen})
+
+    def iter_contracts(self, excludeId=[], filteringCategory=0, limit=50, retrieveSinceYesterday=False, sinceLastSync=False):
+        """Generator over single contracts, see iter_contract_pages. Used as source of a Pipeline."""
+        for selected in self.iter_contract_pages(excludeId, filteringCategory, limit, retrieveSinceYesterday, sinceLastSync):
+            yield from selected
+
+    def commit_watermark(self):
+        """
+        Persists the watermark of the last completed iter_contract_pages(sinceLastSync=True).
+        Call this once all contracts were processed, such that an aborted run is retried in full on the next sync.
+        """
+        if self._pending_watermark is not None:
+            self.save_watermark(*self._pending_watermark)
+            self._pending_watermark = None
+
+    def fetch_document(self, contract):
+        """Downloads the document of a raw contract, returns (contract, document or None). Used as Pipeline stage."""
+        try:
+            docFile = self.get_document(contract['id'], contract.get('updated-at'))
+        except Exception as e:
+            print(f"Failed to retrieve document: {e}")
+            docFile = None
+
+        if docFile == False:
+            docFile = None
+
+        return contract, docFile
+
+    def build_contract(self, contract, docFile=None):
+        """
+        Sanitizes a raw Coupa contract into the record handed to the loaders, and stages it (see ContractStaging).
+        """
+        print(f"Contract ID: {contract['id']}, Contract Type: {contract['name']}, Category")
+
+        lower = contract['name'].lower()
+        isAmendment = 'renewal' in lower or 'extension' in lower or 'amendment' in lower or 'addendum' in lower or 'revised' in lower or 'renewed' in lower or 'renew' in lower
+
+        # both commitments at the rate of the contract's start, in one lookup
+        rate_date = self.rate_date(contract['start-date'])
+        currency = contract['currency']['code'].upper()
+        commitments_eur = self.exchange_rates.convert_batch(
+            [float(contract['min-commit']), float(contract['max-commit'])], [currency, currency], [rate_date, rate_date]
+        )
+
+        c = {
+            'coupa_contract_id': contract['id'],
+            'coupa_supplier_id': contract['supplier']['id'],
+            'name': contract['name'],
+            'type': contract['type'],
+            'owner_mail': contract['contract-owner']['email'],
+            'owner_fullname': contract['contract-owner']['fullname'],
+            'start-date': self.get_date( contract['start-date'] ),
+            'end-date': self.get_date( contract['end-date'] ),
+            'supplier': contract['supplier']['custom-fields']['harmonized-supplier-name'],
+            'currency': contract['currency']['code'],
+            'TCV': contract['custom-fields']['total-contract-value-in-eur'],
+            'min-commitment': float(contract['min-commit']),
+            'max-commitment': float(contract['max-commit']),
+            'min-commitment-eur': commitments_eur[0],
+            'max-commitment-eur': commitments_eur[1],
+            'description': contract['description'],
+            'document': docFile,
+            'amendment': isAmendment,
+            'url': contract['legal-agreement-url']
+        }
 
-        # contracts_url = f'https://{self.domain}' + '/api/contracts?status=published&fields=["start-date","end-date","id", "created-at", "updated-at", "name","description","type","min-commit", "max-commit", "term-type", {"currency":["code"]}]&status=published&supplier[id]=' + str(supplier_id)
-        
+        #make supplier path safe
+        c['supplier'] = re.sub(r'[^a-zA-Z0-9]', '_', c['supplier'])
+
+        self.staging.append(c)
+
+        return c
+
+    def _contracts_by_supplier_url(self, supplier_id, max_commit=None):
         contracts_url = f'https://{self.domain}' + '/api/contracts?status=published&supplier[id]=' + str(supplier_id)
         
         if max_commit is not None:
             contracts_url += '&max-commit[in]=' + str(max_commit)
 
-        #contracts_url = f"https://{self.domain}/api/contracts?status=published"
-        # headers = {
-        #     'Authorization': f'Bearer {self.access_token}',
-        #     'Accept': 'application/json'
-        # }
-        params = {
-            'offset': offset,
-            'limit': limit
-        }
-        # response = requests.get(contracts_url, headers=headers, params=params, verify=self.verify_ssl)
-        response = self._call(contracts_url, params=params)
+        return contracts_url
 
-        if response.status_code == 200:
-            contracts = response.json()
-            return contracts
-        else:
-            print(f"Failed to retrieve contracts: {response.status_code}")
-            print(f"Response: {response.text}")
-            return []
+    def get_contracts_by_supplier(self, supplier_id, max_commit=None, offset=0, limit=50):
+        """Retrieve contracts with pagination."""
+        if not self.access_token:
+            raise Exception("Access token not available. Call obtain_access_token() first.")
+
+        contracts_url = self._contracts_by_supplier_url(supplier_id, max_commit)
+
+        contracts = self._get_page(contracts_url, {'fields': json.dumps(self.contract_fields)}, offset, limit)
+
+        return contracts if contracts is not None else []
         
     
-    def extract_first_pdf(self, zip_file_path, output_dir):
+    def extract_first_pdf(self, zip_file_path, output_dir, max_size=None):
         with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-            # List all files in the ZIP archive
-            file_list = zip_ref.namelist()
-
             # Find the first PDF file
-            for file_name in file_list:
-                if file_name.endswith('.pdf'):
+            for member in zip_ref.infolist():
+                if member.filename.endswith('.pdf'):
+                    # skip without extracting if the uncompressed pdf is too large
+                    if max_size is not None and member.file_size > max_size:
+                        print(f"Skipping {member.filename}, too large ({member.file_size} bytes)")
+                        return None
+
                     # Extract the first PDF file
-                    zip_ref.extract(file_name, output_dir)
-                    print(f"Extracted: {file_name}")
-                    return os.path.join(output_dir, file_name)
+                    zip_ref.extract(member, output_dir)
+                    print(f"Extracted: {member.filename}")
+                    return os.path.join(output_dir, member.filename)
             
             print("No PDF file found in the archive.")
             return None
+
+    def read_first_pdf(self, zip_file, max_size=None):
+        """
+        Reads the first pdf of a zip (path or file object) into memory, without extracting to disk.
+        The size limit is enforced while reading, regardless of the size stated in the archive.
+
+        Returns a ContractDocument, or None if there is no pdf or it is too large.
+        """
+        with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+            for member in zip_ref.infolist():
+                if member.filename.endswith('.pdf'):
+                    if max_size is not None and member.file_size > max_size:
+                        print(f"Skipping {member.filename}, too large ({member.file_size} bytes)")
+                        return None
+
+                    content = bytearray()
+                    with zip_ref.open(member) as pdf:
+                        for chunk in iter(lambda: pdf.read(1024*1024), b''):
+                            content.extend(chunk)
+                            if max_size is not None and len(content) > max_size:
+                                print(f"Skipping {member.filename}, too large (> {max_size} bytes)")
+                                return None
+
+                    print(f"Read: {member.filename}")
+                    return ContractDocument(os.path.basename(member.filename), bytes(content))
+
+            print("No PDF file found in the archive.")
+            return None
+
+    def _load_document_cache(self):
+        if self._document_cache is None:
+            try:
+                with open(self.document_cache_file, 'r') as f:
+                    self._document_cache = json.load(f)
+            except (OSError, ValueError):
+                self._document_cache = {}
+
+        return self._document_cache
+
+    def _cached_document(self, contract_id, updated_at):
+        """Returns (True, document) if the document of this contract version was retrieved before, else (False, None)."""
+        if updated_at is None:
+            return False, None
+
+        with self._document_cache_lock:
+            entry = self._load_document_cache().get(str(contract_id))
+
+        if entry is None or entry['updated-at'] != updated_at:
+            return False, None
+
+        if entry['document'] is not None and not os.path.exists(entry['document']):
+            return False, None
+
+        return True, entry['document']
+
+    def _cache_document(self, contract_id, updated_at, document):
+        if updated_at is None:
+            return
+
+        with self._document_cache_lock:
+            cache = self._load_document_cache()
+            cache[str(contract_id)] = {'updated-at': updated_at, 'document': document}
+
+            self._document_cache_changes += 1
+            if self._document_cache_changes >= self.document_cache_flush_every:
+                self._write_document_cache()
+
+    def _write_document_cache(self):
+        # written to a temporary file first, such that an aborted run never leaves a truncated cache
+        os.makedirs(os.path.dirname(self.document_cache_file), exist_ok=True)
+
+        temp_file = self.document_cache_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            f.write(json.dumps(self._document_cache))
+
+        os.replace(temp_file, self.document_cache_file)
+        self._document_cache_changes = 0
+
+    def flush_document_cache(self):
+        """Writes the cached documents to document_cache_file (done every document_cache_flush_every documents)."""
+        with self._document_cache_lock:
+            if self._document_cache_changes > 0:
+                self._write_document_cache()
     
-    def get_document(self, contract_id):
-        """Retrieve contract pdfs."""
+    def _cache_pdf(self, contract_id, updated_at, document):
+        """Caches an in-memory document (ContractDocument or None), the pdf is written once per contract version."""
+        if updated_at is None:
+            return
+
+        pdfFile = None
+
+        if document is not None:
+            directory = os.path.join(self.documents_dir, str(contract_id))
+            os.makedirs(directory, exist_ok=True)
+
+            pdfFile = os.path.join(directory, document.name)
+            with open(pdfFile, 'wb') as pdf:
+                pdf.write(document.content)
+
+        self._cache_document(contract_id, updated_at, pdfFile)
+
+    def get_document(self, contract_id, updated_at=None):
+        """
+        Retrieve the first pdf of the contract's legal agreement (zip).
+        The zip is streamed to disk and skipped as soon as it exceeds max_document_size (by Content-Length, or while streaming).
+        When updated_at is given, the result is cached and unchanged contracts are not downloaded again.
+
+        With in_memory_documents, the zip is streamed into a spooled buffer and the pdf is read from it directly.
+        Only the pdf is kept on disk for the cache (when updated_at is given), no zip or extracted archive.
+
+        Returns the path of the pdf (or a ContractDocument), None if not available (or too large), False if the contract has no document.
+        """
         if not self.access_token:
             raise Exception("Access token not available. Call obtain_access_token() first.")
 
-        contracts_url = f"https://{self.domain}/api/contracts/{contract_id}/retrieve_legal_agreement"
-        # headers = {
-        #     'Authorization': f'Bearer {self.access_token}',
-        #     'Accept': 'application/json'
-        # }
+        cached, docFile = self._cached_document(contract_id, updated_at)
+        if cached:
+            if self.in_memory_documents and docFile is not None:
+                with open(docFile, 'rb') as pdf:
+                    return ContractDocument(os.path.basename(docFile), pdf.read())
 
-        #download file and save to disk (can be a large pdf)
-        # response = requests.get(contracts_url, headers=headers, verify=self.verify_ssl)
-        response = self._call(contracts_url)
+            return docFile
 
-        docFile = f'docs/contract_{contract_id}.zip'
+        contracts_url = f"https://{self.domain}/api/contracts/{contract_id}/retrieve_legal_agreement"
 
-        if response.status_code == 200:
-            with open(docFile, 'wb') as f:
-                f.write(response.content)
+        #download file and stream to disk (can be a large pdf)
+        response = self._call(contracts_url, stream=True)
 
-            #mkdir contract_id
-            
-            #os path indicator
-            sep = os.path.sep
+        #os path indicator
+        sep = os.path.sep
 
-            try:
-                os.makedirs('docs' + sep + str(contract_id), exist_ok=True)
-                pdfFile = self.extract_first_pdf(docFile, 'docs' + sep + str(contract_id))
-                
-                docFile = pdfFile
-            except Exception as e:
-                print(f"Failed to extract PDF file: {e}")
-                docFile = None
+        docFile = self.documents_dir + sep + f'contract_{contract_id}.zip'
 
-        else:
+        f = None
+
+        try:
             if response.status_code == 404:
                 print(f"Document not found for contract: {contract_id}")
-                docFile = None
+                self._cache_document(contract_id, updated_at, None)
                 return False
-            else:
+
+            if response.status_code != 200:
                 print(f"Failed to retrieve document: {response.status_code}")
-                docFile = None
                 print(f"Response: {response.text}")
+                return None
+
+            length = response.headers.get('Content-Length')
+            if length is not None and int(length) > self.max_document_size:
+                print(f"Document for contract {contract_id} is too large ({length} bytes), skipping")
+                self._cache_document(contract_id, updated_at, None)
+                return None
+
+            if self.in_memory_documents:
+                # never spills to disk, the download is aborted before it exceeds max_document_size
+                f = tempfile.SpooledTemporaryFile(max_size=self.max_document_size + 1)
+            else:
+                os.makedirs(self.documents_dir, exist_ok=True)
+                f = open(docFile, 'wb')
+
+            size = 0
+            for chunk in response.iter_content(chunk_size=1024*1024):
+                size += len(chunk)
+                if size > self.max_document_size:
+                    break
+                f.write(chunk)
+
+        except:
+            if f is not None:
+                f.close()
+            raise
+
+        finally:
+            response.close()
+
+        if size > self.max_document_size:
+            print(f"Document for contract {contract_id} is too large (> {self.max_document_size} bytes), skipping")
+            f.close()
+            if not self.in_memory_documents:
+                os.remove(docFile)
+            self._cache_document(contract_id, updated_at, None)
+            return None
+
+        if self.in_memory_documents:
+            try:
+                f.seek(0)
+                document = self.read_first_pdf(f, max_size=self.max_document_size)
+            except Exception as e:
+                print(f"Failed to read PDF file: {e}")
+                return None
+            finally:
+                f.close()
+
+            self._cache_pdf(contract_id, updated_at, document)
+
+            return document
+
+        f.close()
+
+        try:
+            os.makedirs(self.documents_dir + sep + str(contract_id), exist_ok=True)
+            pdfFile = self.extract_first_pdf(docFile, self.documents_dir + sep + str(contract_id), max_size=self.max_document_size)
+            
+            docFile = pdfFile
+        except Exception as e:
+            print(f"Failed to extract PDF file: {e}")
+            return None
+
+        self._cache_document(contract_id, updated_at, docFile)
             
         return docFile
 
+    def download_documents(self, contracts):
+        """
+        Submit the documents of the given contracts to the download pool. Returns a dict of contract id -> Future.
+        """
+        return {
+            contract['id']: self._document_pool.submit(self.get_document, contract['id'], contract.get('updated-at'))
+            for contract in contracts
+        }
+
+    def _document_result(self, future):
+        """Waits for a download submitted by download_documents, returns the pdf path or None."""
+        try:
+            docFile = future.result()
+        except Exception as e:
+            print(f"Failed to retrieve document: {e}")
+            return None
+
+        if docFile == False:
+            return None
+
+        return docFile
+
     
     def get_purchase_orders_by_commodity(self, commodity_name, offset=0, limit=50):
         """Retrieve purchase orders filtered by commodity with pagination."""
@@ -369,7 +761,7 @@ class CoupaAPI:
             raise Exception("Access token not available. Call obtain_access_token() first.")
         
         # fields = '[{"custom_fields": ["long-description"]},{"currency": ["code"]},"accounting-total","account-type","description", "created-at", "updated-at", {"supplier": ["id", "name"]}]'
-        fields = '["created-at", "updated-at", {"supplier": ["id", "name"]}]'
+        fields = json.dumps(self.purchase_order_line_fields)
 
         purchase_orders_url = f'https://{self.domain}/api/purchase_order_lines?commodity[name]={commodity_name}' + '&fields=' + fields
         headers = {
@@ -392,32 +784,45 @@ class CoupaAPI:
             print(f"Response: {response.text}")
             return []
 
-    def get_all_purchase_orders_by_commodity(self, commodity_name="IT Software and Maintenance - L4", callback=None):
-        """Retrieve all purchase orders for a given commodity by handling pagination."""
+    def get_all_purchase_orders_by_commodity(self, commodity_name="IT Software and Maintenance - L4", callback=None, max_workers=1):
+        """
+        Retrieve all purchase order lines for a given commodity and load the contracts of their suppliers.
+
+        Phase 1 streams all PO lines and collects the distinct suppliers, phase 2 retrieves the contracts
+        of every supplier exactly once (in parallel when max_workers > 1, callback is then called from worker threads).
+        """
         all_purchase_orders = []
-        offset = 0
-        limit = 50
+        suppliers = {}
 
-        # enabled = False
+        purchase_orders_url = f'https://{self.domain}/api/purchase_order_lines?commodity[name]={commodity_name}'
 
-        while True:
-            purchase_orders = self.get_purchase_orders_by_commodity(commodity_name, offset, limit)
-            if not purchase_orders:
-                break
+        # Phase 1: stream all PO lines (next pages prefetched), collect distinct suppliers
+        for purchase_orders in self._pages(purchase_orders_url, fields=self.purchase_order_line_fields):
             all_purchase_orders.extend(purchase_orders)
-            if len(purchase_orders) < limit:
-                break
-            offset += limit
-            # time.sleep(1)  # To avoid hitting rate limits
 
             for po in purchase_orders:
-                print(po['supplier']['name'])
+                if po['supplier'] is not None and po['supplier']['id'] not in suppliers:
+                    suppliers[po['supplier']['id']] = po['supplier']['name']
 
-                # if po['supplier']['name'] == "ServiceNow Nederland B.V.":
-                #     enabled=True
+        print(f"{len(all_purchase_orders)} PO lines for {len(suppliers)} distinct suppliers, avoided {len(all_purchase_orders) - len(suppliers)} redundant contract retrievals")
 
-                # if enabled:
-                self.get_all_contracts_by_supplier(po['supplier']['id'], callback)
+        # Phase 2: retrieve contracts once per supplier
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(self.get_all_contracts_by_supplier, supplier_id, callback): name
+                    for supplier_id, name in suppliers.items()
+                }
+
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"Failed to retrieve contracts for supplier {futures[future]}: {e}")
+        else:
+            for supplier_id, name in suppliers.items():
+                print(name)
+                self.get_all_contracts_by_supplier(supplier_id, callback)
 
         return all_purchase_orders
 
@@ -441,79 +846,29 @@ class CoupaAPI:
 
     def get_all_contracts_by_supplier(self, supplier_id, callback=None):
         """Retrieve all contract IDs by iterating through all pages."""
-        offset = 0
-        limit = 50
+        if not self.access_token:
+            raise Exception("Access token not available. Call obtain_access_token() first.")
+
         all_contract_ids = []
 
-        while True:
-            contracts = self.get_contracts_by_supplier(supplier_id, offset=offset, limit=limit)     
+        contracts_url = self._contracts_by_supplier_url(supplier_id)
 
-            if not contracts or len(contracts) == 0:
-                break  # Exit loop if no more contracts are returned
+        for contracts in self._pages(contracts_url, fields=self.contract_fields):
 
-            #write it to file as formatted json
+            #download the documents of this page in the background, while the contracts are parsed
+            #(documents larger than max_document_size are skipped, leanix cannot handle those large files)
+            documents = self.download_documents(contracts)
+
+            #sanitize and stage each contract
             # for contract in self.filter_contracts(contracts):
             for contract in contracts:
-                                        
-                print(f"Contract ID: {contract['id']}, Contract Type: {contract['name']}, Category")
-
-                docFile = None
-
-                try:
-                        docFile = self.get_document(contract['id'])
-
-                        if docFile == False:
-                            docFile = None
-                except:
-                    docFile = None
-
-
-                lower = contract['name'].lower()
-                isAmendment = 'renewal' in lower or 'extension' in lower or 'amendment' in lower or 'addendum' in lower or 'revised' in lower or 'renewed' in lower or 'renew' in lower
-
-                #check if docFile is larger than 10mb, if so, then set to None
-                #(leanix cannot handle those large files)
-                if docFile is not None:
-                    if os.path.getsize(docFile) > 10*1024*1024:
-                        docFile = None
-
-                c = {
-                    'coupa_contract_id': contract['id'],
-                    'coupa_supplier_id': supplier_id,
-                    'name': contract['name'],
-                    'type': contract['type'],
-                    'owner_mail': contract['contract-owner']['email'],
-                    'owner_fullname': contract['contract-owner']['fullname'],
-                    'start-date': self.get_date( contract['start-date'] ),
-                    'end-date': self.get_date( contract['end-date'] ),
-                    'supplier': contract['supplier']['custom-fields']['harmonized-supplier-name'],
-                    'currency': contract['currency']['code'],
-                    'TCV': contract['custom-fields']['total-contract-value-in-eur'],
-                    'min-commitment': float(contract['min-commit']),
-                    'max-commitment': float(contract['max-commit']),
-                    'min-commitment-eur': self.convert_to_eur(float(contract['min-commit']), contract['currency']['code'].upper()),
-                    'max-commitment-eur': self.convert_to_eur(float(contract['max-commit']), contract['currency']['code'].upper()),
-                    'description': contract['description'],
-                    'document': docFile,
-                    'amendment': isAmendment,
-                    'url': contract['legal-agreement-url']
-                }
-
-                #make supplier path safe
-                fileSupplier = c['supplier'] = re.sub(r'[^a-zA-Z0-9]', '_', c['supplier'])
-
-                with open(f'contracts-{fileSupplier}-{c['coupa_contract_id']}.json', 'w') as f:
-                    f.write(json.dumps(c, indent=4))
-
+                c = self.build_contract(contract, self._document_result(documents[contract['id']]))
                 
                 # if "SCT" in c['name'] or "SuccessFactors" in c['name']:
                 if callback is not None:
                     callback(c)
 
-                        # exit()
-                
             all_contract_ids.extend([contract['id'] for contract in contracts])
-            offset += limit
 
-            #sleep for 5 seconds
-            time.sleep(1)
+        self.staging.flush()
+        self.flush_document_cache()
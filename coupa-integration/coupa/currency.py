@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import threading
+import requests
+from datetime import date, datetime, timedelta
+
+
+class ExchangeRates:
+    """
+    Exchange rates (from exchangeratesapi.io) with an on-disk cache, for converting amounts to EUR.
+
+    Latest rates are re-fetched after ttl, historical rates are kept per date forever.
+    A cache hit never makes a network call; when the API cannot be reached, the cached (stale) latest rates are used,
+    and for a historical date the rates of the nearest cached date (or the latest rates).
+
+    Usage:
+
+    rates = ExchangeRates(access_key)
+    rates.convert(100, "USD")                   # latest rate
+    rates.convert(100, "USD", "2024-01-31")     # rate of that date
+    rates.convert_batch([100, 200], ["USD", "GBP"], ["2024-01-31", None])
+    """
+    base_url = "https://api.exchangeratesapi.io/v1/"
+
+    def __init__(self, access_key, cache_file='rates.json', ttl=timedelta(hours=24), verify_ssl=True):
+        self.access_key = access_key
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.verify_ssl = verify_ssl
+
+        self._cache = None
+        self._lock = threading.RLock()
+        self._unavailable = {} # date -> fallback rates, for historical dates that failed to retrieve in this process
+
+    def _load(self):
+        if self._cache is not None:
+            return self._cache
+
+        try:
+            with open(self.cache_file, 'r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+
+        # rates.json as written before (the plain API response): use as stale latest rates
+        if 'rates' in cache:
+            cache = {'latest': {'fetched': 0, 'rates': cache['rates']}}
+
+        cache.setdefault('latest', None)
+        cache.setdefault('historical', {})
+
+        self._cache = cache
+        return cache
+
+    def _save(self):
+        # written to a temporary file first, such that an aborted run never leaves a truncated cache
+        temp_file = self.cache_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            f.write(json.dumps(self._cache, indent=4))
+
+        os.replace(temp_file, self.cache_file)
+
+    def _fetch(self, endpoint):
+        response = requests.get(self.base_url + endpoint, params={'access_key': self.access_key}, verify=self.verify_ssl)
+        response.raise_for_status()
+
+        result = response.json()
+        if 'rates' not in result:
+            raise Exception(f"Failed to retrieve exchange rates: {result}")
+
+        return result['rates']
+
+    def latest(self):
+        """Returns the latest rates (currency -> rate against EUR)."""
+        with self._lock:
+            cache = self._load()
+            latest = cache['latest']
+
+            if latest is not None and time.time() - latest['fetched'] < self.ttl.total_seconds():
+                return latest['rates']
+
+            try:
+                cache['latest'] = {'fetched': time.time(), 'rates': self._fetch('latest')}
+                self._save()
+            except Exception as e:
+                if latest is None:
+                    raise
+                print(f"Using cached exchange rates, failed to retrieve the latest: {e}")
+
+            return cache['latest']['rates']
+
+    def on(self, day):
+        """Returns the rates of a date (date, datetime or YYYY-MM-DD). Dates from today on use the latest rates."""
+        if day is None:
+            return self.latest()
+
+        if isinstance(day, datetime):
+            day = day.date()
+        elif isinstance(day, str):
+            day = date.fromisoformat(day[:10])
+
+        if day >= date.today():
+            return self.latest()
+
+        key = day.isoformat()
+
+        with self._lock:
+            cache = self._load()
+
+            if key in cache['historical']:
+                return cache['historical'][key]
+
+            if key in self._unavailable:
+                return self._unavailable[key]
+
+            try:
+                cache['historical'][key] = self._fetch(key)
+                self._save()
+                return cache['historical'][key]
+            except Exception as e:
+                # not cached, such that the date is retrieved again in a next run
+                self._unavailable[key] = self._fallback(day)
+                print(f"Using fallback exchange rates for {key}, failed to retrieve them: {e}")
+                return self._unavailable[key]
+
+    def _fallback(self, day):
+        """Rates of the cached date nearest to day, or the latest rates if no historical rates are cached."""
+        historical = self._load()['historical']
+
+        if len(historical) == 0:
+            return self.latest()
+
+        nearest = min(historical, key=lambda cached: abs((date.fromisoformat(cached) - day).days))
+        return historical[nearest]
+
+    def convert(self, amount, currency, day=None):
+        """Converts an amount in the given currency to EUR (rounded to two decimals)."""
+        return self.convert_batch([amount], [currency], [day])[0]
+
+    def convert_batch(self, amounts, currencies, days=None):
+        """
+        Converts lists of amounts/currencies/dates (None for latest) to EUR in one go.
+        Rates are looked up once per distinct date, the conversion itself needs no I/O.
+        """
+        if days is None:
+            days = [None] * len(amounts)
+
+        tables = {day: None for day in days}
+
+        # only dates with a foreign currency need rates
+        for day, currency in zip(days, currencies):
+            if tables[day] is None and currency not in ("EUR", "", None):
+                tables[day] = self.on(day)
+
+        result = []
+
+        for amount, currency, day in zip(amounts, currencies, days):
+            amount = float(amount)
+
+            if currency in ("EUR", "", None):
+                result.append(amount)
+                continue
+
+            rates = tables[day]
+            if currency not in rates:
+                raise ValueError(f"Currency {currency} not supported")
+
+            result.append(round(amount / rates[currency], 2))
+
+        return result
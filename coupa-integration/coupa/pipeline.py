@@ -0,0 +1,150 @@
+import time
+import queue
+import threading
+
+
+class _Stop:
+    pass
+
+
+_STOP = _Stop()
+
+
+class Stage:
+    """
+    A step in a Pipeline: fn is called for every item with the given number of worker threads.
+    fn returns the item for the next stage, or None to drop it.
+    """
+
+    def __init__(self, name, fn, workers=1):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.busy = 0.0 # seconds spent in fn, summed over the workers
+
+        self._lock = threading.Lock()
+
+    def _record(self, elapsed, result=None, error=False):
+        with self._lock:
+            self.busy += elapsed
+
+            if error:
+                self.errors += 1
+            elif result is None:
+                self.dropped += 1
+            else:
+                self.processed += 1
+
+
+class Pipeline:
+    """
+    Runs items from a source (iterable) through a sequence of stages, each with its own worker threads.
+    Stages are connected by bounded queues, such that a slow stage holds back the ones before it (back-pressure)
+    and at most queue_size items wait between two stages.
+
+    Usage:
+
+    pipeline = Pipeline([
+        Stage("download", coupa_api.fetch_document, workers=4),
+        Stage("transform", transformContract),
+        Stage("write", writeContract, workers=2),
+    ], queue_size=20)
+
+    pipeline.run(coupa_api.iter_contracts())
+    pipeline.report()
+    """
+
+    def __init__(self, stages, queue_size=20):
+        self.stages = stages
+        self.queue_size = queue_size
+
+        self.fetched = 0
+        self.fetch_time = 0.0
+        self.elapsed = 0.0
+
+    def _worker(self, stage, inbox, outbox):
+        while True:
+            item = inbox.get()
+
+            if item is _STOP:
+                # let the other workers of this stage stop as well
+                inbox.put(_STOP)
+                return
+
+            start = time.perf_counter()
+
+            try:
+                result = stage.fn(item)
+            except Exception as e:
+                stage._record(time.perf_counter() - start, error=True)
+                print(f"Pipeline stage {stage.name} failed: {e}")
+                continue
+
+            stage._record(time.perf_counter() - start, result)
+
+            if result is not None and outbox is not None:
+                outbox.put(result)
+
+    def run(self, source):
+        """
+        Feeds all items of source through the stages, returns when every item has passed the last stage.
+        """
+        start = time.perf_counter()
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = []
+
+        for i, stage in enumerate(self.stages):
+            outbox = queues[i + 1] if i + 1 < len(queues) else None
+
+            stage_threads = [
+                threading.Thread(target=self._worker, args=(stage, queues[i], outbox), name=f"{stage.name}-{n}", daemon=True)
+                for n in range(stage.workers)
+            ]
+            for thread in stage_threads:
+                thread.start()
+
+            threads.append(stage_threads)
+
+        try:
+            # the source is consumed on this thread, blocking when the first stage is full
+            items = iter(source)
+            while True:
+                fetch_start = time.perf_counter()
+                item = next(items, _STOP)
+                self.fetch_time += time.perf_counter() - fetch_start
+
+                if item is _STOP:
+                    break
+
+                self.fetched += 1
+                queues[0].put(item)
+        finally:
+            # drain stage by stage: a stage is done once all its workers saw the stop marker
+            for i, stage_threads in enumerate(threads):
+                queues[i].put(_STOP)
+
+                for thread in stage_threads:
+                    thread.join()
+
+            self.elapsed = time.perf_counter() - start
+
+    @property
+    def failed(self):
+        """Number of items that raised an error in any of the stages."""
+        return sum(stage.errors for stage in self.stages)
+
+    def report(self):
+        """Prints the throughput per stage."""
+        elapsed = self.elapsed if self.elapsed > 0 else 1e-9
+
+        print(f"Pipeline finished in {self.elapsed:.1f}s")
+        print(f"  {'fetch':<12} {self.fetched:6d} items  {self.fetched / elapsed:7.2f}/s  busy {self.fetch_time:7.1f}s")
+
+        for stage in self.stages:
+            print(f"  {stage.name:<12} {stage.processed:6d} items  {stage.processed / elapsed:7.2f}/s  busy {stage.busy:7.1f}s over {stage.workers} worker(s)"
+                  f"  ({stage.dropped} dropped, {stage.errors} failed)")
@@ -0,0 +1,203 @@
+import os
+import json
+import gzip
+import threading
+
+
+class ContractStaging:
+    """
+    Append-only staging file for sanitized contract records, one JSON record per line (JSONL).
+    Files ending with .gz are gzip compressed.
+
+    Next to the file an index (<file>.index.json) is kept with the offset of the latest record per contract id,
+    such that later stages and re-runs can look up a single contract or stream all of them.
+    Superseded records are dropped by rewriting the file (see compact()), on close() or once they exceed compact_ratio.
+
+    Usage:
+
+    staging = ContractStaging('contracts.jsonl')
+    staging.append(contract)
+    staging.flush()
+
+    staging.get(12345)
+    for contract in staging:
+        ...
+    """
+
+    compact_ratio = 0.5 # share of superseded records in the file at which flush() compacts it
+
+    def __init__(self, path='contracts.jsonl'):
+        self.path = path
+        self.index_path = path + '.index.json'
+        self.compressed = path.endswith('.gz')
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._index = None
+        self._size = 0 # uncompressed size of the staging file
+        self._records = 0 # records in the staging file, including superseded ones
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _open(self, mode):
+        if self.compressed:
+            return gzip.open(self.path, mode)
+
+        return open(self.path, mode)
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+
+        # the index is stale if the staging file was appended without writing it (i.e. an aborted run)
+        if index is not None and not self.compressed and os.path.exists(self.path) and os.path.getsize(self.path) != index['size']:
+            index = None
+
+        if index is not None and os.path.exists(self.path):
+            self._index = index['contracts']
+            self._size = index['size']
+            self._records = index.get('records', len(self._index))
+        else:
+            self._rebuild_index()
+
+    def _rebuild_index(self):
+        self._index = {}
+        self._size = 0
+        self._records = 0
+
+        if not os.path.exists(self.path):
+            return
+
+        with self._open('rb') as f:
+            for line in f:
+                record = json.loads(line)
+                self._index[str(record['coupa_contract_id'])] = self._size
+                self._size += len(line)
+                self._records += 1
+
+    def append(self, record):
+        """Appends a contract record (as created by the CoupaAPI contract loops), a later record replaces an earlier one."""
+        line = (json.dumps(record, default=str) + '\n').encode('utf-8')
+
+        with self._lock:
+            self._load_index()
+
+            if self._file is None:
+                self._file = self._open('ab')
+
+            self._file.write(line)
+
+            self._index[str(record['coupa_contract_id'])] = self._size
+            self._size += len(line)
+            self._records += 1
+
+    def flush(self, compact=False):
+        """Flushes the staging file and writes the index. Compacts the file if requested or superseded records exceed compact_ratio."""
+        with self._lock:
+            if self._file is not None:
+                # a gzip member can only be completed by closing it, appending continues in a new member
+                self._file.close()
+                self._file = None
+
+            if self._index is None:
+                return
+
+            superseded = self._records - len(self._index)
+
+            if superseded > 0 and (compact or superseded > self.compact_ratio * self._records):
+                self._compact()
+
+            with open(self.index_path, 'w') as f:
+                f.write(json.dumps({'size': self._size, 'records': self._records, 'contracts': self._index}))
+
+    def _compact(self):
+        """Rewrites the staging file with only the latest record per contract id (the file must be closed)."""
+        latest = {offset: contract_id for contract_id, offset in self._index.items()}
+
+        index = {}
+        size = 0
+
+        temp_path = self.path + '.tmp'
+        temp = gzip.open(temp_path, 'wb') if self.compressed else open(temp_path, 'wb')
+
+        with temp, self._open('rb') as f:
+            offset = 0
+
+            for line in f:
+                if offset in latest:
+                    temp.write(line)
+                    index[latest[offset]] = size
+                    size += len(line)
+
+                offset += len(line)
+
+        # the index is written after the file, an index that does not match is rebuilt (see _load_index)
+        os.replace(temp_path, self.path)
+
+        self._index = index
+        self._size = size
+        self._records = len(index)
+
+    def compact(self):
+        """Drops superseded records from the staging file."""
+        self.flush(compact=True)
+
+    def close(self):
+        self.flush(compact=True)
+
+    def __len__(self):
+        with self._lock:
+            self._load_index()
+            return len(self._index)
+
+    def __contains__(self, contract_id):
+        with self._lock:
+            self._load_index()
+            return str(contract_id) in self._index
+
+    def get(self, contract_id):
+        """Returns the latest record of a contract, or None."""
+        if self._file is not None:
+            self.flush()
+
+        with self._lock:
+            self._load_index()
+            offset = self._index.get(str(contract_id))
+
+        if offset is None:
+            return None
+
+        with self._open('rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def __iter__(self):
+        """Streams the latest record of every contract, in order of staging."""
+        if self._file is not None:
+            self.flush()
+
+        with self._lock:
+            self._load_index()
+            latest = set(self._index.values())
+
+        offset = 0
+
+        if not os.path.exists(self.path):
+            return
+
+        with self._open('rb') as f:
+            for line in f:
+                if offset in latest:
+                    yield json.loads(line)
+                offset += len(line)
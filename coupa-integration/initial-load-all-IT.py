@@ -12,70 +12,22 @@ if os.name == 'nt':
 from leanix.leanix import LeanIXAPI
 
 # Import the coupa API class
-from coupa.coupa import CoupaAPI
-
-appCache = None
-supplierCache = []
+from coupa.coupa import CoupaAPI, ContractDocument
+from coupa.classifier import ContractClassifier
+from coupa.pipeline import Pipeline, Stage
 
 def detectApp(description, supplier=None):
-    global appCache
-    global supplierCache
-
-    if appCache is None:
-        appCache = leanix_api.get_all("Application")
-        supplierCache = leanix_api.get_all("Provider")
-
-    description = description.lower()
-    supplier = supplier.lower()
-
     #detect if any of the apps - or its aliases (if present) - are in the description
     #detect also if any of the combinations of supplier and app are in the description
-
-    appId = None
+    #(single pass over the description, see leanix/matcher.py)
+    appId = leanix_api.application_matcher().match(description, supplier)
     domains = None
-    cnt = 0
-
-    for app in appCache:
-        searchStr = " " + app['name'].lower().replace(supplier + " ", "")
-
-        if searchStr in description:
-            appId = app['id']
-            cnt += 1
-
-        #search for aliases
-        if cnt == 0:
-            if 'alias' in app:
-                if app['alias'] is not None:
-                    if " " + app['alias'].lower() + " " in description:
-                        appId = app['id']
-                        cnt += 1
-
-        #search for supplier and app combination
-        if cnt == 0:
-            searchStr = " " + supplier + " " + app['name'].lower()
-            if searchStr in description:
-                appId = app['id']
-                cnt += 1
-
-            #search for aliases
-            if cnt == 0:
-                if 'alias' in app:
-                    if app['alias'] is not None:
-                        searchStr = " " + supplier + " " + app['alias'].lower()
-                        if searchStr in description:
-                            appId = app['id']
-                            cnt += 1
-
-    if cnt == 1:
+
+    if appId is not None:
         print("APP FOUND: " + str(appId))   
         # app is known, so source all the domain relationship from this app, if existing
         domains = leanix_api.get_relationships(appId, "Application", "relApplicationToDomain")
 
-        return appId, domains
-    else:
-        appId = None
-
-
     return appId, domains
 
 
@@ -106,9 +58,25 @@ def sanitize_title(title):
 
 leanix_api = None
 
+classifier = ContractClassifier()
+
 import datetime
 
 def parseContract(contract):
+    """Callback for CoupaAPI.get_all_contracts: transform, write and upload a single contract inline."""
+    item = transformContract(contract)
+
+    if item is not None:
+        try:
+            uploadDocument(writeContract(item))
+        except Exception as e:
+            print(e)
+
+
+def transformContract(contract):
+    """
+    Classifies a contract and prepares the create_contract arguments. Returns None for contracts that are not loaded.
+    """
     global leanix_api
  
     print(contract)
@@ -121,184 +89,15 @@ def parseContract(contract):
                 (" dpa " in contract['name'].lower() or "dpa-" in contract['name'].lower() or "fa&sow" in contract['name'].lower()):
         return        
     
-    searchTxt = (contract['name'] +  " " + contract['description']).lower()
-    ignore = ["dpa",
-              "nda",
-              "feedback agreement",
-              "service agreement",
-              "confidentialityagreement",
-              "confidentiality agreement"
-              "sap fa",
-              "sow-",
-              "dpa-",
-              ]
-    
-    for i in ignore:
-        if (" " + i + " " in searchTxt) or (" " + i + "-" in searchTxt) or (" " + i + ":" in searchTxt):
-            return
-        
-    
-    tagsToAdd = []
-        
-    isSoW = False
-    isUnclassified = True
-    isSupport = False
-    isLicense = False
-    isHardware = False
-    isTelephony = False 
-
-    searches = [
-        "sow",
-        "sow&fa",
-        "statement of work",
-        "delivery",
-        "implementation",
-        "project",
-        "consulting",
-        "consultancy",
-        "consultant",
-        "consultants",
-        "consultancy services",
-    ]
-
-    for i in searches:
-        if (" " + i + " " in searchTxt.replace("_", " ")) or (" " + i + "-" in searchTxt) or (" " + i + ":" in searchTxt):
-            isSoW = True
-            isUnclassified = False
-            break
-
-    searches = [
-        "support",
-        "maintenance",
-        "helpdesk",
-        "hours",
-        "service",
-        "sla",
-        "support",
-        "supporting"
-    ]
-
-    for i in searches:
-        if (" " + i + " " in searchTxt) or (" " + i + "-" in searchTxt) or (" " + i + ":" in searchTxt):
-            isSupport = True
-            isUnclassified = False
-            isSow = False
-            break
-
-    searches = [
-        "license",
-        "users",
-        "software",
-        "saas",
-        "subscription",
-        "tool"
-    ]
-
-    for i in searches:
-        if (" " + i + " " in searchTxt) or (" " + i + "-" in searchTxt) or (" " + i + ":" in searchTxt):
-            isLicense = True
-            isSow = False
-            isUnclassified = False
-            isSupport = False
-            break
+    #ignore list and category keywords are matched in a single pass (see coupa/classifier.py)
+    category = classifier.classify(contract)
 
-    
-    searches = [
-        "hardware",
-        "servers",
-        "device",
-        "server",
-        "devices",
-        "network",
-        "switch",
-        "router",
-        "firewall",
-        "storage",
-        "datacenter",
-        "data center",
-        "datacentre",
-        "printing",
-        "printer",
-        "printers",
-        "laptop",
-        "desktop",
-        "workstation",
-        "workstations",
-        "monitor",
-        "monitors",
-        "display",
-        "displays",
-        "keyboard",
-        "keyboards"                     
-    ]
+    if category is None:
+        return
 
     print(contract['supplier'], contract['name'])
 
- 
-    for i in searches:
-        if (" " + i + " " in searchTxt) or (" " + i + "-" in searchTxt) or (" " + i + ":" in searchTxt):
-            isLicense = False
-            isSow = False
-            isUnclassified = False
-            isSupport = False
-            isTelephony = False
-            isHardware = True
-            break
-
-
-    searches = [
-        "telephony",
-        "telephone",    
-        "telecom",
-        "telecommunications",        
-        "communications",
-        "phone",
-        "voip",
-        "mobile",
-        "fixed line",
-        "fixedline"
-    ]
-
-    
-    for i in searches:
-        if (i  in searchTxt.lower()) or (" " + i + "-" in searchTxt) or (" " + i + ":" in searchTxt):
-            isLicense = False
-            isSow = False
-            isUnclassified = False
-            isSupport = False
-            isHardware = False
-            isTelephony= True
-            break
-
-
-    telephonySuppliers = ["orange", "vodafone", "t-mobile", "telefonica", "kpn", "tele2", "british telecom"]
-
-    for i in telephonySuppliers:
-        if i in contract['supplier'].lower() + " " + contract['name'].lower():
-            isLicense = False
-            isSow = False
-            isUnclassified = False
-            isSupport = False
-            isHardware = False
-            isTelephony= True
-
-
-    if not isSoW and not isLicense and not isSupport and not isHardware and not isTelephony:
-        isUnclassified = True
-
-
-    if isSoW:
-        tagsToAdd.append(default_tags['sow'])
-    elif isLicense:
-        tagsToAdd.append(default_tags['license'])
-    elif isSupport:
-        tagsToAdd.append(default_tags['support'])
-    elif isHardware:
-        tagsToAdd.append(default_tags['hardware'])
-    elif isTelephony:
-        tagsToAdd.append(default_tags['telephony'])
-    else:
-        tagsToAdd.append(default_tags['unclassified'])
+    tagsToAdd = [default_tags[category]]
 
 
     contractName = contract['name']
@@ -335,48 +134,60 @@ def parseContract(contract):
 
     print(contract)
 
+    return {
+        'title': title,
+        'document': contract['document'],
+        'args': {
+            'name': title,
+            'supplierName': contract["supplier"],
+            'description': contract["description"],
+            'subtype': "Amendment" if contract["amendment"] else "MasterContract",
+            'isActive': True,
+            'isExpired': False,
+            'contractValue': contract["min-commitment-eur"],
+            'numberOfSeats': None,
+            'volumeType': "License",
+            'eol_date': contract['end-date'],
+            'active_date': contract['start-date'],
+            'phasein_date': None,
+            'notice_date': noticeDate,
+            'externalId': contract["coupa_contract_id"],
+            'externalUrl': contract["url"],
+            'applicationId': app,
+            'domains': domains,
+            'managedByName': contract['owner_fullname'],
+            'managedByEmail': contract['owner_mail'],
+            'currency': contract['currency'],
+            'additionalTags': tagsToAdd
+        }
+    }
+
+
+def writeContract(item):
     try:
+        item['contract_id'] = leanix_api.create_contract(**item['args'])
+    except Exception as e:
+        print("ERROR - " + item['title'])
+        raise
+
+    print(item['contract_id'])
+
+    return item
+
+
+def uploadDocument(item):
+    file = item['document']
 
-        contract_id = leanix_api.create_contract(\
-            name=title,\
-            supplierName=contract["supplier"],\
-            description=contract["description"],\
-            subtype="Amendment" if contract["amendment"] else "MasterContract",\
-            isActive=True,\
-            isExpired=False,\
-            contractValue=contract["min-commitment-eur"],\
-            numberOfSeats=None,\
-            volumeType="License",\
-            eol_date=contract['end-date'],\
-            active_date=contract['start-date'],\
-            phasein_date=None,\
-            notice_date=noticeDate,\
-            externalId=contract["coupa_contract_id"],\
-            externalUrl=contract["url"],\
-            applicationId=app,\
-            domains=domains,\
-            managedByName=contract['owner_fullname'],\
-            managedByEmail=contract['owner_mail'],\
-            currency=contract['currency'],\
-            additionalTags=tagsToAdd
-        )
-
-        print(contract_id)
-
-        file = contract['document']
-
-        if file is not None:
+    if file is not None:
+        if isinstance(file, ContractDocument):
+            basename, file = file.name, file.content
+        else:
             basename = os.path.basename(file)
-            leanix_api.upload_resource_to_factsheet(contract_id, file, basename, "documentation", "Contract document")
-    
-    except Exception as e:
-        print("ERROR - " + title)
-        print(e)
-    
-    print("OK - " + title)
+        leanix_api.upload_resource_to_factsheet(item['contract_id'], file, basename, "documentation", "Contract document")
 
-    
-    
+    print("OK - " + item['title'])
+
+    return item
 
 
 if __name__ == "__main__":
@@ -384,7 +195,7 @@ if __name__ == "__main__":
     client_id = '<clientid>'
     client_secret = '<secret>'
 
-    coupa_api = CoupaAPI(domain=coupa_domain, client_id=client_id, client_secret=client_secret, verify_ssl=False)
+    coupa_api = CoupaAPI(domain=coupa_domain, client_id=client_id, client_secret=client_secret, verify_ssl=False, in_memory_documents=True)
     coupa_api.obtain_access_token()
 
     leanix_token = '<token>'
@@ -393,7 +204,10 @@ if __name__ == "__main__":
 
     leanix_api = LeanIXAPI(leanix_token, leanix_auth_url, leanix_request_url)
 
-    contracts = leanix_api.get_all("Contract")
+    # Providers are matched on harmonized names (without legal suffixes)
+    leanix_api.provider_resolver(normalize=CoupaAPI.harmonize_company_name)
+
+    contracts = leanix_api.get_all("Contract", fields=["externalId"])
 
     #extract id only
     contract_ids_to_exclude = []
@@ -443,7 +257,25 @@ if __name__ == "__main__":
     
     
     
-    coupa_api.get_all_contracts(callback=parseContract, excludeId=contract_ids_to_exclude, filteringCategory=124452)
+    # Coupa paging, document download, transformation, LeanIX writes and uploads run as separate stages,
+    # such that the network legs of both systems overlap. Providers are resolved by create_contract in the write stage,
+    # i.e. only for contracts that pass transformContract
+    pipeline = Pipeline([
+        Stage("download", coupa_api.fetch_document, workers=4),
+        Stage("transform", lambda item: transformContract(coupa_api.build_contract(*item))),
+        Stage("write", writeContract, workers=2),
+        Stage("upload", uploadDocument, workers=2),
+    ], queue_size=20)
+
+    pipeline.run(coupa_api.iter_contracts(excludeId=contract_ids_to_exclude, filteringCategory=124452, sinceLastSync=True))
+    pipeline.report()
+
+    coupa_api.staging.close()
+    coupa_api.flush_document_cache()
+
+    # failed contracts are retried on the next sync
+    if pipeline.failed == 0:
+        coupa_api.commit_watermark()
     
     # leanix_api.delete_contracts_with_tag(default_tags["unclassified"])
 
@@ -12,70 +12,21 @@ if os.name == 'nt':
 from leanix.leanix import LeanIXAPI
 
 # Import the coupa API class
-from coupa.coupa import CoupaAPI
-
-appCache = None
-supplierCache = []
+from coupa.coupa import CoupaAPI, ContractDocument
+from coupa.classifier import ContractClassifier
 
 def detectApp(description, supplier=None):
-    global appCache
-    global supplierCache
-
-    if appCache is None:
-        appCache = leanix_api.get_all("Application")
-        supplierCache = leanix_api.get_all("Provider")
-
-    description = description.lower()
-    supplier = supplier.lower()
-
     #detect if any of the apps - or its aliases (if present) - are in the description
     #detect also if any of the combinations of supplier and app are in the description
-
-    appId = None
+    #(single pass over the description, see leanix/matcher.py)
+    appId = leanix_api.application_matcher().match(description, supplier)
     domains = None
-    cnt = 0
-
-    for app in appCache:
-        searchStr = " " + app['name'].lower().replace(supplier + " ", "")
-
-        if searchStr in description:
-            appId = app['id']
-            cnt += 1
-
-        #search for aliases
-        if cnt == 0:
-            if 'alias' in app:
-                if app['alias'] is not None:
-                    if " " + app['alias'].lower() + " " in description:
-                        appId = app['id']
-                        cnt += 1
-
-        #search for supplier and app combination
-        if cnt == 0:
-            searchStr = " " + supplier + " " + app['name'].lower()
-            if searchStr in description:
-                appId = app['id']
-                cnt += 1
-
-            #search for aliases
-            if cnt == 0:
-                if 'alias' in app:
-                    if app['alias'] is not None:
-                        searchStr = " " + supplier + " " + app['alias'].lower()
-                        if searchStr in description:
-                            appId = app['id']
-                            cnt += 1
-
-    if cnt == 1:
+
+    if appId is not None:
         print("APP FOUND: " + str(appId))   
         # app is known, so source all the domain relationship from this app, if existing
         domains = leanix_api.get_relationships(appId, "Application", "relApplicationToDomain")
 
-        return appId, domains
-    else:
-        appId = None
-
-
     return appId, domains
 
 
@@ -106,6 +57,22 @@ def sanitize_title(title):
 
 leanix_api = None
 
+# only the ignore list is used for this load, contracts are not categorized
+ignoreClassifier = ContractClassifier(ignore=["dpa",
+              "nda",
+              "sow",
+              "fa",
+              "feedback agreement",
+              "service agreement",
+              "confidentialityagreement",
+              "confidentiality agreement",
+              "sap fa",
+              "fa-",
+              "sow-",
+              "dpa-",
+              "fa&sow"
+              ], rules=[], telephony_suppliers=[])
+
 import datetime
 
 def parseContract(contract):
@@ -121,25 +88,8 @@ def parseContract(contract):
                     (" dpa " in contract['name'].lower() or "dpa-" in contract['name'].lower() or "fa&sow" in contract['name'].lower()):
         return        
     
-    searchTxt = (contract['name'] +  " " + contract['description']).lower()
-    ignore = ["dpa",
-              "nda",
-              "sow",
-              "fa",
-              "feedback agreement",
-              "service agreement",
-              "confidentialityagreement",
-              "confidentiality agreement"
-              "sap fa",
-              "fa-",
-              "sow-",
-              "dpa-",
-              "fa&sow"
-              ]
-    
-    for i in ignore:
-        if (" " + i + " " in searchTxt) or (" " + i + "-" in searchTxt) or (" " + i + ":" in searchTxt):
-            return
+    if ignoreClassifier.classify(contract) is None:
+        return
 
 
 
@@ -207,7 +157,10 @@ def parseContract(contract):
         file = contract['document']
 
         if file is not None:
-            basename = os.path.basename(file)
+            if isinstance(file, ContractDocument):
+                basename, file = file.name, file.content
+            else:
+                basename = os.path.basename(file)
             leanix_api.upload_resource_to_factsheet(contract_id, file, basename, "documentation", "Contract document")
     
     except Exception as e:
@@ -225,7 +178,7 @@ if __name__ == "__main__":
     client_secret = '<your secret>'
 
 
-    coupa_api = CoupaAPI(domain=coupa_domain, client_id=client_id, client_secret=client_secret, verify_ssl=False)
+    coupa_api = CoupaAPI(domain=coupa_domain, client_id=client_id, client_secret=client_secret, verify_ssl=False, in_memory_documents=True)
     coupa_api.obtain_access_token()
 
     leanix_token = '<your api key>'
@@ -234,6 +187,9 @@ if __name__ == "__main__":
 
     leanix_api = LeanIXAPI(leanix_token, leanix_auth_url, leanix_request_url)
 
+    # Providers are matched on harmonized names (without legal suffixes)
+    leanix_api.provider_resolver(normalize=CoupaAPI.harmonize_company_name)
+
 
 
     coupa_api.get_all_purchase_orders_by_commodity(callback=parseContract)
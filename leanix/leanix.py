@@ -1,19 +1,22 @@
-import pprint
 from datetime import datetime,timezone, timedelta
 
-from gql import Client, gql
-from gql.transport.requests import RequestsHTTPTransport
-from gql.transport.exceptions import TransportServerError
-
+import io
 import os
 import json
+import functools
+import threading
 import requests
 import warnings
 from urllib3.exceptions import InsecureRequestWarning
 
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type, before_sleep_log, retry_if_exception
 import logging
 
+from leanix.writebuffer import FactsheetWriteBuffer
+from leanix.singleflight import SingleFlight
+from leanix.matcher import ApplicationMatcher
+from leanix.providers import ProviderResolver
+from leanix.uniqueness import UniquenessIndex
+
 # Set up logging to see the retry attempts
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
@@ -22,10 +25,49 @@ logger = logging.getLogger(__name__)
 # Suppress only the InsecureRequestWarning from urllib3
 warnings.simplefilter('ignore', InsecureRequestWarning)
 
+
+# gql (graphql-core) and tenacity are imported on first use, as importing them is a large part of the
+# start-up time of a runbook (see benchmarks/leanix-startup.py)
+
+def gql(document):
+    """Parses a GraphQL document, importing gql on first use."""
+    from gql import gql as parse
+    return parse(document)
+
+
+def retry(attempts=3, max_wait=60):
+    """
+    Retry with exponential backoff on any requests exception, like tenacity's @retry used across this repo,
+    but tenacity is only imported when the decorated method is called for the first time.
+    """
+    def decorator(fn):
+        retrying = None
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            nonlocal retrying
+
+            if retrying is None:
+                from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type, before_sleep_log
+
+                retrying = retry(
+                    stop=stop_after_attempt(attempts),
+                    wait=wait_exponential(multiplier=1, min=2, max=max_wait),  # Exponential backoff: wait 2^x * 1 (where x is the attempt number)
+                    retry=retry_if_exception_type(requests.exceptions.RequestException),  # Retry on any requests exceptions
+                    before_sleep=before_sleep_log(logger, logging.INFO)  # Log before retrying
+                )(fn)
+
+            return retrying(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
 class LeanIXAPI:
-    _coupa_tag = None
-    _active_tag = None
-    _expired_tag = None
+
+    batch_size = 100 # number of factsheets retrieved per aliased GraphQL query in the *_by_ids methods
+    alias_types = ("Application",) # factsheet types with an alias field, selected by get_all when fields contains "alias"
 
     def __init__(self, api_token, auth_url, request_url, metrics_url=None, search_base_url=None):
         self.api_token = api_token
@@ -34,18 +76,30 @@ class LeanIXAPI:
         self.metrics_url = metrics_url
         self.search_base_url = search_base_url
 
-        self._authenticate()
-        self.header['x-graphql-enable-extensions'] = 'true'
+        # identical concurrent reads share one request (see _call and batch())
+        self._single_flight = SingleFlight()
+
         self.upload_url = self.request_url + '/upload'
 
-        for tag in self.all_tags():
-            if tag['node']['name'] == "Coupa":
-                self._coupa_tag = tag['node']['id']
-            if tag['node']['name'] == "Active":
-                self._active_tag = tag['node']['id']
-            if tag['node']['name'] == "Expired":
-                self._expired_tag = tag['node']['id']
+        # authentication, tags and GraphQL clients are loaded on first use, keeping the constructor free of requests
+        self._header = None
+        self._tags = None
+        self._application_matcher = None
+        self._provider_resolver = None
+        self._uniqueness_indexes = {}
+        self._uniqueness_lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def header(self):
+        if self._header is None:
+            self._authenticate()
+
+        return self._header
 
+    @header.setter
+    def header(self, value):
+        self._header = value
 
     def _authenticate(self):
         # Get the bearer token
@@ -53,16 +107,116 @@ class LeanIXAPI:
                                  data={'grant_type': 'client_credentials'}, verify=False)
         response.raise_for_status()
         access_token = response.json()['access_token']
-        self.header = {'Authorization': 'Bearer ' + access_token}
+        self.header = {'Authorization': 'Bearer ' + access_token, 'x-graphql-enable-extensions': 'true'}
 
         return self.header
+
+    def _gql_client(self, url=None):
+        """
+        Returns a GraphQL client for the given url (default: request_url).
+        Clients are cached per thread and rebuilt after re-authentication, such that the schema is only fetched once.
+        """
+        from gql import Client
+        from gql.transport.requests import RequestsHTTPTransport
+
+        if url is None:
+            url = self.request_url
+
+        header = self.header
+
+        clients = getattr(self._local, 'clients', None)
+        if clients is None:
+            clients = self._local.clients = {}
+
+        if url not in clients or clients[url][0] is not header:
+            # Create the transport with the given headers
+            transport = RequestsHTTPTransport(
+                url=url,
+                headers=header,
+                use_json=True,
+                verify=False
+            )
+
+            # Create a GraphQL client
+            clients[url] = (header, Client(transport=transport, fetch_schema_from_transport=True))
+
+        return clients[url][1]
+
+    def tag_registry(self, refresh=False):
+        """
+        Returns all tags as dict of tag name -> tag ID. Loaded on first use and cached.
+        """
+        if self._tags is None or refresh:
+            self._tags = {tag['node']['name']: tag['node']['id'] for tag in self.all_tags()}
+
+        return self._tags
+
+    def application_matcher(self, refresh=False):
+        """
+        Returns an ApplicationMatcher over the names and aliases of all Applications. Built on first use and cached.
+        """
+        if self._application_matcher is None or refresh:
+            self._application_matcher = ApplicationMatcher(self.get_all("Application", fields=["alias"]))
+
+        return self._application_matcher
+
+    def provider_resolver(self, normalize=None):
+        """
+        Returns the ProviderResolver used by create_contract. Providers are loaded on first use and cached.
+
+        Args:
+            normalize (function): Optional. Harmonizes supplier/provider names before lookup (i.e. CoupaAPI.harmonize_company_name),
+                                  set when the resolver is created. Passing a different one afterwards raises a ValueError.
+        """
+        if self._provider_resolver is None:
+            self._provider_resolver = ProviderResolver(self, normalize)
+        elif normalize is not None and normalize != self._provider_resolver.normalize:
+            raise ValueError("The provider resolver was already created with another normalize function")
+
+        return self._provider_resolver
+
+    def uniqueness_index(self, type, refresh=False):
+        """
+        Returns the UniquenessIndex (factsheets by name and provider) of a factsheet type. Loaded on first use and cached.
+        """
+        with self._uniqueness_lock:
+            if type not in self._uniqueness_indexes:
+                self._uniqueness_indexes[type] = UniquenessIndex(self, type)
+
+        if refresh:
+            self._uniqueness_indexes[type].refresh()
+
+        return self._uniqueness_indexes[type]
+
+    def resolve_or_create(self, type, name, subtype=None, provider_id=None, patches=None, alternatives=[]):
+        """
+        Returns the ID of the factsheet with the name (or one of the alternative names) and provider,
+        creating it (with the provider relation and patches) only if the name is not taken yet.
+        See leanix/uniqueness.py.
+        """
+        factsheet_id, _ = self.uniqueness_index(type).resolve_or_create(name, subtype, provider_id, patches, alternatives)
+
+        return factsheet_id
+
+    def get_tag_id(self, name):
+        """
+        Returns the ID of the tag with the given name, None if it does not exist.
+        """
+        return self.tag_registry().get(name)
+
+    @property
+    def _coupa_tag(self):
+        return self.get_tag_id("Coupa")
+
+    @property
+    def _active_tag(self):
+        return self.get_tag_id("Active")
+
+    @property
+    def _expired_tag(self):
+        return self.get_tag_id("Expired")
     
-    @retry(
-        stop=stop_after_attempt(3),  # Stop after 5 attempts
-        wait=wait_exponential(multiplier=1, min=2, max=60),  # Exponential backoff: wait 2^x * 1 (where x is the attempt number)
-        retry=retry_if_exception_type(requests.exceptions.RequestException),  # Retry on any requests exceptions
-        before_sleep=before_sleep_log(logger, logging.INFO)  # Log before retrying
-    )
+    @retry()
     def _call_generic(self, url, method="GET", payload=None):
         try:
             if method == "GET":
@@ -150,14 +304,122 @@ class LeanIXAPI:
         print(response)
         return None
 
+    def _chunks(self, items, chunk_size=None):
+        if chunk_size is None:
+            chunk_size = self.batch_size
+
+        items = list(dict.fromkeys(items)) # de-duplicate, keep order
+
+        for i in range(0, len(items), chunk_size):
+            yield items[i:i + chunk_size]
+
+    def _get_factsheets_batched(self, factsheet_ids, fields, chunk_size=None):
+        """
+        Retrieve many factsheets using one aliased GraphQL query per chunk of IDs, i.e.:
+
+        {
+            f0: factSheet(id: "...") { id ... }
+            f1: factSheet(id: "...") { id ... }
+        }
+
+        Args:
+            factsheet_ids (list): The IDs of the factsheets.
+            fields (str): The GraphQL fields to retrieve for every factsheet.
+            chunk_size (int): Optional. Number of factsheets per request, defaults to LeanIXAPI.batch_size.
+
+        Returns:
+            dict: factsheet ID -> factsheet data (None if not found). Raises an exception if a chunk
+            could not be retrieved, such that a failed lookup is never mistaken for a missing factsheet.
+        """
+        result = {}
+
+        for chunk in self._chunks(factsheet_ids, chunk_size):
+            aliases = "\n".join(
+                f'f{i}: factSheet(id: "{factsheet_id}") {{ {fields} }}' for i, factsheet_id in enumerate(chunk)
+            )
+
+            response = self._call("{\n" + aliases + "\n}")
+
+            data = response.get('data')
+            errors = response.get('errors') or []
+
+            # errors on single aliases (i.e. a factsheet that does not exist) leave that alias null,
+            # without data or with an error on the whole query the lookup failed: not the same as "not found"
+            if data is None or any(not error.get('path') for error in errors):
+                raise Exception(f"Failed to retrieve factsheets: {errors}")
+
+            for error in errors:
+                print(f"Factsheet lookup error: {error.get('message')} ({'.'.join(str(part) for part in error['path'])})")
+
+            for i, factsheet_id in enumerate(chunk):
+                result[factsheet_id] = data.get(f"f{i}")
+
+        return result
+
+    def get_factsheets_by_ids(self, factsheet_ids, fields=None, chunk_size=None):
+        """
+        Retrieve many factsheets by their IDs, batched (see get_factsheet_by_id for a single factsheet).
+
+        Args:
+            factsheet_ids (list): The IDs of the factsheets.
+            fields (str): Optional. Additional GraphQL fields to retrieve, formatted as a string.
+            chunk_size (int): Optional. Number of factsheets per request.
+
+        Returns:
+            dict: factsheet ID -> factsheet data (None if not found)
+        """
+        if fields is None:
+            fields = ""
+
+        fields = f"""
+            id
+            name
+            type
+            description
+            status
+            category
+            {fields}
+        """
+
+        return self._get_factsheets_batched(factsheet_ids, fields, chunk_size)
+
 
-    @retry(
-        stop=stop_after_attempt(3),  # Stop after 5 attempts
-        wait=wait_exponential(multiplier=1, min=2, max=60),  # Exponential backoff: wait 2^x * 1 (where x is the attempt number)
-        retry=retry_if_exception_type(requests.exceptions.RequestException),  # Retry on any requests exceptions
-        before_sleep=before_sleep_log(logger, logging.INFO)  # Log before retrying
-    )
     def _call(self, query, dump=True):
+        """
+        Executes a GraphQL query (string). Reads are de-duplicated: concurrent identical queries share one request,
+        and within batch() results are memoized. Mutations are always sent and invalidate memoized reads.
+        """
+        if self._is_mutation(query):
+            self._single_flight.invalidate()
+            return self._post_query(query, dump)
+
+        return self._single_flight.do(self._normalize_query(query), lambda: self._post_query(query, dump))
+
+    def _is_mutation(self, query):
+        return query.lstrip().startswith("mutation")
+
+    def _normalize_query(self, query, variables=None):
+        key = " ".join(query.split())
+
+        if variables is not None:
+            key += json.dumps(variables, sort_keys=True)
+
+        return key
+
+    def batch(self):
+        """
+        Memoize identical reads for the duration of a with-block, i.e.:
+
+        with leanix_api.batch():
+            for contract in contracts:
+                leanix_api.find_by_name("Provider", contract['supplier'])  # one request per distinct supplier
+
+        Memoized reads are dropped whenever a write is done through this class.
+        """
+        return self._single_flight.memoize()
+
+    @retry()
+    def _post_query(self, query, dump=True):
         data = {"query": query}
 
         if dump:
@@ -177,7 +439,7 @@ class LeanIXAPI:
                     if response.status_code == 401:
                         print("Unauthorized. Re-authenticating...")
                         self.header = self._authenticate()
-                        return self._call(query, dump)
+                        return self._post_query(query, dump)
                     else:
                         response.raise_for_status()        
             
@@ -189,7 +451,7 @@ class LeanIXAPI:
                     if response.status_code == 401:
                         print("Unauthorized. Re-authenticating...")
                         self.header = self._authenticate()
-                        return self._call(query, dump)
+                        return self._post_query(query, dump)
                     else:
                         # print(response.text)
                         pass
@@ -200,19 +462,67 @@ class LeanIXAPI:
         return response.json()
 
     def retry_if_http_421(exception):
+        from gql.transport.exceptions import TransportServerError
+
         if isinstance(exception, TransportServerError):
             if exception.http_status == 421:
                 return True
         return False
 
 
-    @retry(
-        stop=stop_after_attempt(3),  # Stop after 3 attempts
-        wait=wait_exponential(multiplier=1, min=2, max=60),  # Exponential backoff
-        retry=retry_if_exception_type(requests.exceptions.RequestException),  # Retry on any requests exceptions
-        before_sleep=before_sleep_log(logger, logging.INFO)  # Log before retrying
-    )
-    def create_factsheet(self, type, name, subtype=None):
+    def create_factsheets(self, type, names, subtype=None, chunk_size=None):
+        """
+        Create many factsheets using one aliased mutation per chunk of names, i.e.:
+
+        mutation {
+            c0: createFactSheet(input: {name: "...", type: Provider}, patches: [...]) { factSheet { id } }
+            c1: createFactSheet(input: {name: "...", type: Provider}, patches: [...]) { factSheet { id } }
+        }
+
+        Args:
+            type (str): The factsheet type.
+            names (list): The names of the factsheets to create.
+            subtype (str): Optional. The category of the factsheets.
+            chunk_size (int): Optional. Number of factsheets per request, defaults to LeanIXAPI.batch_size.
+
+        Returns:
+            dict: name -> ID of the created factsheet (None if it could not be created, i.e. the name is taken).
+            Raises an exception if a chunk failed as a whole.
+        """
+        patches = ""
+        if subtype:
+            patches = ', patches: [{op: replace, path: "/category", value: %s}]' % json.dumps(subtype)
+
+        result = {}
+
+        for chunk in self._chunks(names, chunk_size):
+            print(f"Creating {len(chunk)} {type} factsheets")
+
+            # names as JSON strings, which are valid GraphQL string literals
+            aliases = "\n".join(
+                f'c{i}: createFactSheet(input: {{name: {json.dumps(name)}, type: {type}}}{patches}) {{ factSheet {{ id }} }}'
+                for i, name in enumerate(chunk)
+            )
+
+            response = self._call("mutation {\n" + aliases + "\n}")
+
+            data = response.get('data')
+            errors = response.get('errors') or []
+
+            if data is None or any(not error.get('path') for error in errors):
+                raise Exception(f"Failed to create factsheets: {errors}")
+
+            for error in errors:
+                print(f"Factsheet create error: {error.get('message')} ({'.'.join(str(part) for part in error['path'])})")
+
+            for i, name in enumerate(chunk):
+                created = data.get(f"c{i}")
+                result[name] = created['factSheet']['id'] if created is not None else None
+
+        return result
+
+    @retry()
+    def create_factsheet(self, type, name, subtype=None, patches=None):
         # Create the GraphQL mutation with or without the patches for category
         mutation = """
         mutation($input: BaseFactSheetInput!, $patches: [Patch]) {
@@ -254,19 +564,15 @@ class LeanIXAPI:
                 "patches": []
             }
             print(f"Creating {type}: {name}")
-        
-        # Create the transport with the given headers
-        transport = RequestsHTTPTransport(
-            url=self.request_url,
-            headers=self.header,
-            use_json=True,
-            verify=False
-        )
 
-        # Create a GraphQL client
-        client = Client(transport=transport, fetch_schema_from_transport=True)
+        # Additional patches are applied as part of the creation (i.e. tags, relations, fields)
+        if patches:
+            variables["patches"].extend(patches)
+        
+        client = self._gql_client()
 
         # Execute the mutation
+        self._single_flight.invalidate()
         response = client.execute(gql(mutation), variable_values=variables)
 
         # Handle error
@@ -276,23 +582,14 @@ class LeanIXAPI:
 
         return response['createFactSheet']['factSheet']['id']
         
-    @retry(
-        stop=stop_after_attempt(20),  # Stop after 3 attempts
-        wait=wait_exponential(multiplier=1, min=2, max=500),  # Exponential backoff
-        retry=retry_if_exception_type(requests.exceptions.RequestException),  # Retry on any requests exceptions
-        before_sleep=before_sleep_log(logger, logging.INFO)  # Log before retrying
-    )
+    @retry(attempts=20, max_wait=500)
     def _gql_call(self, url, graphQL, variables):
-        # Create the transport with the given headers
-        transport = RequestsHTTPTransport(
-            url=url,
-            headers=self.header,
-            use_json=True,
-            verify=False
-        )
+        from gql.transport.exceptions import TransportServerError
 
-        # Create a GraphQL client
-        client = Client(transport=transport, fetch_schema_from_transport=True)
+        client = self._gql_client(url)
+
+        # mostly used for mutations, so drop memoized reads
+        self._single_flight.invalidate()
 
         try:
             # Execute the mutation
@@ -322,12 +619,7 @@ class LeanIXAPI:
             raise
 
 
-    @retry(
-        stop=stop_after_attempt(3),  # Stop after 3 attempts
-        wait=wait_exponential(multiplier=1, min=2, max=60),  # Exponential backoff
-        retry=retry_if_exception_type(requests.exceptions.RequestException),  # Retry on any requests exceptions
-        before_sleep=before_sleep_log(logger, logging.INFO)  # Log before retrying
-    )
+    @retry()
     def modify_factsheet(self, factsheet_id, patches):
         # Create the GraphQL mutation
         mutation = gql("""
@@ -369,18 +661,23 @@ class LeanIXAPI:
             return response['data']['factSheet']['type']
         else:
             return None
+
+    def get_factsheet_types_by_ids(self, factsheet_ids, chunk_size=None):
+        """
+        Returns a dict of factsheet ID -> type (None if not found), batched.
+        """
+        factsheets = self._get_factsheets_batched(factsheet_ids, "id type", chunk_size)
+
+        return {
+            factsheet_id: fs['type'] if fs is not None else None
+            for factsheet_id, fs in factsheets.items()
+        }
         
     def create_if_not_exists(self, type, name, subtype=None, createAsChildOf=None, relationshipName=None, cost=None):
-        factsheet_id = self.find_by_name(type, name)
-
-        precreated=False
+        # resolved locally (see uniqueness_index), a taken name is never created twice
+        fs_id, created = self.uniqueness_index(type).resolve_or_create(name, subtype)
 
-        fs_id = None
-        if factsheet_id:
-            precreated=True
-            fs_id = factsheet_id
-        else:
-            fs_id = self.create_factsheet(type, name, subtype)
+        precreated = not created
 
         try:
             # detect if we need to create a relationship
@@ -421,6 +718,21 @@ class LeanIXAPI:
             print(f"Error checking factsheet existence: {e}")
             return False
 
+    def factsheets_exist(self, factsheet_ids, chunk_size=None):
+        """
+        Check for many factsheets if they exist, batched.
+
+        Returns:
+            dict: factsheet ID -> True if the factsheet exists, False otherwise.
+        """
+        try:
+            types = self.get_factsheet_types_by_ids(factsheet_ids, chunk_size)
+        except Exception as e:
+            print(f"Error checking factsheet existence: {e}")
+            return {factsheet_id: False for factsheet_id in factsheet_ids}
+
+        return {factsheet_id: kind is not None for factsheet_id, kind in types.items()}
+
     
     def _custom_json_format(self,value_dict):
         # Build the inner JSON string with proper escaping
@@ -613,6 +925,48 @@ class LeanIXAPI:
             }
             for relationship in relationships if relationship.get('node', {}).get('factSheet')
         ]
+
+    def get_relationships_by_ids(self, factsheet_ids, source, target, chunk_size=None):
+        """
+        Batched version of get_relationships.
+
+        Returns:
+            dict: factsheet ID -> list of related factsheets ({'id', 'name'}), None if the factsheet was not found.
+        """
+        fields = """
+            id
+            ... on %s {
+                %s {
+                    edges {
+                        node {
+                            factSheet {
+                                id
+                                name
+                            }
+                        }
+                    }
+                }
+            }
+        """ % (source, target)
+
+        result = {}
+
+        for factsheet_id, fact_sheet in self._get_factsheets_batched(factsheet_ids, fields, chunk_size).items():
+            if fact_sheet is None:
+                result[factsheet_id] = None
+                continue
+
+            relationships = (fact_sheet.get(target) or {}).get('edges', [])
+
+            result[factsheet_id] = [
+                {
+                    'id': relationship['node']['factSheet']['id'],
+                    'name': relationship['node']['factSheet']['name']
+                }
+                for relationship in relationships if relationship.get('node', {}).get('factSheet')
+            ]
+
+        return result
     
     def get_relationship_ids(self, factsheet_id, factsheet_type, relationship_name):    
         query = """
@@ -668,17 +1022,79 @@ class LeanIXAPI:
 
 
 
-    def get_all_components(self, ignoreHomegrown=True):
-        query = """
-        {
-            allFactSheets(filter: {facetFilters: [{facetKey: "FactSheetTypes", keys: ["ITComponent"]}]}) {
-                edges {
-                    node {
-                        ... on ITComponent {
-                            id
-                            name
-                            isOpenSource
+    def _as_list(self, value):
+        if value is None:
+            return []
+        if isinstance(value, (list, tuple, set)):
+            return list(value)
+        return [value]
+
+    def _tag_ids(self, tags):
+        """
+        Resolve tag names (or IDs) to tag IDs, as the _TAGS_ facet only accepts IDs.
+        """
+        tags = self._as_list(tags)
+        if len(tags) == 0:
+            return []
+
+        ids = []
+        registry = self.tag_registry()
+        known = set(registry.values())
+
+        for tag in tags:
+            if tag in registry:
+                ids.append(registry[tag])
+            elif tag in known:
+                ids.append(tag)
+            else:
+                raise ValueError(f"Tag {tag} does not exist in LeanIX")
+
+        return ids
+
+    def _facet_filters(self, type, category=None, tags=None, lifecycle=None):
+        """
+        Builds the facetFilters for allFactSheets, such that filtering happens server-side.
+
+        Args:
+            type (str): The factsheet type.
+            category (str|list): Optional. Subtype(s), i.e. "website". Any of them matches.
+            tags (str|list): Optional. Tag names or IDs. All of them must be present.
+            lifecycle (str|list): Optional. Current lifecycle phase(s), i.e. "active". Any of them matches.
+
+        Returns:
+            str: The facetFilters as GraphQL literal.
+        """
+        def keys(values):
+            return ", ".join(json.dumps(v) for v in values)
+
+        filters = ['{facetKey: "FactSheetTypes", keys: [%s]}' % keys([type])]
+
+        if category:
+            filters.append('{facetKey: "category", keys: [%s]}' % keys(self._as_list(category)))
+
+        tag_ids = self._tag_ids(tags)
+        if len(tag_ids) > 0:
+            filters.append('{facetKey: "_TAGS_", operator: AND, keys: [%s]}' % keys(tag_ids))
+
+        if lifecycle:
+            filters.append('{facetKey: "lifecycle", operator: OR, keys: [%s]}' % keys(self._as_list(lifecycle)))
+
+        return "[" + ", ".join(filters) + "]"
+
+    def get_all_components(self, ignoreHomegrown=True, tagFilter=[], category=None, lifecycle=None, fields=["provider", "applications"]):
+        """
+        Retrieve all IT Components.
 
+        Args:
+            ignoreHomegrown (bool): Skip components used by Homegrown applications (requires "applications" in fields).
+            tagFilter (list): Optional. Tag names or IDs that must all be present, filtered server-side.
+            category (str|list): Optional. Subtype(s) to filter on, server-side.
+            lifecycle (str|list): Optional. Lifecycle phase(s) to filter on, server-side.
+            fields (list): Optional parts to retrieve: "provider", "applications". Use [] for id/name only.
+        """
+        providerStr = ""
+        if "provider" in fields:
+            providerStr = """
                             relITComponentToProvider { 
                                 edges {
                                     node {
@@ -690,7 +1106,11 @@ class LeanIXAPI:
                                     }
                                 }
                             }
+            """
 
+        applicationStr = ""
+        if "applications" in fields:
+            applicationStr = """
                             relITComponentToApplication { 
                                 edges {
                                     node {
@@ -703,12 +1123,27 @@ class LeanIXAPI:
                                     }
                                 }
                             }
+            """
+
+        query = """
+        {
+            allFactSheets(filter: {facetFilters: %s}) {
+                edges {
+                    node {
+                        ... on ITComponent {
+                            id
+                            name
+                            isOpenSource
+
+                            %s
+
+                            %s
                         }
                     }
                 }
             }
         }
-        """
+        """ % (self._facet_filters("ITComponent", category, tagFilter, lifecycle), providerStr, applicationStr)
 
         response = self._call(query)
 
@@ -756,23 +1191,120 @@ class LeanIXAPI:
 
 
 
-    def get_all_contracts(self, tagFilter = []):
+    def get_components_with_relations(self, tagFilter=[], relations=[], attributes=[]):
+        """
+        Retrieve all IT Components (with their relations) in a single query, i.e. to compare a generated structure
+        against what exists in LeanIX.
+
+        Args:
+            tagFilter (list): Optional. Tag names or IDs that must all be present, filtered server-side.
+            relations (list): Relation names to retrieve, i.e. "relParentalComponentITComponentToSubcomponentITComponent".
+            attributes (list): Optional. Additional (custom) fields of the IT Component, i.e. "osType".
+
+        Returns:
+            list: dicts with id, name, category, the attributes and per relation a list of
+                  {'relation_id', 'id', 'name', 'costTotalAnnual'}.
+        """
+        relationStr = ""
+        for relation in relations:
+            relationStr += """
+                            %s {
+                                edges {
+                                    node {
+                                        id
+                                        costTotalAnnual
+                                        factSheet {
+                                            id
+                                            name
+                                        }
+                                    }
+                                }
+                            }
+            """ % relation
+
         query = """
         {
-            allFactSheets(filter: {facetFilters: [{facetKey: "FactSheetTypes", keys: ["Contract"]}]}) {
+            allFactSheets(filter: {facetFilters: %s}) {
                 edges {
                     node {
-                        ... on Contract {
-                            id
-                            name                            
+                        id
+                        name
+                        ... on ITComponent {
+                            category
+                            %s
+
+                            %s
+                        }
+                    }
+                }
+            }
+        }
+        """ % (self._facet_filters("ITComponent", None, tagFilter), " ".join(attributes), relationStr)
+
+        response = self._call(query)
+
+        components = []
+
+        for edge in response['data']['allFactSheets']['edges']:
+            node = edge['node']
+
+            item = {
+                'id': node['id'],
+                'name': node['name'],
+                'category': node.get('category')
+            }
+
+            for attribute in attributes:
+                item[attribute] = node.get(attribute)
+
+            for relation in relations:
+                item[relation] = []
+
+                for rel in (node.get(relation) or {}).get('edges', []):
+                    if not rel['node'].get('factSheet'):
+                        continue
+
+                    item[relation].append({
+                        'relation_id': rel['node']['id'],
+                        'id': rel['node']['factSheet']['id'],
+                        'name': rel['node']['factSheet']['name'],
+                        'costTotalAnnual': rel['node'].get('costTotalAnnual')
+                    })
+
+            components.append(item)
+
+        return components
+
+    def get_all_contracts(self, tagFilter = [], category=None, lifecycle=None, fields=["externalId", "tags", "provider", "applications"]):
+        """
+        Retrieve all contracts.
+
+        Args:
+            tagFilter (list): Optional. Tag names or IDs that must all be present, filtered server-side.
+            category (str|list): Optional. Subtype(s) to filter on, server-side.
+            lifecycle (str|list): Optional. Lifecycle phase(s) to filter on, server-side.
+            fields (list): Optional parts to retrieve: "externalId", "tags", "provider", "applications". Use [] for id/name only.
+        """
+        externalIdStr = ""
+        if "externalId" in fields:
+            externalIdStr = """
                             externalId {
                                 externalId
                             }
+            """
+
+        tagStr = ""
+        if "tags" in fields:
+            tagStr = """
                             tags {
                                 id
                                 name
                             }
+            """
 
+        providerStr = ""
+        if "provider" in fields:
+            providerStr = """
                             relContractToProvider { 
                                 edges {
                                     node {
@@ -785,7 +1317,11 @@ class LeanIXAPI:
                                     }
                                 }
                             }
+            """
 
+        applicationStr = ""
+        if "applications" in fields:
+            applicationStr = """
                             relContractToApplication { 
                                 edges {
                                     node {
@@ -798,12 +1334,26 @@ class LeanIXAPI:
                                     }
                                 }
                             }
+            """
+
+        query = """
+        {
+            allFactSheets(filter: {facetFilters: %s}) {
+                edges {
+                    node {
+                        ... on Contract {
+                            id
+                            name                            
+                            %s
+                            %s
+                            %s
+                            %s
                         }
                     }
                 }
             }
         }
-        """
+        """ % (self._facet_filters("Contract", category, tagFilter, lifecycle), externalIdStr, tagStr, providerStr, applicationStr)
 
 
         response = self._call(query)
@@ -821,15 +1371,8 @@ class LeanIXAPI:
                 'applications': []
             }
 
-            theTags = set()
-            for t in edge['node']['tags']:
-                theTags.add(t['name'])
-
-            # check if all tagFilter are in theTags
-            if len(tagFilter) > 0:
-                if not all(x in theTags for x in tagFilter):
-                    print("Skipping contract (not passing filter): " + item['name'])
-                    continue            
+            if 'tags' in edge['node']:
+                item['tags'] = [t['name'] for t in edge['node']['tags']]
 
             #stamp externalId on the record
             if 'externalId' in edge['node']:
@@ -863,7 +1406,6 @@ class LeanIXAPI:
 
         return contracts
     
-
     def add_subscription(self, factsheetId, roleId, email, firstName, lastName):
         graphql_mutation = gql("""
             mutation m($user:UserInput!, $roles:[SubscriptionToSubscriptionRoleLinkInput])
@@ -1069,7 +1611,19 @@ class LeanIXAPI:
             return None
 
 
-    def get_all(self, type, specificSubtype=None, includeChildren=False, returnAsRaw=False):
+    def get_all(self, type, specificSubtype=None, includeChildren=False, returnAsRaw=False, tagFilter=[], lifecycle=None, fields=("externalId",)):
+        """
+        Retrieve all factsheets of a type.
+
+        Args:
+            type (str): The factsheet type.
+            specificSubtype (str|list): Optional. Subtype(s) to filter on, server-side.
+            includeChildren (bool): Also retrieve relToChild.
+            returnAsRaw (bool): Return the GraphQL response as is.
+            tagFilter (list): Optional. Tag names or IDs that must all be present, filtered server-side.
+            lifecycle (str|list): Optional. Lifecycle phase(s) to filter on, server-side.
+            fields (tuple|list): Optional parts to retrieve: "externalId", "alias" (only for alias_types, otherwise None). Use () for id/name only.
+        """
         childStr = ""
         if includeChildren:
             childStr = """
@@ -1085,64 +1639,50 @@ class LeanIXAPI:
                                 }
             """
 
-        if specificSubtype is None:            
-            query = """
-            {
-                allFactSheets(filter: {facetFilters: [{facetKey: "FactSheetTypes", keys: ["%s"]}]}) {
-                    edges {
-                        node {
-                            id
-                            name              
-                            ...on %s {
+        externalIdStr = ""
+        if "externalId" in fields:
+            externalIdStr = """
                                 externalId {
                                     externalId                                    
                                     comment
                                     externalUrl
                                     status
                                 }
+            """
 
-                                %s
-                            }
-
-                            ...on Application{
+        # alias is not a field of every factsheet type, selecting it on others fails validation
+        aliasStr = ""
+        if "alias" in fields and type in self.alias_types:
+            aliasStr = """
                                 alias
-                            }
-                        }
-                    }
-                }
-            }
-            """ % (type, type, childStr)
-        else:
-            query = """
-            {
-                allFactSheets(filter: {facetFilters: [
-                        {facetKey: "FactSheetTypes",  keys: ["%s"]},
-                        {facetKey: "category", keys: ["%s"]}
-                    ]
-                }) {
-                    edges {
-                        node {
-                            id
-                            name              
-                            ...on %s {
-                                externalId {
-                                    externalId                                                                      
-                                    comment
-                                    externalUrl
-                                    status                                
-                                }
+            """
 
-                                %s
-                            }
+        # an empty selection is invalid GraphQL, the fragment is only added when something is requested
+        typeStr = ""
+        if externalIdStr or childStr or aliasStr:
+            typeStr = """
+                        ...on %s {
+                            %s
 
-                            ...on Application{
-                                alias
-                            }
+                            %s
+
+                            %s
                         }
+            """ % (type, externalIdStr, childStr, aliasStr)
+
+        query = """
+        {
+            allFactSheets(filter: {facetFilters: %s}) {
+                edges {
+                    node {
+                        id
+                        name              
+                        %s
                     }
                 }
             }
-            """ % (type, specificSubtype, type, childStr)
+        }
+        """ % (self._facet_filters(type, specificSubtype, tagFilter, lifecycle), typeStr)
         
         response = self._call(query)
 
@@ -1176,6 +1716,14 @@ class LeanIXAPI:
             applications.append(item)
 
         return applications
+    def write_buffer(self, threshold=50):
+        """
+        Returns a write-behind buffer that merges patches per factsheet and sends one mutation per factsheet.
+        Flushes when {threshold} factsheets are buffered and on exit of the with-block.
+
+        See leanix/writebuffer.py for usage.
+        """
+        return FactsheetWriteBuffer(self, threshold)
 
     def create_it_component(self, name):
         return self.create_factsheet("ITComponent", name)
@@ -1184,13 +1732,8 @@ class LeanIXAPI:
         return self.create_factsheet("Application", name)
     
     
-    @retry(
-        stop=stop_after_attempt(3),  # Stop after 3 attempts
-        wait=wait_exponential(multiplier=1, min=2, max=60),  # Exponential backoff
-        retry=retry_if_exception_type(requests.exceptions.RequestException),  # Retry on any requests exceptions
-        before_sleep=before_sleep_log(logger, logging.INFO)  # Log before retrying
-    )
-    def create_contract(self, supplierName, name, description, subtype="Contract", isActive=True, isExpired=False, contractValue=0, numberOfSeats=None, volumeType="License", phasein_date=None, active_date=None, notice_date=None, eol_date=None, externalId="", externalUrl="", applicationId="", domains=[], managedByName=None, managedByEmail=None, currency="EUR", additionalTags=[]):
+    @retry()
+    def create_contract(self, supplierName, name, description, subtype="Contract", isActive=True, isExpired=False, contractValue=0, numberOfSeats=None, volumeType="License", phasein_date=None, active_date=None, notice_date=None, eol_date=None, externalId="", externalUrl="", applicationId="", domains=[], managedByName=None, managedByEmail=None, currency="EUR", additionalTags=[], providerId=None):
         # set None to ""
         if phasein_date is None:
             phasein_date = ""
@@ -1428,16 +1971,9 @@ class LeanIXAPI:
                 "value": lifecycle_value
             })
 
-        # format supplier
-        supplierName = supplierName.replace("_", " ").strip()
-
-        # Lookup provider by name
-        providerId = self.find_by_name("Provider", supplierName)
-
-    
+        # Lookup provider by name (unless resolved upfront), in the cached provider index - created if missing
         if not providerId:
-            #create new provider
-            providerId = self.create_factsheet("Provider", supplierName)
+            providerId = self.provider_resolver().resolve(supplierName)
 
         if providerId:
             patches.append({
@@ -1452,18 +1988,10 @@ class LeanIXAPI:
             "patches": patches
         }
 
-        # Set up the transport with the given headers
-        transport = RequestsHTTPTransport(
-            url=self.request_url,
-            headers=self.header,
-            use_json=True,
-            verify=False
-        )
-
-        # Create a GraphQL client
-        client = Client(transport=transport, fetch_schema_from_transport=True)
+        client = self._gql_client()
 
         # Execute the mutation with the variables
+        self._single_flight.invalidate()
         response = client.execute(mutation, variable_values=variables)
 
         return response['createFactSheet']['factSheet']['id']
@@ -1575,13 +2103,11 @@ class LeanIXAPI:
         return True
 
 
-    @retry(
-        stop=stop_after_attempt(3),  # Stop after 3 attempts
-        wait=wait_exponential(multiplier=1, min=2, max=60),  # Exponential backoff
-        retry=retry_if_exception_type(requests.exceptions.RequestException),  # Retry on any requests exceptions
-        before_sleep=before_sleep_log(logger, logging.INFO)  # Log before retrying
-    )
+    @retry()
     def upload_resource_to_factsheet(self, fact_sheet_id, file_path, document_name, document_type="documentation", description=None):
+        """
+        Uploads a document to a factsheet. file_path is either a path on disk, or the content itself (bytes).
+        """
         # Define the GraphQL mutation as a string
         graphql_mutation = """
         mutation($factSheetId: ID!, $name: String!, $description: String, $url: String, $origin: String, $documentType: String, $metadata: String, $refId: String) {
@@ -1624,8 +2150,13 @@ class LeanIXAPI:
             "variables": variables
         })
 
-        # Open the file in binary mode
-        with open(file_path, 'rb') as file:
+        # Open the file in binary mode (or wrap the in-memory content)
+        if isinstance(file_path, (bytes, bytearray)):
+            file_handle = io.BytesIO(file_path)
+        else:
+            file_handle = open(file_path, 'rb')
+
+        with file_handle as file:
             # Prepare the multipart form-data payload
             files = {
                 'file': (document_name, file, 'application/pdf'),
@@ -1637,6 +2168,7 @@ class LeanIXAPI:
 
             try:
                 # Make the POST request
+                self._single_flight.invalidate()
                 response = requests.post(self.upload_url, headers=self.header, files=files, verify=False)
             except:
                 # get HTTP error code.
@@ -1697,6 +2229,36 @@ class LeanIXAPI:
             print(f"Failed to retrieve documents. Status code: {response.status_code}")
             print(response.text)
             return None
+
+    def get_resources_for_factsheets(self, fact_sheet_ids, chunk_size=None):
+        """
+        Batched version of get_resources_for_factsheet.
+
+        Returns:
+            dict: factsheet ID -> list of documents ({'id', 'name', 'documentType'}), None if the factsheet was not found.
+        """
+        fields = """
+            id
+            documents {
+                edges {
+                    node {
+                        id
+                        name
+                        documentType
+                    }
+                }
+            }
+        """
+
+        result = {}
+
+        for fact_sheet_id, fact_sheet in self._get_factsheets_batched(fact_sheet_ids, fields, chunk_size).items():
+            if fact_sheet is None:
+                result[fact_sheet_id] = None
+            else:
+                result[fact_sheet_id] = [edge['node'] for edge in fact_sheet['documents']['edges']]
+
+        return result
         
     def delete_resource(self, document_id):
         # GraphQL mutation to delete a document
@@ -1710,6 +2272,7 @@ class LeanIXAPI:
 
         variables = {"id": document_id}
 
+        self._single_flight.invalidate()
         response = requests.post(
             self.request_url,
             json={"query": graphql_mutation, "variables": variables},
@@ -1782,6 +2345,7 @@ class LeanIXAPI:
             }
         }
 
+        self._single_flight.invalidate()
         response = requests.post(self.request_url, headers=self.header, json=json_data, verify=False)
 
         if response.status_code == 200:
@@ -1799,12 +2363,7 @@ class LeanIXAPI:
     
     
 
-    @retry(
-        stop=stop_after_attempt(3),  # Stop after 3 attempts
-        wait=wait_exponential(multiplier=1, min=2, max=60),  # Exponential backoff
-        retry=retry_if_exception_type(requests.exceptions.RequestException),  # Retry on any requests exceptions
-        before_sleep=before_sleep_log(logger, logging.INFO)  # Log before retrying
-    )
+    @retry()
     def delete_contracts_with_tag(self,theTag):
         """Delete all contract factsheets that have the 'Coupa' tag."""
         if not self._coupa_tag:
@@ -1863,14 +2422,7 @@ class LeanIXAPI:
             ]
         }
 
-        transport = RequestsHTTPTransport(
-            url=self.request_url,
-            headers=self.header,
-            use_json=True,
-            verify=False
-        )
-
-        client = Client(transport=transport, fetch_schema_from_transport=True)
+        client = self._gql_client()
 
         response = client.execute(query, variable_values=variables)
 
@@ -1895,12 +2447,7 @@ class LeanIXAPI:
 
     
 
-    @retry(
-        stop=stop_after_attempt(3),  # Stop after 3 attempts
-        wait=wait_exponential(multiplier=1, min=2, max=60),  # Exponential backoff
-        retry=retry_if_exception_type(requests.exceptions.RequestException),  # Retry on any requests exceptions
-        before_sleep=before_sleep_log(logger, logging.INFO)  # Log before retrying
-    )
+    @retry()
     def delete_factsheets_with_tag(self, factsheetType, theTag):
         """Delete all contract factsheets that have the 'Coupa' tag."""
         if not self._coupa_tag:
@@ -1959,14 +2506,7 @@ class LeanIXAPI:
             ]
         }
 
-        transport = RequestsHTTPTransport(
-            url=self.request_url,
-            headers=self.header,
-            use_json=True,
-            verify=False
-        )
-
-        client = Client(transport=transport, fetch_schema_from_transport=True)
+        client = self._gql_client()
 
         response = client.execute(query, variable_values=variables)
 
@@ -2003,25 +2543,22 @@ class LeanIXAPI:
         }
         """ % factsheet_id)
 
-        transport = RequestsHTTPTransport(
-            url=self.request_url,
-            headers=self.header,
-            use_json=True,
-            verify=False
-        )
-
-        client = Client(transport=transport, fetch_schema_from_transport=True)
+        client = self._gql_client()
 
         response = client.execute(query)
         return response['factSheet']['rev']
 
+    def get_factsheet_revisions(self, factsheet_ids, chunk_size=None):
+        """Fetch the current revision numbers of many factsheets, batched. Returns a dict of factsheet ID -> rev."""
+        factsheets = self._get_factsheets_batched(factsheet_ids, "id rev", chunk_size)
+
+        return {
+            factsheet_id: fs['rev'] if fs is not None else None
+            for factsheet_id, fs in factsheets.items()
+        }
+
 
-    @retry(
-        stop=stop_after_attempt(3),  # Stop after 3 attempts
-        wait=wait_exponential(multiplier=1, min=2, max=60),  # Exponential backoff
-        retry=retry_if_exception_type(requests.exceptions.RequestException),  # Retry on any requests exceptions
-        before_sleep=before_sleep_log(logger, logging.INFO)  # Log before retrying
-    )
+    @retry()
     def archive_factsheet(self, factsheet_id):
         """Archive a factsheet by setting its status to 'ARCHIVED'."""
 
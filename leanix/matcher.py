@@ -0,0 +1,127 @@
+from collections import deque
+
+
+class ApplicationMatcher:
+    """
+    Finds Applications mentioned in a text (i.e. a contract name/description or a hostname) in a single pass.
+
+    Names and aliases of all Applications are compiled into an Aho-Corasick automaton once, such that the cost per text
+    no longer depends on the number of Applications. Matching rules (case-insensitive):
+    - name: preceded by a space, i.e. " teams" in "microsoft teams license"
+    - name without supplier prefix: for "Microsoft Teams" and supplier "microsoft", " teams" matches as well
+    - alias: preceded and followed by a space, or directly preceded by the supplier (" microsoft o365")
+    Aliases are only considered when no name matched.
+
+    Usage:
+
+    matcher = leanix_api.application_matcher()
+    app_id = matcher.match(contract['name'], contract['supplier']) # None if no or multiple Applications match
+    """
+
+    def __init__(self, applications):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for app in applications:
+            if app.get('name'):
+                name = app['name'].lower()
+                self._add(" " + name, ('name', app['id'], None))
+
+                # supplier-prefixed names, matched without the prefix when the supplier is given
+                words = name.split(" ")
+                for i in range(1, len(words)):
+                    self._add(" " + " ".join(words[i:]), ('stripped', app['id'], " ".join(words[:i])))
+
+            if app.get('alias'):
+                self._add(" " + app['alias'].lower(), ('alias', app['id'], None))
+
+        self._build()
+
+    def _add(self, pattern, value):
+        state = 0
+
+        for ch in pattern:
+            if ch not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][ch] = len(self._goto) - 1
+
+            state = self._goto[state][ch]
+
+        self._output[state].append((len(pattern), value))
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+
+        while queue:
+            state = queue.popleft()
+
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+
+                self._fail[next_state] = self._goto[fail].get(ch, 0)
+                if self._fail[next_state] == next_state:
+                    self._fail[next_state] = 0
+
+                # states inherit the matches of their longest proper suffix
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find(self, text):
+        """
+        Returns all pattern matches in the text as list of (start, end, (kind, app id, supplier prefix)).
+        """
+        text = text.lower()
+        matches = []
+        state = 0
+
+        for i, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+
+            state = self._goto[state].get(ch, 0)
+
+            for length, value in self._output[state]:
+                matches.append((i + 1 - length, i + 1, value))
+
+        return matches
+
+    def candidates(self, text, supplier=None):
+        """
+        Returns the IDs of all Applications mentioned in the text (names first, aliases only if no name matched).
+        """
+        text = text.lower()
+        supplier = supplier.lower() if supplier is not None else None
+
+        names = []
+        aliases = []
+
+        for start, end, (kind, app_id, prefix) in self.find(text):
+            if kind == 'name':
+                names.append(app_id)
+
+            elif kind == 'stripped':
+                if supplier is not None and prefix == supplier:
+                    names.append(app_id)
+
+            elif kind == 'alias':
+                after = text[end:end + 1]
+                if after == " " or (supplier is not None and text[:start].endswith(" " + supplier)):
+                    aliases.append(app_id)
+
+        found = names if len(names) > 0 else aliases
+
+        return list(dict.fromkeys(found))
+
+    def match(self, text, supplier=None):
+        """
+        Returns the ID of the Application mentioned in the text, None if none or more than one (ambiguous) match.
+        """
+        found = self.candidates(text, supplier)
+
+        return found[0] if len(found) == 1 else None
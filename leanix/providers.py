@@ -0,0 +1,100 @@
+import re
+import threading
+
+
+class ProviderResolver:
+    """
+    Resolves supplier names to Provider factsheet IDs without a search per name.
+
+    All Providers are loaded once and indexed by normalized name (and alias, if Provider is in LeanIXAPI.alias_types).
+    Names that are not found are created, with one aliased mutation (see LeanIXAPI.create_factsheets) when resolved
+    with resolve_batch. Safe to use from multiple threads: a missing Provider is only created once.
+
+    Usage:
+
+    resolver = leanix_api.provider_resolver(normalize=CoupaAPI.harmonize_company_name)
+    ids = resolver.resolve_batch(["Acme Software B.V.", "Contoso Ltd"]) # name -> Provider ID
+    """
+
+    def __init__(self, leanix_api, normalize=None):
+        self.leanix_api = leanix_api
+        self.normalize = normalize
+
+        self._index = None
+        self._lock = threading.RLock()
+
+    def key(self, name):
+        """Normalized lookup key of a name: (optionally) harmonized, lowercase, single spaces."""
+        name = name.replace("_", " ").strip()
+
+        if self.normalize is not None:
+            # fall back to the name itself if nothing is left (i.e. "Company Ltd")
+            name = self.normalize(name) or name
+
+        return re.sub(r'\s+', ' ', name).strip().lower()
+
+    def _load(self):
+        if self._index is not None:
+            return
+
+        self._index = {}
+
+        providers = self.leanix_api.get_all("Provider", fields=["alias"])
+
+        for provider in providers:
+            self._index.setdefault(self.key(provider['name']), provider['id'])
+
+        # aliases after names, such that a name always wins over an alias of another Provider
+        for provider in providers:
+            if provider.get('alias'):
+                self._index.setdefault(self.key(provider['alias']), provider['id'])
+
+    def refresh(self):
+        with self._lock:
+            self._index = None
+            self._load()
+
+    def resolve(self, name, create=True):
+        """Returns the Provider ID for a supplier name, creating the Provider if needed (and create is set)."""
+        return self.resolve_batch([name], create).get(name)
+
+    def resolve_batch(self, names, create=True):
+        """
+        Resolves a list of supplier names locally, returns a dict of name -> Provider ID.
+        Missing Providers are created with one aliased mutation per LeanIXAPI.batch_size names (or left out when create
+        is not set, or when they could not be created).
+        """
+        with self._lock:
+            self._load()
+
+            result = {}
+            missing = {}
+
+            for name in names:
+                if name is None:
+                    continue
+
+                key = self.key(name)
+
+                if key in self._index:
+                    result[name] = self._index[key]
+                else:
+                    missing.setdefault(key, []).append(name)
+
+            if not create or len(missing) == 0:
+                return result
+
+            provider_names = {key: names_of_key[0].replace("_", " ").strip() for key, names_of_key in missing.items()}
+            created = self.leanix_api.create_factsheets("Provider", list(provider_names.values()))
+
+            for key, provider_name in provider_names.items():
+                # not indexed if it could not be created, such that a next resolve tries again
+                if created.get(provider_name) is None:
+                    continue
+
+                self._index[key] = created[provider_name]
+
+                for name in missing[key]:
+                    result[name] = self._index[key]
+
+            return result
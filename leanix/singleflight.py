@@ -0,0 +1,97 @@
+import copy
+import threading
+
+
+class SingleFlight:
+    """
+    De-duplicates identical calls that are in flight at the same time (i.e. from multiple threads).
+    The first caller of a key executes the call, concurrent callers of the same key wait for and share its result.
+
+    Optionally memoizes results while a batch is active (see memoize()), such that repeated identical
+    reads within a batch are served locally. Call invalidate() after writes to drop memoized results.
+    """
+
+    class _Flight:
+        def __init__(self, generation):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.generation = generation
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._memo = {}
+        self._memo_depth = 0
+        self._generation = 0 # incremented by invalidate(), results of reads started before are not memoized
+
+    def do(self, key, fn):
+        with self._lock:
+            if key in self._memo:
+                return copy.deepcopy(self._memo[key])
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+
+            if leader:
+                flight = self._inflight[key] = self._Flight(self._generation)
+
+        if not leader:
+            flight.done.wait()
+
+            if flight.error is not None:
+                raise flight.error
+
+            return copy.deepcopy(flight.result)
+
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+
+                if flight.error is None and self._memo_depth > 0 and flight.generation == self._generation:
+                    self._memo[key] = flight.result
+
+            flight.done.set()
+
+        # the result is shared with the memo and waiting callers, the leader gets its own copy as well
+        return copy.deepcopy(flight.result)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._memo.clear()
+
+            # reads in flight may predate the write, later callers start a new read instead of joining them
+            self._inflight.clear()
+
+    def memoize(self):
+        """
+        Context manager that memoizes results for the duration of the with-block (nesting is allowed).
+        """
+        return _Memoize(self)
+
+
+class _Memoize:
+    def __init__(self, single_flight):
+        self.single_flight = single_flight
+
+    def __enter__(self):
+        with self.single_flight._lock:
+            self.single_flight._memo_depth += 1
+
+        return self.single_flight
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self.single_flight._lock:
+            self.single_flight._memo_depth -= 1
+
+            if self.single_flight._memo_depth == 0:
+                self.single_flight._memo.clear()
+
+        return False
@@ -0,0 +1,126 @@
+import json
+import threading
+
+
+class UniquenessIndex:
+    """
+    Index of the factsheets of one type by lowercase name and (for IT Components) provider, the combination LeanIX
+    requires to be unique. Every factsheet is indexed by name only as well, for lookups without a provider.
+    Used to resolve a factsheet before creating it, such that a name that is already taken never leads to a failed
+    create/patch (and an archived duplicate).
+
+    All factsheets of the type are loaded once. Factsheets created through the index are added to it.
+    Safe to use from multiple threads: a missing factsheet is only created once.
+
+    Usage:
+
+    index = leanix_api.uniqueness_index("ITComponent")
+    fs_id = index.resolve_or_create("Storage", "paas", provider_id=MICROSOFT, alternatives=["Azure Storage"])
+    """
+
+    def __init__(self, leanix_api, type):
+        self.leanix_api = leanix_api
+        self.type = type
+
+        self._index = None
+        self._lock = threading.RLock()
+
+    def key(self, name, provider_id=None):
+        return (" ".join(name.split()).lower(), provider_id)
+
+    def _load(self):
+        if self._index is not None:
+            return
+
+        providerStr = ""
+        if self.type == "ITComponent":
+            providerStr = """
+                        ... on ITComponent {
+                            relITComponentToProvider {
+                                edges {
+                                    node {
+                                        factSheet {
+                                            id
+                                        }
+                                    }
+                                }
+                            }
+                        }
+            """
+
+        query = """
+        {
+            allFactSheets(filter: {facetFilters: [{facetKey: "FactSheetTypes", keys: [%s]}]}) {
+                edges {
+                    node {
+                        id
+                        name
+                        %s
+                    }
+                }
+            }
+        }
+        """ % (json.dumps(self.type), providerStr)
+
+        response = self.leanix_api._call(query)
+
+        self._index = {}
+
+        for edge in response['data']['allFactSheets']['edges']:
+            node = edge['node']
+
+            providers = [
+                provider['node']['factSheet']['id']
+                for provider in (node.get('relITComponentToProvider') or {}).get('edges', [])
+                if provider['node'].get('factSheet')
+            ]
+
+            # also by name only, such that a lookup without provider finds factsheets with a provider as well
+            for provider_id in providers + [None]:
+                self._index.setdefault(self.key(node['name'], provider_id), node['id'])
+
+    def refresh(self):
+        with self._lock:
+            self._index = None
+            self._load()
+
+    def find(self, name, provider_id=None, alternatives=[]):
+        """Returns the ID of the factsheet with the name (or one of the alternative names) and provider, None if none exists."""
+        with self._lock:
+            self._load()
+
+            for candidate in [name] + list(alternatives):
+                key = self.key(candidate, provider_id)
+
+                if key in self._index:
+                    return self._index[key]
+
+            return None
+
+    def resolve_or_create(self, name, subtype=None, provider_id=None, patches=None, alternatives=[]):
+        """
+        Returns (factsheet ID, created): the existing factsheet with the name (or an alternative name) and provider,
+        or a new one created with the provider relation and patches (i.e. tags) in a single mutation.
+        """
+        with self._lock:
+            factsheet_id = self.find(name, provider_id, alternatives)
+
+            if factsheet_id is not None:
+                return factsheet_id, False
+
+            patches = list(patches or [])
+
+            if provider_id is not None:
+                patches.append({
+                    "op": "add",
+                    "path": "/relITComponentToProvider/new_provider",
+                    "value": '{"factSheetId":"' + provider_id + '"}'
+                })
+
+            factsheet_id = self.leanix_api.create_factsheet(self.type, name, subtype, patches=patches)
+
+            if factsheet_id is not None:
+                self._index[self.key(name, provider_id)] = factsheet_id
+                self._index.setdefault(self.key(name), factsheet_id)
+
+            return factsheet_id, factsheet_id is not None
@@ -0,0 +1,272 @@
+import re
+import json
+import itertools
+
+
+class FactsheetWriteBuffer:
+    """
+    Write-behind buffer for the LeanIX facade.
+
+    Collects patches per factsheet and sends a single mutation per factsheet when flushed.
+    Factsheets created through the buffer are returned as a placeholder handle (i.e. "pending_3");
+    patches queued against that handle are folded into the createFactSheet mutation.
+    Handles may be used inside patch paths/values of other factsheets, they are substituted on flush.
+
+    Usage:
+
+    with leanix_api.write_buffer(threshold=50) as buffer:
+        site = buffer.create_factsheet("Representation", "www.example.com", "website")
+        buffer.add_tag_to_factsheet(site, TAG_AKAMAI)
+        buffer.modify_factsheet(site, patches)
+        buffer.create_relation_if_not_exists(site, AKAMAI_COMPONENT, "Representation", "relToRequires")
+
+        site_id = buffer.resolve(site) # flushes if needed and returns the real ID
+    """
+    _handle_counter = itertools.count(1)
+    _handle_pattern = re.compile(r'pending_\d+')
+
+    def __init__(self, leanix_api, threshold=50):
+        self.leanix_api = leanix_api
+        self.threshold = threshold
+
+        self._pending = {}  # factsheet id or handle -> buffered entry, in insertion order
+        self._resolved = {} # handle -> real factsheet id
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # work of a with-block that raised may be incomplete, it is not written
+        if exc_type is None:
+            self.flush()
+        return False
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _is_handle(self, factsheet_id):
+        return isinstance(factsheet_id, str) and factsheet_id.startswith("pending_")
+
+    def _entry(self, factsheet_id):
+        factsheet_id = self._resolved.get(factsheet_id, factsheet_id)
+
+        if factsheet_id not in self._pending:
+            self._pending[factsheet_id] = {
+                'create': None,
+                'patches': [],
+                'relations': []
+            }
+
+        return self._pending[factsheet_id]
+
+    def _check_threshold(self):
+        if self.threshold and len(self._pending) >= self.threshold:
+            self.flush()
+
+    def create_factsheet(self, type, name, subtype=None):
+        """
+        Queue the creation of a factsheet. Returns a handle that can be used as factsheet ID in this buffer.
+        """
+        handle = "pending_%d" % next(self._handle_counter)
+
+        self._entry(handle)['create'] = {
+            'type': type,
+            'name': name,
+            'subtype': subtype
+        }
+
+        return handle
+
+    def modify_factsheet(self, factsheet_id, patches):
+        self._entry(factsheet_id)['patches'].extend(patches)
+        self._check_threshold()
+
+        return factsheet_id
+
+    def add_tag_to_factsheet(self, factsheet_id, tag_id):
+        return self.modify_factsheet(factsheet_id, [
+            {
+                "op": "add",
+                "path": "/tags",
+                "value": '[{"tagId":"' + tag_id + '"}]'
+            }
+        ])
+
+    def create_relation_if_not_exists(self, source_id, target_id, on_factsheet_type, relation_name, cost=None):
+        """
+        Queue a relation from source to target. For existing factsheets the relations are read once on flush,
+        such that relations already present are not duplicated (and only their costs are updated).
+        """
+        self._entry(source_id)['relations'].append({
+            'target': target_id,
+            'type': on_factsheet_type,
+            'relation': relation_name,
+            'cost': cost
+        })
+        self._check_threshold()
+
+        return None
+
+    def resolve(self, factsheet_id):
+        """
+        Returns the real factsheet ID for a handle, flushing the buffer if the factsheet was not created yet.
+        """
+        if not self._is_handle(factsheet_id):
+            return factsheet_id
+
+        if factsheet_id not in self._resolved:
+            self.flush()
+
+        return self._resolved.get(factsheet_id)
+
+    def _substitute(self, value):
+        if not isinstance(value, str):
+            return value
+
+        return self._handle_pattern.sub(lambda m: self._resolved.get(m.group(0)) or m.group(0), value)
+
+    def _references_unresolved(self, patch, own_handle=None):
+        for value in (patch['path'], patch.get('value')):
+            if isinstance(value, str):
+                for handle in self._handle_pattern.findall(value):
+                    # a factsheet's own handle in a path is only used as key for new relations (i.e. /relToParent/new_pending_3)
+                    if handle == own_handle and value is patch['path']:
+                        continue
+                    if self._resolved.get(handle) is None:
+                        return True
+        return False
+
+    def _relation_patch(self, target_id, relation, cost, path=None, op="add"):
+        value = {"factSheetId": target_id}
+
+        if cost is not None and cost > 0:
+            value["costTotalAnnual"] = cost
+
+        return {
+            "op": op,
+            "path": path if path is not None else "/%s/new_%s" % (relation, target_id),
+            "value": json.dumps(value)
+        }
+
+    def _relation_patches(self, factsheet_id, relations, isNew):
+        patches = []
+
+        existing = {}
+
+        for rel in relations:
+            target_id = self._resolved.get(rel['target'], rel['target'])
+
+            if isNew:
+                patches.append(self._relation_patch(target_id, rel['relation'], rel['cost']))
+                continue
+
+            key = (rel['type'], rel['relation'])
+            if key not in existing:
+                existing[key] = {
+                    r['to']: r['relationship_id'] for r in self.leanix_api.get_relationship_ids(factsheet_id, rel['type'], rel['relation'])
+                }
+
+            if target_id in existing[key]:
+                if rel['cost'] is not None:
+                    path = "/%s/%s" % (rel['relation'], existing[key][target_id])
+                    patches.append(self._relation_patch(target_id, rel['relation'], rel['cost'], path=path, op="replace"))
+            else:
+                patches.append(self._relation_patch(target_id, rel['relation'], rel['cost']))
+
+        return patches
+
+    def merge_patches(self, patches):
+        """
+        Merges a list of patches into the smallest equivalent list:
+        - replace/remove on the same path: last one wins
+        - all "add /tags" patches are combined into one
+        - identical patches are only sent once
+        """
+        merged = []
+        positions = {}
+        tag_ids = []
+        tag_position = None
+
+        for patch in patches:
+            op = patch['op']
+            path = patch['path']
+
+            if op == "add" and path == "/tags":
+                try:
+                    tags = json.loads(patch['value'])
+                except (TypeError, ValueError):
+                    tags = None
+
+                if isinstance(tags, list):
+                    if tag_position is None:
+                        tag_position = len(merged)
+                        merged.append(None)
+
+                    for tag in tags:
+                        if tag.get('tagId') not in tag_ids:
+                            tag_ids.append(tag.get('tagId'))
+                    continue
+
+            if op in ("replace", "remove"):
+                key = ("set", path)
+            else:
+                key = (op, path, json.dumps(patch.get('value'), sort_keys=True))
+
+            if key in positions:
+                merged[positions[key]] = patch
+            else:
+                positions[key] = len(merged)
+                merged.append(patch)
+
+        if tag_position is not None:
+            merged[tag_position] = {
+                "op": "add",
+                "path": "/tags",
+                "value": json.dumps([{"tagId": t} for t in tag_ids])
+            }
+
+        return merged
+
+    def flush(self):
+        """
+        Sends all buffered work: one createFactSheet per new factsheet, one updateFactSheet per modified factsheet.
+        Entries are dropped once sent, if a mutation raises the unsent work stays buffered.
+        """
+        if len(self._pending) == 0:
+            return
+
+        pending = list(self._pending.items())
+
+        deferred = {}
+
+        # create new factsheets first (in order of creation), folding their patches into the create mutation
+        for handle, entry in pending:
+            if entry['create'] is None:
+                continue
+
+            patches = []
+            for patch in entry['patches'] + self._relation_patches(handle, entry['relations'], isNew=True):
+                if self._references_unresolved(patch, own_handle=handle):
+                    deferred.setdefault(handle, []).append(patch)
+                else:
+                    patches.append(dict(patch, path=self._substitute(patch['path']), value=self._substitute(patch.get('value'))))
+
+            create = entry['create']
+            self._resolved[handle] = self.leanix_api.create_factsheet(create['type'], create['name'], create['subtype'], patches=self.merge_patches(patches))
+
+            # what is left of a created factsheet are the patches that referenced factsheets created after it
+            entry['create'] = None
+            entry['patches'] = deferred.get(handle, [])
+            entry['relations'] = []
+
+        # then patch existing factsheets (and new ones that referenced factsheets created after them)
+        for factsheet_id, entry in pending:
+            patches = entry['patches'] + self._relation_patches(factsheet_id, entry['relations'], isNew=False)
+            target_id = self._resolved.get(factsheet_id, factsheet_id) if self._is_handle(factsheet_id) else factsheet_id
+
+            if target_id is not None and len(patches) > 0:
+                patches = [dict(p, path=self._substitute(p['path']), value=self._substitute(p.get('value'))) for p in patches]
+
+                self.leanix_api.modify_factsheet(target_id, self.merge_patches(patches))
+
+            del self._pending[factsheet_id]